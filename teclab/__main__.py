@@ -1,16 +1,37 @@
+import time
+t_start = time.perf_counter()
+
 import logging
 import os
+import argparse
 import datetime
 
-from teclab.app import App
+from teclab import config
+
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="TEC Label Creator")
+    parser.add_argument('--data-dir', help=f"dataset directory, overrides ${config.DATA_DIR_ENV}")
+    parser.add_argument('--server', metavar='HOST:PORT',
+                        help="label through a teclab.server instead of directly, the authkey comes from "
+                             "$TECLAB_AUTHKEY or the server's server.key copied into the dataset directory")
+    parser.add_argument('--annotator', help="name recorded with saves made through the server")
+    args = parser.parse_args()
+    if args.data_dir:
+        config.set_data_dir(args.data_dir)
 
-date_string = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-log_fn = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'logs', f'{date_string}_info.log'))
-logging.basicConfig(filename=log_fn,
-                    level=logging.INFO,
-                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-                    filemode='w')
+    date_string = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    log_fn = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'logs', f'{date_string}_info.log'))
+    os.makedirs(os.path.dirname(log_fn), exist_ok=True)
+    logging.basicConfig(filename=log_fn,
+                        level=logging.INFO,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+                        filemode='w')
 
-app = App()
-app.start()
+    from teclab.app import App
+    backend = None
+    if args.server:
+        from teclab import server, backend as backends
+        backend = backends.RemoteBackend(server.parse_address(args.server), annotator=args.annotator)
+    app = App(backend)
+    app.start(t_start)
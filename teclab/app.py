@@ -1,18 +1,34 @@
 from PyQt5.QtWidgets import QApplication
-import numpy as np
+from PyQt5 import QtCore
+import os
+import time
 import logging
+import threading
 
 from teclab.gui import Gui
 from teclab import config
+from teclab import sampling
+from teclab import prefetch
+from teclab import sequential
 from teclab import utils
+from teclab import prelabel
+from teclab import instrument
+from teclab import backend as backends
 
 logger = logging.getLogger(__name__)
 
 
 class App:
+    """
+    Parameters
+    ----------
+    backend: LocalBackend or RemoteBackend
+        see `teclab.backend`, local by default
+    """
 
-    def __init__(self):
+    def __init__(self, backend=None):
         logger.info("Initializing App class")
+        self.backend = backend if backend is not None else backends.LocalBackend()
         self.gui = None
         self.current_map = {
             'year': None,
@@ -23,49 +39,260 @@ class App:
             'h5_file': None,
         }
         self.tec_map = None
+        self.cross_section_params = {
+            'avg_width': config.cross_section_avg_width,
+            'median_width': config.cross_section_median_width,
+        }
+        self.cross_sections = None
+        self.sampling_strategy = sampling.Uniform()
+        self.prefetcher = None
+        # sequential mode: step through the maps in time order instead of sampling them
+        self.sequential = False
+        self.carry_labels = True
+        self.navigator = None
+        # set from the GUI, see `set_max_empty_fraction`
+        self.max_empty_fraction = None
 
     @property
     def map_indicator(self):
         return f"{self.current_map['datetime']} ({self.current_map['year']}, {self.current_map['month']}, {self.current_map['index']})"
 
-    def start(self):
+    def start(self, t_start=None):
+        """Show the window and run the event loop. The map index, progress and first maps are loaded once the
+        window is up.
+
+        Parameters
+        ----------
+        t_start: float
+            `time.perf_counter()` at process start, used to report the time to first window
+        """
         logger.info("Starting App")
         app = QApplication([])
+        instrument.session.profile_dir = os.path.join(config.cache_dir, "profiles")
         self.gui = Gui(self)
+        QtCore.QTimer.singleShot(0, lambda: self._window_shown(t_start))
         app.exec_()
+        if self.prefetcher is not None:
+            self.prefetcher.shutdown()
+        if self.navigator is not None:
+            self.navigator.shutdown()
+        self.gui.draw_img.close_journal()
+        self.backend.close()
+        logger.info(f"Session timings:\n{instrument.session.format_summary()}")
+
+    def _window_shown(self, t_start):
+        if t_start is not None:
+            seconds = time.perf_counter() - t_start
+            instrument.session.record('startup.first_window', seconds)
+            logger.info(f"Time to first window: {seconds:.2f} s")
+            self.gui.status_bar.showMessage(f"Started in {seconds:.2f} s, loading the dataset index")
+        threading.Thread(target=self._load_dataset, name="DatasetLoader", daemon=True).start()
+
+    def _load_dataset(self):
+        """Build the map index, progress store and sampler off the GUI thread, `_dataset_loaded` runs on the GUI
+        thread once they are ready."""
+        try:
+            with instrument.span('startup.dataset'):
+                self.backend.sampler
+        except Exception as e:
+            logger.exception("Failed to load the dataset")
+            self.gui.dataset_loaded.emit(f"Failed to load the dataset: {e}")
+            return
+        self.gui.dataset_loaded.emit("")
+
+    def _dataset_loaded(self, error):
+        if error:
+            self.gui.status_bar.showMessage(error)
+            return
+        if self.max_empty_fraction is not None:
+            self._apply_max_empty_fraction()
+        with instrument.span('startup.prefetcher'):
+            self.prefetcher = prefetch.Prefetcher(self.backend.sampler, self.load_map, config.prefetch_depth,
+                                                  self.sampling_strategy)
+            self.prefetcher.fill()
+        self.gui.status_bar.showMessage("Dataset loaded")
 
+    @instrument.timed()
     def map_save(self):
+        """Snapshot the labels and update the in-memory state, the labels and progress are persisted in the
+        background and the outcome is reported in the status bar."""
         if self.tec_map is None:
             logger.info("No map to save")
             return
         logger.info(f"Saving map: {self.current_map}")
+        current_map = dict(self.current_map)
         labels = self.gui.get_labels()
-        utils.update_h5(self.current_map, labels)
-        utils.update_done_list(config.done_list_file, config.done_list, self.current_map)
-        utils.update_unsure_list(config.unsure_list_file, config.unsure_list, self.current_map)
-        import matplotlib.pyplot as plt
-        fig = plt.figure()
-        ax = fig.add_subplot(projection='polar')
-        ax.pcolormesh(config.theta_grid, config.radius_grid, labels, shading='auto')
-        plt.show()
+        journal = self.gui.draw_img.journal
+        n_ops = 0 if journal is None else journal.n_ops
+        saved = self.backend.save(current_map, labels)
+        if self.navigator is not None:
+            self.navigator.invalidate(current_map['year'], current_map['month'], current_map['index'])
+        saved.add_done_callback(lambda future: self._save_finished(current_map, future, journal, n_ops))
+        self.gui.show_label_preview(labels)
+
+    def _save_finished(self, current_map, future, journal=None, n_ops=0):
+        map_id = (int(current_map['year']), int(current_map['month']), int(current_map['index']))
+        try:
+            future.result()
+        except Exception as e:
+            logger.exception(f"Failed to save map {map_id}")
+            self.gui.save_finished.emit(f"Save FAILED for {map_id}: {e}")
+            return
+        logger.info(f"Saved map {map_id}")
+        if journal is not None:
+            self.gui.journal_saved.emit(journal, n_ops)
+        self.gui.save_finished.emit(f"Saved {map_id}")
+
+    def _journal_saved(self, journal, n_ops):
+        # a journal which was closed before its save finished keeps its file, `start_journal` discards it once the
+        # saved labels no longer match its base
+        if self.gui.draw_img.journal is journal:
+            journal.mark_saved(n_ops)
 
+    @instrument.timed()
     def map_next(self):
-        year, month, index, datetime = self.get_next_map()
-        self.current_map.update(year=year, month=month, index=index, datetime=datetime,
-                                h5_file=config.data_file_name.format(year=year, month=month))
+        if self.sequential:
+            return self.map_step(1)
+        if self.prefetcher is None:
+            return
+        try:
+            key, entry = self.prefetcher.pop()
+        except LookupError as e:
+            logger.info(str(e))
+            self.gui.status_bar.showMessage(str(e))
+            return
+        except Exception as e:
+            logger.exception("Skipping a map which couldn't be loaded")
+            self.gui.status_bar.showMessage(f"{e}, skipped it")
+            return
+        self.show_map(key, entry)
+
+    def map_previous(self):
+        if self.sequential:
+            self.map_step(-1)
+
+    @instrument.timed()
+    def map_step(self, offset):
+        """Move `offset` hours in sequential mode. Stepping forward onto an unlabeled map starts it from the
+        labels of the map being left if `carry_labels` is set."""
+        if self.navigator is None:
+            return
+        carried = None
+        if offset == 1 and self.carry_labels and self.tec_map is not None:
+            carried = self.gui.get_labels()
+        try:
+            key, entry = self.navigator.step(offset)
+        except LookupError as e:
+            logger.info(str(e))
+            self.gui.status_bar.showMessage(str(e))
+            return
+        except Exception as e:
+            logger.exception("Skipping a map which couldn't be loaded")
+            self.gui.status_bar.showMessage(f"{e}, skipped it")
+            return
+        self.show_map(key, entry, carried)
+
+    def show_map(self, key, entry, carried=None):
+        """Make a prepared map (see `load_map`) the current map. The drawing layer starts from the saved labels
+        if the map has been labeled, otherwise from `carried` or the proposal."""
+        year, month, index, datetime = key
+        self.current_map.update(year=year, month=month, index=index, datetime=datetime, h5_file=entry['h5_file'])
         logger.info(f"Getting next map: {self.current_map}")
-        self.tec_map, *_ = utils.open_map(self.current_map)
+        self.tec_map = entry['tec_map']
+        if entry['cross_section_params'] == self.cross_section_params:
+            self.cross_sections = entry['cross_sections']
+        else:
+            self.update_cross_sections()
+        status = self.backend.sampler.get_status(year, month, index)
+        labels = entry['labels'] if status != sampling.UNLABELED else carried
         self.gui.update_map_indicator()
-        self.gui.update_tec_map(reset=True)
-
-    @staticmethod
-    def get_next_map():
-        year = np.random.choice(list(config.map_tree.keys()))
-        month = np.random.choice(list(config.map_tree[year].keys()))
-        index = np.random.choice(list(config.map_tree[year][month]['index']))
-        while (year, month, index) in config.done_list + config.unsure_list:
-            year = np.random.choice(list(config.map_tree.keys()))
-            month = np.random.choice(list(config.map_tree[year].keys()))
-            index = np.random.choice(list(config.map_tree[year][month]['index']))
-        datetime = config.map_tree[year][month]['datetime'][index]
-        return year, month, index, datetime
+        self.gui.update_tec_map(reset=True, prepared=entry['prepared'], proposal=entry['proposal'], labels=labels,
+                                unsure=status == sampling.UNSURE, journal=self.journal_path(year, month, index),
+                                color_range=entry['color_range'])
+
+    def journal_path(self, year, month, index):
+        """Stroke journal file of a map, see `strokes.StrokeJournal`."""
+        os.makedirs(config.journal_dir, exist_ok=True)
+        return os.path.join(config.journal_dir, f"{int(year):04d}_{int(month):02d}_{int(index):04d}.jsonl")
+
+    @instrument.timed()
+    def load_map(self, year, month, index, datetime):
+        """Read and pre-render a map, runs on the prefetch thread."""
+        h5_file = config.data_file_name.format(year=year, month=month)
+        tec_map, labels = self.backend.load(year, month, index)
+        cross_section_params = dict(self.cross_section_params)
+        color_range = None
+        if config.map_stats is not None:
+            color_range = config.map_stats.color_range(year, month, index, config.auto_color_percentiles)
+        return {
+            'h5_file': h5_file,
+            'tec_map': tec_map,
+            'labels': labels,
+            'color_range': color_range,
+            'prepared': self.gui.tec_map_img.prepare(tec_map, **self.gui.color_params(color_range)),
+            'cross_sections': utils.cross_section_profiles(tec_map, **cross_section_params),
+            'cross_section_params': cross_section_params,
+            'proposal': prelabel.read_proposal(config.proposal_dir, year, month, index),
+        }
+
+    def set_cross_section_param(self, name, value):
+        self.cross_section_params[name] = value
+        self.update_cross_sections()
+
+    def update_cross_sections(self):
+        if self.tec_map is not None:
+            self.cross_sections = utils.cross_section_profiles(self.tec_map, **self.cross_section_params)
+
+    def set_sampling_strategy(self, name):
+        logger.info(f"Sampling strategy: {name}")
+        self.sampling_strategy = sampling.STRATEGIES[name]()
+        if self.prefetcher is not None:
+            self.prefetcher.set_strategy(self.sampling_strategy)
+
+    def set_sequential(self, enabled):
+        """Switch between sampling maps and stepping through them in time order, starting from the current map
+        or the earliest unlabeled one."""
+        logger.info(f"Sequential mode: {enabled}")
+        if self.navigator is not None:
+            self.navigator.shutdown()
+            self.navigator = None
+        self.sequential = False
+        if not enabled:
+            return
+        if not isinstance(self.backend, backends.LocalBackend):
+            self.gui.status_bar.showMessage("Sequential mode needs a local dataset")
+            return
+        sampler = self.backend.sampler
+        window = sequential.MapWindow(config.map_cache, config.data_file_name, sampler, config.sequential_behind,
+                                      config.sequential_ahead)
+        self.navigator = sequential.SequentialNavigator(sampler, self.load_map, window, config.prefetch_depth)
+        if self.current_map['year'] is not None:
+            self.navigator.seek(self.current_map['year'], self.current_map['month'], self.current_map['index'])
+        else:
+            self.navigator.seek()
+        self.sequential = True
+        if self.current_map['year'] is None:
+            self.map_step(0)
+
+    def set_max_empty_fraction(self, value):
+        """Leave maps with a larger fraction of NaN cells out of sampling, using the map statistics. While the
+        dataset is loading the value is only kept, `_dataset_loaded` applies it."""
+        self.max_empty_fraction = value
+        if self.prefetcher is not None:
+            self._apply_max_empty_fraction()
+
+    def _apply_max_empty_fraction(self):
+        value = self.max_empty_fraction
+        if config.map_stats is None or not isinstance(self.backend, backends.LocalBackend):
+            self.gui.status_bar.showMessage("Filtering empty maps needs the map statistics of a local dataset, "
+                                            "see python -m teclab.stats")
+            return
+        sampler = self.backend.sampler
+        sampler.set_excluded(config.map_stats.nan_fraction(sampler) > value)
+        logger.info(f"Excluded {int(sampler.excluded.sum())} maps more than {value:.0%} empty from sampling")
+        if self.prefetcher is not None:
+            self.prefetcher.clear()
+            self.prefetcher.fill()
+
+    def get_next_map(self):
+        return self.backend.sampler.sample(self.sampling_strategy)
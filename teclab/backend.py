@@ -0,0 +1,110 @@
+"""Where the app gets maps from and saves labels to.
+
+`LocalBackend` owns the dataset directory through `teclab.config` (a single annotator), `RemoteBackend` is a thin
+client of a `teclab.server.LabelServer` shared by several annotators. Both provide
+
+- `sampler`: drawn from by the `Prefetcher`, `sample(strategy)` and `get_status(year, month, index)`
+- `load(year, month, index)`: the TEC map and its saved labels, called from the prefetch thread
+- `save(current_map, labels)`: returns a Future which is done once the labels and progress are on disk
+- `close()`
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from teclab import config
+from teclab import sampling
+from teclab import instrument
+
+logger = logging.getLogger(__name__)
+
+
+class LocalBackend:
+
+    def __init__(self):
+        self.save_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="MapSave")
+
+    @property
+    def sampler(self):
+        return config.map_sampler
+
+    def load(self, year, month, index):
+        tec_map, labels, _ = config.map_cache.get(config.data_file_name.format(year=year, month=month), index)
+        return tec_map, labels
+
+    def save(self, current_map, labels):
+        """Update the in-memory state right away, the labels and progress are persisted in the background."""
+        config.map_cache.update_labels(current_map['h5_file'], current_map['index'], labels)
+        status = sampling.UNSURE if current_map['unsure'] else sampling.DONE
+        config.map_sampler.set_status(current_map['year'], current_map['month'], current_map['index'], status)
+        write = config.label_writer.submit(current_map, labels)
+        return self.save_executor.submit(self._persist, current_map, write)
+
+    @staticmethod
+    def _persist(current_map, write):
+        with instrument.span('App.persist'):
+            write.result()
+            config.progress_store.record(current_map)
+
+    def close(self):
+        self.save_executor.shutdown(wait=True)
+        logger.info("Flushing queued label writes")
+        config.label_writer.close()
+
+
+class LeaseSampler:
+    """Sampler facade of a `LabelClient`, every sample is a lease on the server. Statuses are only known for
+    maps saved through this client, leased maps can't be labeled by anyone else in the meantime."""
+
+    def __init__(self, client):
+        self.client = client
+        self._status = {}
+
+    def sample(self, strategy=None):
+        return self.client.lease(strategy)
+
+    def get_status(self, year, month, index):
+        return self._status.get((int(year), int(month), int(index)), sampling.UNLABELED)
+
+    def set_status(self, year, month, index, status):
+        self._status[(int(year), int(month), int(index))] = status
+
+    def release(self, year, month, index):
+        self.client.release(year, month, index)
+
+    def exclude(self, year, month, index):
+        """Keep the lease of a map which couldn't be loaded instead of releasing it, so the server doesn't hand it
+        out again until the lease times out."""
+
+
+class RemoteBackend:
+    """Maps and saves go through a labeling server.
+
+    Parameters
+    ----------
+    address: tuple
+        (host, port) of the server
+    authkey: bytes
+    annotator: str
+    """
+
+    def __init__(self, address, authkey=None, annotator=None):
+        from teclab.server import LabelClient
+        self.client = LabelClient(address, authkey, annotator)
+        self.sampler = LeaseSampler(self.client)
+        self.save_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="MapSave")
+
+    def load(self, year, month, index):
+        return self.client.get_map(year, month, index)
+
+    def save(self, current_map, labels):
+        status = sampling.UNSURE if current_map['unsure'] else sampling.DONE
+        self.sampler.set_status(current_map['year'], current_map['month'], current_map['index'], status)
+        return self.save_executor.submit(self._persist, dict(current_map), labels)
+
+    def _persist(self, current_map, labels):
+        with instrument.span('App.persist'):
+            self.client.save(current_map, labels)
+
+    def close(self):
+        self.save_executor.shutdown(wait=True)
+        self.client.close()
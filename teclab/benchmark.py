@@ -0,0 +1,219 @@
+"""Benchmarks of the hot paths on a synthetic dataset, no real archive or display needed.
+
+    python -m teclab.benchmark [--size small] [--out results.json] [--baseline test/benchmark_baseline.json]
+
+Results are written as JSON (median, min and mean seconds per call of every benchmark). With `--baseline`, the
+medians are compared with a previous result file and the exit code is 1 if any benchmark got slower than the
+baseline by more than `--tolerance`. `--save-baseline FILE` stores the results as a new baseline.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import platform
+import argparse
+import logging
+
+import numpy as np
+import h5py
+
+from teclab import utils
+from teclab import synthetic
+from teclab import sampling
+from teclab import dataset_index
+
+logger = logging.getLogger(__name__)
+
+SIZES = {
+    'tiny': {'months': 1, 'shape': (20, 36), 'n_maps': 24, 'repeat': 3},
+    'small': {'months': 2, 'shape': (60, 180), 'n_maps': 120, 'repeat': 20},
+    'large': {'months': 12, 'shape': (60, 180), 'n_maps': None, 'repeat': 50},
+}
+LABELED_FRACTIONS = [0, .5, .9, .99]
+
+
+def timeit(func, repeat, setup=None):
+    """Wall time of `repeat` calls of `func`, `setup` (untimed) runs before every call and its return value is
+    passed on to `func`.
+
+    Returns
+    -------
+    list of float
+        seconds
+    """
+    times = []
+    for _ in range(repeat):
+        args = () if setup is None else (setup(), )
+        t0 = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - t0)
+    return times
+
+
+def _summary(times):
+    return {'median': float(np.median(times)), 'min': float(np.min(times)), 'mean': float(np.mean(times)),
+            'n': len(times)}
+
+
+def _qt_app():
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    import pyqtgraph as pg
+    return pg.mkQApp()
+
+
+def run_benchmarks(data_dir, repeat=20, seed=0):
+    """Time the hot paths on the dataset in `data_dir`, see `synthetic.generate_dataset`.
+
+    Returns
+    -------
+    results: dict
+        benchmark name -> summary of the timings
+    """
+    rng = np.random.default_rng(seed)
+    results = {}
+    file_name = os.path.join(data_dir, "{year:04d}_{month:02d}_tec.h5")
+    index_file = os.path.join(data_dir, dataset_index.INDEX_FILE_NAME)
+
+    def remove_index():
+        if os.path.exists(index_file):
+            os.remove(index_file)
+
+    results['get_map_tree_cold'] = _summary(timeit(lambda _: utils.get_map_tree(data_dir), max(repeat // 5, 1),
+                                                   remove_index))
+    results['get_map_tree'] = _summary(timeit(lambda: utils.get_map_tree(data_dir), repeat))
+    map_tree = utils.get_map_tree(data_dir)
+    sampler = sampling.MapSampler(map_tree, seed=seed)
+    n_maps = sampler.status.shape[0]
+
+    def random_map():
+        year, month, index, datetime = sampler.key(int(rng.integers(n_maps)))
+        return {'year': year, 'month': month, 'index': index, 'datetime': datetime, 'unsure': False,
+                'h5_file': file_name.format(year=year, month=month)}
+
+    results['open_map'] = _summary(timeit(utils.open_map, repeat, random_map))
+    tec_map, labels, _ = utils.open_map(random_map())
+    results['update_h5'] = _summary(timeit(lambda current_map: utils.update_h5(current_map, labels), repeat,
+                                           random_map))
+    for fraction in LABELED_FRACTIONS:
+        done = rng.permutation(n_maps)[:int(fraction * n_maps)]
+        labeled = sampling.MapSampler(map_tree, [sampler.key(int(flat))[:3] for flat in done], seed=seed)
+        strategy = sampling.Uniform()
+        results[f'get_next_map[labeled={fraction}]'] = _summary(timeit(lambda: labeled.sample(strategy), repeat))
+    avg_width, median_width = 7, 3
+    results['cross_sections'] = _summary(timeit(
+        lambda: utils.cross_section_profiles(tec_map, avg_width, median_width), repeat))
+
+    qt_app = _qt_app()
+    from teclab import image_items
+    with h5py.File(os.path.join(data_dir, "grid.h5"), 'r') as f:
+        mlt_vals, mlat_vals = f['mlt'][()], f['mlat'][()]
+    theta_grid, radius_grid = np.meshgrid(np.pi * (mlt_vals - 6) / 12, 90 - mlat_vals)
+    t0 = time.perf_counter()
+    tec_map_img = image_items.TecMapImageItem(theta_grid, radius_grid)
+    results['TecMapImageItem.__init__'] = _summary([time.perf_counter() - t0])
+    results['TecMapImageItem.update_and_get_pixels'] = _summary(timeit(
+        lambda: tec_map_img.update_and_get_pixels(tec_map, vmin=0, vmax=20), repeat))
+    draw_img = image_items.DrawingImage('r', tec_map_img)
+    width, height = draw_img.image.shape[:2]
+    for _ in range(20):
+        draw_img.draw_segment(tuple(rng.integers(width, size=2)), tuple(rng.integers(height, size=2)))
+    results['DrawingImage.get_labels'] = _summary(timeit(draw_img.get_labels, repeat))
+    results['startup.first_window'] = _summary([first_window_time(data_dir, qt_app)])
+    return results
+
+
+def first_window_time(data_dir, qt_app):
+    """Seconds from creating the `App` until its window is shown, with `teclab.config` on `data_dir`."""
+    from teclab import config
+    previous = config.get_config().data_base_dir
+    config.set_data_dir(data_dir)
+    try:
+        t0 = time.perf_counter()
+        from teclab.app import App
+        from teclab.gui import Gui
+        app = App()
+        app.gui = Gui(app)
+        qt_app.processEvents()
+        seconds = time.perf_counter() - t0
+        app.gui.close()
+        app.backend.close()
+    finally:
+        config.set_data_dir(previous)
+    return seconds
+
+
+def compare(results, baseline, tolerance=1.):
+    """Benchmarks whose median is more than `tolerance` (relative) above the baseline median.
+
+    Returns
+    -------
+    list
+        (name, baseline median, median) of the regressions
+    """
+    regressions = []
+    for name, summary in results.items():
+        if name in baseline:
+            if summary['median'] > baseline[name]['median'] * (1 + tolerance):
+                regressions.append((name, baseline[name]['median'], summary['median']))
+    return regressions
+
+
+def run(size='small', data_dir=None, seed=0):
+    """Generate a synthetic dataset of `size` (in a temporary directory unless `data_dir` is given) and run the
+    benchmarks on it.
+
+    Returns
+    -------
+    dict
+        'meta' and 'results'
+    """
+    params = SIZES[size]
+    tmp_dir = None
+    if data_dir is None:
+        tmp_dir = data_dir = tempfile.mkdtemp(prefix="teclab_benchmark_")
+    try:
+        synthetic.generate_dataset(data_dir, synthetic.month_range(2012, 1, params['months']), params['shape'],
+                                   params['n_maps'], labeled_fraction=.1, seed=seed)
+        results = run_benchmarks(data_dir, params['repeat'], seed)
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    meta = {'size': size, 'python': sys.version.split()[0], 'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+    return {'meta': meta, 'results': results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark teclab on a synthetic dataset")
+    parser.add_argument('--size', choices=list(SIZES), default='small')
+    parser.add_argument('--data-dir', help="where to generate the dataset, a temporary directory by default")
+    parser.add_argument('--out', help="write the results to this JSON file")
+    parser.add_argument('--baseline', help="compare with this result file")
+    parser.add_argument('--tolerance', type=float, default=1., help="allowed relative slowdown")
+    parser.add_argument('--save-baseline', metavar='FILE', help="write the results as a new baseline")
+    args = parser.parse_args(argv)
+
+    output = run(args.size, args.data_dir)
+    for name, summary in output['results'].items():
+        print(f"{name:45s} {summary['median'] * 1e3:10.3f} ms")
+    for fn in [args.out, args.save_baseline]:
+        if fn:
+            with open(fn, 'w') as f:
+                json.dump(output, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['meta'].get('size') != args.size:
+            print(f"warning: baseline was run with size {baseline['meta'].get('size')}")
+        regressions = compare(output['results'], baseline['results'], args.tolerance)
+        for name, before, after in regressions:
+            print(f"REGRESSION {name}: {before * 1e3:.3f} ms -> {after * 1e3:.3f} ms")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,174 @@
+import threading
+import logging
+from collections import OrderedDict
+
+import numpy as np
+
+from teclab import utils
+from teclab import instrument
+
+logger = logging.getLogger(__name__)
+
+
+class MapCache:
+    """Bounded LRU cache of decoded maps keyed by (h5 file, index).
+
+    A miss reads the requested map together with `neighbours` maps on either side in a single hyperslab read,
+    so stepping to an adjacent map is served from memory. Entries are evicted least recently used first once
+    the total size of the cached arrays exceeds `max_bytes`.
+
+    Parameters
+    ----------
+    max_bytes: int
+        memory budget for cached arrays
+    neighbours: int
+        number of maps on each side of a missed index to read along with it
+    pending_labels: callable
+        optional `(fn, index) -> labels or None` giving saved labels which haven't reached the h5 file yet,
+        see `LabelWriter.pending_labels`
+    write_generation: callable
+        optional `fn -> int` which changes whenever labels are written to `fn`, see `LabelWriter.generation`.
+        A block read while a write finished is read again.
+    """
+
+    def __init__(self, max_bytes=256 * 2 ** 20, neighbours=1, pending_labels=None, write_generation=None):
+        self.max_bytes = max_bytes
+        self.neighbours = neighbours
+        self.pending_labels = pending_labels
+        self.write_generation = write_generation
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return (key[0], int(key[1])) in self._entries
+
+    def get_map(self, current_map):
+        """Same return values as `utils.open_map` but served from the cache when possible.
+
+        Parameters
+        ----------
+        current_map: dict
+
+        Returns
+        -------
+        tec, labels: numpy.ndarray (mlat, mlt)
+        start_time: float
+        """
+        return self.get(current_map['h5_file'], current_map['index'])
+
+    def get(self, fn, index):
+        """Get map `index` of h5 file `fn`, reading it (and its neighbours) from disk on a miss.
+
+        Parameters
+        ----------
+        fn: str
+        index: int
+
+        Returns
+        -------
+        tec, labels: numpy.ndarray (mlat, mlt)
+        start_time: float
+        """
+        key = (fn, int(index))
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                instrument.count('MapCache.hit')
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            self.misses += 1
+        instrument.count('MapCache.miss')
+        self.load_block(fn, key[1] - self.neighbours, key[1] + self.neighbours + 1)
+        with self._lock:
+            if key in self._entries:
+                return self._entries[key]
+        raise IndexError(f"map {index} not found in {fn}")
+
+    def load_block(self, fn, start, stop):
+        """Read maps `start:stop` of h5 file `fn` with one hyperslab read and add them to the cache. Maps
+        which are already cached are left untouched so that unsaved label updates are not overwritten.
+
+        Parameters
+        ----------
+        fn: str
+        start, stop: int
+        """
+        start = max(int(start), 0)
+        while True:
+            generation = None if self.write_generation is None else self.write_generation(fn)
+            tec, labels, start_time = utils.read_maps(fn, start, int(stop))
+            logger.debug(f"Read maps {start}:{start + start_time.shape[0]} from {fn}")
+            with self._lock:
+                keys = [(fn, start + i) for i in range(start_time.shape[0])]
+                pending = [None if self.pending_labels is None or key in self._entries else self.pending_labels(*key)
+                           for key in keys]
+                if generation is not None and self.write_generation(fn) != generation:
+                    # labels reached the file during the read and are no longer returned by `pending_labels`
+                    logger.debug(f"Labels were written to {fn} during the read, reading again")
+                    continue
+                for i, key in enumerate(keys):
+                    if key in self._entries:
+                        continue
+                    map_labels = pending[i]
+                    if map_labels is None:
+                        map_labels = np.ascontiguousarray(labels[:, :, i])
+                    self._insert(key, (np.ascontiguousarray(tec[:, :, i]), map_labels, start_time[i]))
+                return
+
+    def update_labels(self, fn, index, labels):
+        """Replace the cached labels of a map after they have been saved, no-op if the map isn't cached.
+
+        Parameters
+        ----------
+        fn: str
+        index: int
+        labels: numpy.ndarray (mlat, mlt)
+        """
+        key = (fn, int(index))
+        with self._lock:
+            if key not in self._entries:
+                return
+            entry = self._entries.pop(key)
+            self.nbytes -= self._entry_nbytes(entry)
+            tec, _, start_time = entry
+            self._insert(key, (tec, np.array(labels, dtype=bool), start_time))
+
+    def invalidate(self, fn, index=None):
+        """Drop a single map or, if `index` is None, every map of an h5 file.
+
+        Parameters
+        ----------
+        fn: str
+        index: int
+        """
+        with self._lock:
+            if index is None:
+                keys = [key for key in self._entries if key[0] == fn]
+            else:
+                keys = [(fn, int(index))]
+            for key in keys:
+                if key in self._entries:
+                    self.nbytes -= self._entry_nbytes(self._entries.pop(key))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def _insert(self, key, entry):
+        self._entries[key] = entry
+        self.nbytes += self._entry_nbytes(entry)
+        while self.nbytes > self.max_bytes and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            self.nbytes -= self._entry_nbytes(evicted)
+
+    @staticmethod
+    def _entry_nbytes(entry):
+        tec, labels, _ = entry
+        return tec.nbytes + labels.nbytes
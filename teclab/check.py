@@ -0,0 +1,279 @@
+"""Consistency check of a dataset directory.
+
+    python -m teclab.check [--data-dir DIR] [--jobs N] [--no-cache]
+
+Every monthly `*tec.h5` file is checked in a process pool:
+- `tec`, `labels` and `start_time` exist and their shapes agree
+- `start_time` is finite, strictly increasing and within the month of the file name
+- the map shape matches `grid.h5`
+
+then the progress is checked against the files:
+- every entry of `labeled.json` / `unsure.json` and of the progress store points at an existing map
+- maps marked as done have labels (a warning, a map without a trough has none) and unlabeled maps have none
+
+The per-file results are cached with the file's content hash, a re-run only opens files whose modification time or
+size changed and only re-checks them if their content changed too.
+"""
+import os
+import re
+import glob
+import json
+import hashlib
+import argparse
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import h5py
+
+from teclab import utils
+
+logger = logging.getLogger(__name__)
+
+CACHE_VERSION = 1
+FILE_NAME_RE = re.compile(r"(\d{4})_(\d{2})_tec\.h5$")
+
+
+def file_hash(fn, block_size=2 ** 20):
+    h = hashlib.blake2b(digest_size=16)
+    with open(fn, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def check_file(args):
+    """Check one month file, runs in a worker process.
+
+    Parameters
+    ----------
+    args: tuple
+        file name and the content hash of the cached result (or None)
+
+    Returns
+    -------
+    result: dict
+        'hash', 'problems', 'n_maps', 'map_shape' and 'labeled' (indices of the maps with labels), None if the
+        content hash matches the cached one
+    """
+    fn, cached_hash = args
+    digest = file_hash(fn)
+    if digest == cached_hash:
+        return None
+    result = {'hash': digest, 'problems': [], 'n_maps': 0, 'map_shape': None, 'labeled': []}
+    problems = result['problems']
+    try:
+        with h5py.File(fn, 'r') as f:
+            missing = [name for name in ['tec', 'labels', 'start_time'] if name not in f]
+            if missing:
+                problems.append(f"missing datasets {missing}")
+                return result
+            tec, labels, start_time = f['tec'], f['labels'], f['start_time']
+            if tec.ndim != 3:
+                problems.append(f"tec has shape {tec.shape}, expected (mlat, mlt, time)")
+                return result
+            n_mlat, n_mlt, n_maps = tec.shape
+            result['n_maps'] = n_maps
+            result['map_shape'] = [n_mlat, n_mlt]
+            if labels.attrs.get('packed', False):
+                expected = (n_mlat, (n_mlt + 7) // 8, n_maps)
+                if int(labels.attrs.get('mlt_size', -1)) != n_mlt:
+                    problems.append(f"packed labels mlt_size {labels.attrs.get('mlt_size')} != {n_mlt}")
+            else:
+                expected = tec.shape
+            if labels.shape != expected:
+                problems.append(f"labels shape {labels.shape} != {expected}")
+            if start_time.shape != (n_maps, ):
+                problems.append(f"start_time shape {start_time.shape} != {(n_maps, )}")
+            problems += _check_times(start_time[()], *_file_month(fn))
+            if labels.shape == expected:
+                for start in range(0, n_maps, 64):
+                    block = utils.read_label_slice(labels, slice(start, start + 64))
+                    result['labeled'] += (start + np.flatnonzero(block.any(axis=(0, 1)))).tolist()
+    except OSError as e:
+        problems.append(f"could not be read: {e}")
+    return result
+
+
+def _file_month(fn):
+    match = FILE_NAME_RE.search(os.path.basename(fn))
+    return (int(match[1]), int(match[2])) if match else (None, None)
+
+
+def _check_times(start_time, year, month):
+    problems = []
+    if not np.isfinite(start_time).all():
+        problems.append(f"{int((~np.isfinite(start_time)).sum())} non-finite start times")
+        return problems
+    steps = np.diff(start_time)
+    if (steps == 0).any():
+        problems.append(f"{int((steps == 0).sum())} duplicate start times")
+    if (steps < 0).any():
+        problems.append(f"start times decrease at indices {(np.flatnonzero(steps < 0) + 1).tolist()[:10]}")
+    if year is not None and start_time.shape[0]:
+        months = start_time.astype('datetime64[s]').astype('datetime64[M]')
+        outside = months != np.datetime64(f"{year:04d}-{month:02d}")
+        if outside.any():
+            problems.append(f"{int(outside.sum())} start times outside {year:04d}-{month:02d}")
+    return problems
+
+
+def read_list(fn):
+    """Entries of a `labeled.json` / `unsure.json` list, empty if the file doesn't exist."""
+    if not os.path.exists(fn):
+        return []
+    with open(fn) as f:
+        return json.load(f).get('list', [])
+
+
+def load_cache(cache_file):
+    if cache_file is None or not os.path.exists(cache_file):
+        return {}
+    try:
+        with open(cache_file) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return cache['files'] if cache.get('version') == CACHE_VERSION else {}
+
+
+def save_cache(cache_file, files):
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    tmp_file = cache_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump({'version': CACHE_VERSION, 'files': files}, f)
+    os.replace(tmp_file, cache_file)
+
+
+def check_files(data_dir, cache_file=None, max_workers=None):
+    """Check every month file of `data_dir`, reusing cached results of unchanged files.
+
+    Returns
+    -------
+    results: dict
+        file name -> result of `check_file`
+    checked: list
+        names of the files which were checked, the others were unchanged
+    """
+    cache = load_cache(cache_file)
+    results, jobs = {}, []
+    for fn in sorted(glob.glob(os.path.join(data_dir, "*tec.h5"))):
+        name = os.path.basename(fn)
+        stat = os.stat(fn)
+        cached = cache.get(name)
+        if cached is not None and cached['mtime'] == stat.st_mtime_ns and cached['size'] == stat.st_size:
+            results[name] = cached
+        else:
+            jobs.append((name, fn, stat, None if cached is None else cached['hash']))
+    args = [(fn, cached_hash) for _, fn, _, cached_hash in jobs]
+    if len(args) > 1:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            outputs = list(executor.map(check_file, args))
+    else:
+        outputs = [check_file(a) for a in args]
+    checked = []
+    for (name, _, stat, _), output in zip(jobs, outputs):
+        if output is None:
+            output = dict(cache[name])
+        else:
+            checked.append(name)
+        output.update(mtime=stat.st_mtime_ns, size=stat.st_size)
+        results[name] = output
+    if cache_file is not None and (jobs or set(cache) != set(results)):
+        save_cache(cache_file, results)
+    return results, checked
+
+
+def check_dataset(data_dir, done_list=(), unsure_list=(), cache_file=None, max_workers=None):
+    """Check the files of a dataset and the progress lists against them.
+
+    Parameters
+    ----------
+    data_dir: str
+    done_list, unsure_list: list
+        (year, month, index) of the maps marked done / unsure, e.g. from the progress store
+    cache_file: str
+    max_workers: int
+
+    Returns
+    -------
+    report: dict
+        'errors' and 'warnings' (lists of messages), 'checked' and 'unchanged' (file names)
+    """
+    results, checked = check_files(data_dir, cache_file, max_workers)
+    errors, warnings = [], []
+    grid_shape = None
+    grid_file = os.path.join(data_dir, "grid.h5")
+    if os.path.exists(grid_file):
+        with h5py.File(grid_file, 'r') as f:
+            grid_shape = [f['mlat'].shape[0], f['mlt'].shape[0]]
+    n_maps, labeled = {}, set()
+    for name, result in sorted(results.items()):
+        errors += [f"{name}: {problem}" for problem in result['problems']]
+        if grid_shape is not None and result['map_shape'] is not None and result['map_shape'] != grid_shape:
+            errors.append(f"{name}: map shape {result['map_shape']} != grid shape {grid_shape}")
+        year, month = _file_month(name)
+        if year is None:
+            errors.append(f"{name}: file name doesn't follow YYYY_MM_tec.h5")
+            continue
+        n_maps[(year, month)] = result['n_maps']
+        labeled.update((year, month, index) for index in result['labeled'])
+
+    def exists(key):
+        return 0 <= key[2] < n_maps.get(key[:2], 0)
+
+    lists = [("labeled.json", read_list(os.path.join(data_dir, "labeled.json"))),
+             ("unsure.json", read_list(os.path.join(data_dir, "unsure.json"))),
+             ("progress done", done_list), ("progress unsure", unsure_list)]
+    for list_name, entries in lists:
+        for key in entries:
+            key = tuple(int(k) for k in key)
+            if not exists(key):
+                errors.append(f"{list_name}: {key} is not a map of the dataset")
+    done = {tuple(int(k) for k in key) for key in done_list}
+    unsure = {tuple(int(k) for k in key) for key in unsure_list}
+    for key in sorted(done & unsure):
+        errors.append(f"{key} is marked both done and unsure")
+    for key in sorted(done - labeled):
+        if exists(key):
+            warnings.append(f"{key} is done but has no labels")
+    for key in sorted(labeled - done - unsure):
+        errors.append(f"{key} has labels but isn't marked done or unsure")
+    return {'errors': errors, 'warnings': warnings, 'checked': checked,
+            'unchanged': sorted(set(results) - set(checked))}
+
+
+def run(config, max_workers=None, use_cache=True):
+    """Check the dataset of a `teclab.config.Config` against its progress store."""
+    cache_file = os.path.join(config.cache_dir, "integrity.json") if use_cache else None
+    return check_dataset(config.data_base_dir, config.progress_store.done_list(), config.progress_store.unsure_list(),
+                         cache_file, max_workers)
+
+
+def print_report(report):
+    for message in report['errors']:
+        print(f"ERROR {message}")
+    for message in report['warnings']:
+        print(f"warning {message}")
+    print(f"checked {len(report['checked'])} files ({len(report['unchanged'])} unchanged): "
+          f"{len(report['errors'])} errors, {len(report['warnings'])} warnings")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the consistency of a TEC dataset")
+    parser.add_argument('--data-dir', help="dataset directory, see teclab.config")
+    parser.add_argument('--jobs', type=int, default=None, help="number of worker processes")
+    parser.add_argument('--no-cache', action='store_true', help="check every file, even unchanged ones")
+    args = parser.parse_args(argv)
+
+    from teclab import config
+    if args.data_dir:
+        config.set_data_dir(args.data_dir)
+    report = run(config.get_config(), args.jobs, not args.no_cache)
+    print_report(report)
+    config.get_config().close()
+    return 1 if report['errors'] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,57 +1,225 @@
-import os
-import h5py
-import json
-import numpy as np
+"""Configuration of teclab.
 
-from teclab import utils
+Nothing is read at import time. The values below are plain module attributes, everything which depends on the
+dataset (grid, map index, progress, caches) is an attribute of the lazily initialised `Config` object and is
+loaded on first access through the module, e.g. `config.map_tree`. The dataset directory is taken from the
+`TECLAB_DATA_DIR` environment variable if set and can be changed with `set_data_dir` (the `--data-dir` option
+of `python -m teclab`) before anything is loaded.
+"""
+import os
+import threading
 
 TEST = True
 
-# set dataset directory
-data_base_dir = "E:\\tec_data"
-if TEST:
-    data_base_dir = os.path.join(data_base_dir, 'test')
+DATA_DIR_ENV = "TECLAB_DATA_DIR"
+
 data_file_pattern = "{year:04d}_{month:02d}_tec.h5"
-data_file_name = os.path.join(data_base_dir, data_file_pattern)
-
-
-def data(year, month):
-    fn = data_file_name.format(year=year, month=month)
-    return utils.open_h5(fn)
-
-
-# get tree of possible maps
-map_tree = utils.get_map_tree(data_base_dir)
-
-grid_file = os.path.join(data_base_dir, "grid.h5")
-with h5py.File(grid_file, 'r') as f:
-    mlt_vals = f['mlt'][()]
-    mlat_vals = f['mlat'][()]
-mlt_grid, mlat_grid = np.meshgrid(mlt_vals, mlat_vals)
-theta_vals = np.pi * (mlt_vals - 6) / 12
-radius_vals = 90 - mlat_vals
-theta_grid, radius_grid = np.meshgrid(theta_vals, radius_vals)
-
-done_list_file = os.path.join(data_base_dir, "labeled.json")
-with open(done_list_file) as f:
-    done_list = json.load(f)
-if 'list' not in done_list:
-    done_list = []
-else:
-    done_list = done_list['list']
-
-unsure_list_file = os.path.join(data_base_dir, "unsure.json")
-with open(unsure_list_file) as f:
-    unsure_list = json.load(f)
-if 'list' not in unsure_list:
-    unsure_list = []
-else:
-    unsure_list = unsure_list['list']
 
 cartesian_grid_size = (500, 500)
 
+# number of upcoming maps loaded and rendered in the background
+prefetch_depth = 3
+
+# percentiles of a map used as its colour range when it loads, see teclab.stats
+auto_color_percentiles = (2, 98)
+
+# sequential mode: maps kept cached before and read ahead of the current map
+sequential_behind = 2
+sequential_ahead = 24
+
+# cross section smoothing: mlt columns averaged and running median width along mlat
+cross_section_avg_width = 7
+cross_section_median_width = 3
+
+
+def default_data_dir():
+    if os.environ.get(DATA_DIR_ENV):
+        return os.environ[DATA_DIR_ENV]
+    data_base_dir = "E:\\tec_data"
+    if TEST:
+        data_base_dir = os.path.join(data_base_dir, 'test')
+    return data_base_dir
+
+
+class lazy:
+    """Thread safe cached property, computed on first access. Every attribute of every instance has its own lock,
+    so a value which takes long to compute doesn't hold up the others."""
+    _locks_lock = threading.Lock()
+
+    def __init__(self, func):
+        self.func = func
+        self.name = func.__name__
+        self.__doc__ = func.__doc__
+
+    def _lock(self, obj):
+        with self._locks_lock:
+            return obj.__dict__.setdefault('_lazy_locks', {}).setdefault(self.name, threading.RLock())
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        with self._lock(obj):
+            if self.name not in obj.__dict__:
+                obj.__dict__[self.name] = self.func(obj)
+            return obj.__dict__[self.name]
+
+
+class Config:
+    """Paths and data of one dataset directory.
+
+    Parameters
+    ----------
+    data_base_dir: str
+    """
+
+    def __init__(self, data_base_dir):
+        self.data_base_dir = data_base_dir
+        self.data_file_name = os.path.join(data_base_dir, data_file_pattern)
+        # derived data which can be regenerated (e.g. the pixel to grid cell mapping)
+        self.cache_dir = os.path.join(data_base_dir, "cache")
+        self.grid_file = os.path.join(data_base_dir, "grid.h5")
+        self.done_list_file = os.path.join(data_base_dir, "labeled.json")
+        self.unsure_list_file = os.path.join(data_base_dir, "unsure.json")
+        self.progress_file = os.path.join(data_base_dir, "progress.sqlite")
+        # per-map labels with modification times, see teclab.label_store
+        self.label_store_file = os.path.join(data_base_dir, "labels.sqlite")
+        # automatic label proposals, see teclab.prelabel
+        self.proposal_dir = os.path.join(data_base_dir, "proposals")
+        # per-map statistics, see teclab.stats
+        self.stats_file = os.path.join(data_base_dir, "map_stats.h5")
+        # authkey of teclab.server, created by the server
+        self.authkey_file = os.path.join(data_base_dir, "server.key")
+        # strokes of drawings which haven't been saved, see strokes.StrokeJournal
+        self.journal_dir = os.path.join(data_base_dir, "journal")
+
+    def data(self, year, month):
+        from teclab import utils
+        fn = self.data_file_name.format(year=year, month=month)
+        return utils.open_h5(fn)
+
+    @lazy
+    def map_tree(self):
+        """tree of possible maps"""
+        from teclab import utils
+        return utils.get_map_tree(self.data_base_dir)
+
+    @lazy
+    def _grid(self):
+        import h5py
+        import numpy as np
+        with h5py.File(self.grid_file, 'r') as f:
+            mlt_vals = f['mlt'][()]
+            mlat_vals = f['mlat'][()]
+        mlt_grid, mlat_grid = np.meshgrid(mlt_vals, mlat_vals)
+        theta_vals = np.pi * (mlt_vals - 6) / 12
+        radius_vals = 90 - mlat_vals
+        theta_grid, radius_grid = np.meshgrid(theta_vals, radius_vals)
+        return {'mlt_vals': mlt_vals, 'mlat_vals': mlat_vals, 'mlt_grid': mlt_grid, 'mlat_grid': mlat_grid,
+                'theta_vals': theta_vals, 'radius_vals': radius_vals, 'theta_grid': theta_grid,
+                'radius_grid': radius_grid}
+
+    mlt_vals = property(lambda self: self._grid['mlt_vals'])
+    mlat_vals = property(lambda self: self._grid['mlat_vals'])
+    mlt_grid = property(lambda self: self._grid['mlt_grid'])
+    mlat_grid = property(lambda self: self._grid['mlat_grid'])
+    theta_vals = property(lambda self: self._grid['theta_vals'])
+    radius_vals = property(lambda self: self._grid['radius_vals'])
+    theta_grid = property(lambda self: self._grid['theta_grid'])
+    radius_grid = property(lambda self: self._grid['radius_grid'])
+
+    @lazy
+    def map_stats(self):
+        """None until `python -m teclab.stats` has been run"""
+        from teclab import stats
+        return stats.load_stats(self.stats_file)
+
+    @lazy
+    def progress_store(self):
+        from teclab import progress
+        progress_store = progress.ProgressStore(self.progress_file)
+        progress_store.import_json(self.done_list_file, self.unsure_list_file)
+        return progress_store
+
+    @property
+    def done_list(self):
+        return self.progress_store.done_list()
+
+    @property
+    def unsure_list(self):
+        return self.progress_store.unsure_list()
+
+    @lazy
+    def map_sampler(self):
+        """status of every map, used to draw unlabeled maps"""
+        from teclab import sampling
+        return sampling.MapSampler(self.map_tree, self.done_list, self.unsure_list)
+
+    @lazy
+    def label_store(self):
+        from teclab import label_store
+        return label_store.LabelStore(self.label_store_file)
+
+    @lazy
+    def label_writer(self):
+        """label saves are written to the h5 files in the background"""
+        from teclab import writer
+        return writer.LabelWriter(batch_delay=1.0, label_store=self.label_store)
+
+    @lazy
+    def map_cache(self):
+        """decoded maps shared by the app and analysis scripts"""
+        from teclab import cache
+        return cache.MapCache(max_bytes=256 * 2 ** 20, neighbours=1, pending_labels=self.label_writer.pending_labels,
+                              write_generation=self.label_writer.generation)
+
+    def close(self):
+        """Flush the label writer and close the progress and label stores, if they were opened."""
+        if 'label_writer' in self.__dict__:
+            self.label_writer.close()
+        if 'label_store' in self.__dict__:
+            self.label_store.close()
+        if 'progress_store' in self.__dict__:
+            self.progress_store.close()
+
+
+_config = None
+_config_lock = threading.Lock()
+
+
+def get_config():
+    global _config
+    with _config_lock:
+        if _config is None:
+            _config = Config(default_data_dir())
+        return _config
+
+
+def set_data_dir(data_base_dir):
+    """Use another dataset directory, the data of the previous one is closed and dropped.
+
+    Returns
+    -------
+    Config
+    """
+    global _config
+    with _config_lock:
+        if _config is not None:
+            _config.close()
+        _config = Config(data_base_dir)
+        return _config
+
+
+def __getattr__(name):
+    if name.startswith('__'):
+        raise AttributeError(name)
+    config = get_config()
+    try:
+        return getattr(config, name)
+    except AttributeError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
+
 
 if __name__ == "__main__":
     year = 2012
     month = 6
-    print(data_file_name.format(year=year, month=month))
+    print(get_config().data_file_name.format(year=year, month=month))
@@ -0,0 +1,181 @@
+import os
+import glob
+import json
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import h5py
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE_NAME = "map_index.json"
+INDEX_VERSION = 1
+
+
+def scan_file(fn):
+    """Read the per-file information stored in the dataset index.
+
+    Parameters
+    ----------
+    fn: str
+
+    Returns
+    -------
+    entry: dict
+        'mtime', 'size', 'shape' (of `tec`) and 'start_time'
+    """
+    stat = os.stat(fn)
+    with h5py.File(fn, 'r') as f:
+        shape = f['tec'].shape
+        start_time = f['start_time'][()]
+    return {
+        'mtime': stat.st_mtime_ns,
+        'size': stat.st_size,
+        'shape': [int(s) for s in shape],
+        'start_time': start_time.tolist(),
+    }
+
+
+def timestamps_to_datetime64(timestamps):
+    """Vectorized equivalent of `datetime.datetime.utcfromtimestamp` with microsecond precision."""
+    timestamps = np.asarray(timestamps, dtype=float)
+    return np.round(timestamps * 1e6).astype(np.int64).astype('datetime64[us]')
+
+
+def build_map_tree(timestamps):
+    """Build the year / month / index / datetime tree (see `utils.get_map_tree`) from the concatenated
+    `start_time` values of the dataset.
+
+    Parameters
+    ----------
+    timestamps: numpy.ndarray
+
+    Returns
+    -------
+    map_tree: dict
+    """
+    dt64 = timestamps_to_datetime64(timestamps)
+    month_code = dt64.astype('datetime64[M]').astype(np.int64)
+    datetimes = dt64.astype(object)
+    codes, inverse = np.unique(month_code, return_inverse=True)
+    order = np.argsort(inverse, kind='stable')
+    groups = np.split(order, np.cumsum(np.bincount(inverse, minlength=codes.shape[0]))[:-1])
+    tree = {}
+    for code, group in zip(codes, groups):
+        yr = np.int64(code // 12 + 1970)
+        mn = int(code % 12 + 1)
+        if yr not in tree:
+            tree[yr] = {}
+        tree[yr][mn] = {
+            'index': np.arange(group.shape[0]),
+            'datetime': datetimes[group],
+        }
+    return tree
+
+
+class DatasetIndex:
+    """Persistent index of the `*tec.h5` files of a dataset, stored as a json sidecar file in the dataset
+    directory. For every file it keeps the modification time, size, `tec` shape and `start_time` values so that
+    only new or modified files need to be opened when the index is refreshed.
+
+    Parameters
+    ----------
+    data_dir: str
+    index_file: str
+        defaults to `INDEX_FILE_NAME` inside `data_dir`
+    """
+
+    def __init__(self, data_dir, index_file=None):
+        self.data_dir = data_dir
+        self.index_file = index_file if index_file is not None else os.path.join(data_dir, INDEX_FILE_NAME)
+        self.files = {}
+
+    def load(self):
+        if not os.path.exists(self.index_file):
+            return
+        try:
+            with open(self.index_file) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            logger.warning(f"Could not read dataset index {self.index_file}, rebuilding it")
+            return
+        if index.get('version') == INDEX_VERSION:
+            self.files = index['files']
+
+    def save(self):
+        tmp_file = self.index_file + '.tmp'
+        try:
+            with open(tmp_file, 'w') as f:
+                json.dump({'version': INDEX_VERSION, 'files': self.files}, f)
+            os.replace(tmp_file, self.index_file)
+        except OSError:
+            logger.warning(f"Could not write dataset index {self.index_file}")
+
+    def refresh(self, max_workers=None):
+        """Rescan files which are new or whose modification time or size changed, in parallel, and drop
+        files which no longer exist.
+
+        Parameters
+        ----------
+        max_workers: int
+            process pool size, defaults to the number of CPUs
+
+        Returns
+        -------
+        rescanned: list
+            file names which were (re)scanned
+        """
+        current = {}
+        for fn in glob.glob(os.path.join(self.data_dir, "*tec.h5")):
+            stat = os.stat(fn)
+            current[os.path.basename(fn)] = (stat.st_mtime_ns, stat.st_size)
+        removed = [name for name in self.files if name not in current]
+        for name in removed:
+            del self.files[name]
+        stale = sorted(
+            name for name, (mtime, size) in current.items()
+            if name not in self.files or self.files[name]['mtime'] != mtime or self.files[name]['size'] != size
+        )
+        paths = [os.path.join(self.data_dir, name) for name in stale]
+        if len(paths) > 1:
+            # the app refreshes from a worker thread, forking a multithreaded process can deadlock the children
+            context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as executor:
+                entries = list(executor.map(scan_file, paths))
+        else:
+            entries = [scan_file(path) for path in paths]
+        self.files.update(zip(stale, entries))
+        if stale or removed:
+            logger.info(f"Dataset index: rescanned {len(stale)} files, removed {len(removed)}")
+            self.save()
+        return stale
+
+    def timestamps(self):
+        """`start_time` values of every file, concatenated in file name order."""
+        if not self.files:
+            return np.empty(0)
+        return np.concatenate([np.asarray(self.files[name]['start_time'], dtype=float) for name in sorted(self.files)])
+
+    def map_tree(self):
+        return build_map_tree(self.timestamps())
+
+
+def load_index(data_dir, index_file=None, max_workers=None):
+    """Load the dataset index of `data_dir` and bring it up to date.
+
+    Parameters
+    ----------
+    data_dir: str
+    index_file: str
+    max_workers: int
+
+    Returns
+    -------
+    DatasetIndex
+    """
+    index = DatasetIndex(data_dir, index_file)
+    index.load()
+    index.refresh(max_workers)
+    return index
@@ -0,0 +1,243 @@
+"""Export labeled maps to a training-ready memory-mapped dataset.
+
+    python -m teclab.export OUT_DIR [--exclude-unsure] [--jobs N] [--check]
+
+OUT_DIR receives `tec.dat` (float32) and `labels.dat` (uint8), raw (n_maps, mlat, mlt) arrays which can be opened
+with `open_export`, plus `metadata.csv` with the year / month / index / datetime / status of every row and
+`export.json` describing the arrays. Re-running appends only maps which haven't been exported yet, and rewrites
+the labels of exported maps which were modified since the last run according to the label store (see
+`teclab.label_store`). The status of rows already exported is brought up to date, rows of maps which are no longer
+selected (e.g. marked unsure since, with `--exclude-unsure`) keep their place in the arrays with status `excluded`.
+"""
+import os
+import csv
+import json
+import time
+import argparse
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from teclab import utils
+from teclab.dataset_index import timestamps_to_datetime64
+from teclab.sampling import DONE, UNSURE
+
+logger = logging.getLogger(__name__)
+
+TEC_FILE = "tec.dat"
+LABELS_FILE = "labels.dat"
+METADATA_FILE = "metadata.csv"
+INFO_FILE = "export.json"
+METADATA_FIELDS = ['row', 'year', 'month', 'index', 'datetime', 'status']
+STATUS_NAMES = {DONE: 'done', UNSURE: 'unsure'}
+# status of exported rows whose map isn't among the selected maps anymore
+EXCLUDED = 'excluded'
+
+
+def read_metadata(out_dir):
+    """Rows of `metadata.csv` as dicts, empty if nothing has been exported yet."""
+    fn = os.path.join(out_dir, METADATA_FILE)
+    if not os.path.exists(fn):
+        return []
+    with open(fn, newline='') as f:
+        return list(csv.DictReader(f))
+
+
+def open_export(out_dir, mode='r'):
+    """Memory-map an export.
+
+    Parameters
+    ----------
+    out_dir: str
+    mode: str
+        numpy.memmap mode
+
+    Returns
+    -------
+    tec: numpy.memmap (n_maps, mlat, mlt) float32
+    labels: numpy.memmap (n_maps, mlat, mlt) uint8
+    metadata: list of dict
+    """
+    with open(os.path.join(out_dir, INFO_FILE)) as f:
+        info = json.load(f)
+    shape = (info['n_maps'], *info['map_shape'])
+    metadata = read_metadata(out_dir)[:info['n_maps']]
+    if info['n_maps'] == 0:
+        return np.empty(shape, np.float32), np.empty(shape, np.uint8), metadata
+    tec = np.memmap(os.path.join(out_dir, TEC_FILE), dtype=info['tec_dtype'], mode=mode, shape=shape)
+    labels = np.memmap(os.path.join(out_dir, LABELS_FILE), dtype=info['labels_dtype'], mode=mode, shape=shape)
+    return tec, labels, metadata
+
+
+def read_month(args):
+    """Read the selected maps of one month file, returned as (n, mlat, mlt) arrays."""
+    fn, indices = args
+    tec, labels, start_time = utils.read_map_indices(fn, indices)
+    tec = np.ascontiguousarray(np.moveaxis(tec, -1, 0), dtype=np.float32)
+    labels = np.ascontiguousarray(np.moveaxis(labels, -1, 0), dtype=np.uint8)
+    return tec, labels, start_time
+
+
+def export_maps(maps, data_file_name, out_dir, max_workers=None):
+    """Append the maps which aren't in the export yet, reading each month file once in a process pool, and update
+    the status of the rows already exported, `EXCLUDED` for maps which aren't in `maps`.
+
+    Parameters
+    ----------
+    maps: list
+        (year, month, index, status) tuples
+    data_file_name: str
+        month file name pattern, see `config.data_file_name`
+    out_dir: str
+    max_workers: int
+
+    Returns
+    -------
+    n_new: int
+        number of exported maps
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    t_start = time.time()
+    info_file = os.path.join(out_dir, INFO_FILE)
+    info = None
+    if os.path.exists(info_file):
+        with open(info_file) as f:
+            info = json.load(f)
+    n_rows = 0 if info is None else info['n_maps']
+    metadata = read_metadata(out_dir)
+    if len(metadata) > n_rows:
+        # rows of maps whose arrays an interrupted run didn't record in export.json, they are exported again
+        logger.info(f"Dropping {len(metadata) - n_rows} metadata rows left by an interrupted export")
+        metadata = metadata[:n_rows]
+        _write_metadata(out_dir, metadata)
+    selected = {(int(year), int(month), int(index)): STATUS_NAMES[status] for year, month, index, status in maps}
+    n_restated = 0
+    for row in metadata:
+        status = selected.get((int(row['year']), int(row['month']), int(row['index'])), EXCLUDED)
+        if row['status'] != status:
+            row['status'] = status
+            n_restated += 1
+    if n_restated:
+        logger.info(f"Updated the status of {n_restated} exported maps")
+        _write_metadata(out_dir, metadata)
+    exported = {(int(row['year']), int(row['month']), int(row['index'])) for row in metadata}
+    by_month = {}
+    for year, month, index, status in sorted(maps):
+        if (int(year), int(month), int(index)) not in exported:
+            by_month.setdefault((int(year), int(month)), []).append((int(index), status))
+    if not by_month:
+        return 0
+
+    jobs = [(data_file_name.format(year=year, month=month), [index for index, _ in entries])
+            for (year, month), entries in by_month.items()]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor, \
+            open(os.path.join(out_dir, METADATA_FILE), 'a', newline='') as meta_f:
+        writer = csv.DictWriter(meta_f, fieldnames=METADATA_FIELDS)
+        if meta_f.tell() == 0:
+            writer.writeheader()
+        for ((year, month), entries), (tec, labels, start_time) in zip(by_month.items(),
+                                                                       executor.map(read_month, jobs)):
+            if info is None:
+                info = {'map_shape': list(tec.shape[1:]), 'n_maps': 0, 'tec_dtype': 'float32', 'labels_dtype': 'uint8',
+                        'synced_at': t_start}
+            _append_arrays(out_dir, info, tec, labels)
+            datetimes = timestamps_to_datetime64(start_time)
+            for (index, status), dt in zip(entries, datetimes):
+                writer.writerow({'row': n_rows, 'year': year, 'month': month, 'index': index,
+                                 'datetime': str(dt.astype('datetime64[s]')), 'status': STATUS_NAMES[status]})
+                n_rows += 1
+            meta_f.flush()
+            info['n_maps'] = n_rows
+            _write_info(info_file, info)
+            logger.info(f"Exported {len(entries)} maps from {year:04d}-{month:02d}")
+    return sum(len(entries) for entries in by_month.values())
+
+
+def update_changed(out_dir, label_store):
+    """Rewrite the labels of exported maps which the label store saw change since the last sync.
+
+    Parameters
+    ----------
+    out_dir: str
+    label_store: teclab.label_store.LabelStore
+
+    Returns
+    -------
+    n_updated: int
+    """
+    info_file = os.path.join(out_dir, INFO_FILE)
+    if not os.path.exists(info_file):
+        return 0
+    with open(info_file) as f:
+        info = json.load(f)
+    t_start = time.time()
+    rows = {(int(m['year']), int(m['month']), int(m['index'])): int(m['row'])
+            for m in read_metadata(out_dir)[:info['n_maps']]}
+    changed = [key for key in label_store.changed_since(info.get('synced_at', 0)) if key in rows]
+    if changed:
+        _, labels, _ = open_export(out_dir, mode='r+')
+        for key in changed:
+            labels[rows[key]] = label_store.get(*key)
+        labels.flush()
+        del labels
+    info['synced_at'] = t_start
+    _write_info(info_file, info)
+    logger.info(f"Updated the labels of {len(changed)} exported maps")
+    return len(changed)
+
+
+def _append_arrays(out_dir, info, tec, labels):
+    """Append to the array files, first dropping anything past `info['n_maps']` left by an interrupted run."""
+    map_size = int(np.prod(info['map_shape']))
+    for name, data, itemsize in [(TEC_FILE, tec, 4), (LABELS_FILE, labels, 1)]:
+        fn = os.path.join(out_dir, name)
+        with open(fn, 'ab') as f:
+            f.truncate(info['n_maps'] * map_size * itemsize)
+            f.write(data.tobytes())
+
+
+def _write_metadata(out_dir, rows):
+    fn = os.path.join(out_dir, METADATA_FILE)
+    tmp_file = fn + '.tmp'
+    with open(tmp_file, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=METADATA_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(tmp_file, fn)
+
+
+def _write_info(info_file, info):
+    tmp_file = info_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(info, f)
+    os.replace(tmp_file, info_file)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export labeled TEC maps to memory-mapped arrays")
+    parser.add_argument('out_dir')
+    parser.add_argument('--exclude-unsure', action='store_true', help="only export maps marked as done")
+    parser.add_argument('--jobs', type=int, default=None, help="number of worker processes")
+    parser.add_argument('--check', action='store_true', help="check the dataset first (see teclab.check), "
+                                                             "nothing is exported if there are errors")
+    args = parser.parse_args(argv)
+
+    from teclab import config
+    if args.check:
+        from teclab import check
+        report = check.run(config.get_config(), args.jobs)
+        check.print_report(report)
+        if report['errors']:
+            return 1
+    maps = [key + (DONE, ) for key in config.progress_store.done_list()]
+    if not args.exclude_unsure:
+        maps += [key + (UNSURE, ) for key in config.progress_store.unsure_list()]
+    n_updated = update_changed(args.out_dir, config.label_store)
+    n_new = export_maps(maps, config.data_file_name, args.out_dir, args.jobs)
+    print(f"exported {n_new} new maps to {args.out_dir}, updated the labels of {n_updated}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,202 @@
+"""Trough features of labeled maps, one row per (map, mlt column).
+
+    python -m teclab.features OUT_FILE [--avg-size 7] [--jobs N]
+
+For every map of the done list and every mlt column holding labeled cells, the table has
+
+- `min_lat`, `min_tec`: location and value of the minimum of the smoothed map over the labeled cells
+- `pwall_lat`, `pwall_tec`, `ewall_lat`, `ewall_tec`: poleward / equatorward labeled cell and its smoothed TEC
+- `width`: `pwall_lat - ewall_lat`
+- `depth`: mean of the two wall TECs minus `min_tec`
+- `pwall_gradient`, `ewall_gradient`: TEC rise from the minimum to each wall per degree of latitude
+
+The smoothed map is the nanmean over an `avg_size` x `avg_size` window, wrapping around in mlt. Columns without
+labeled cells are dropped. OUT_FILE is written as a columnar `.npz` archive (one array per column) or as `.csv`.
+"""
+import os
+import csv
+import argparse
+import logging
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from teclab import utils
+
+logger = logging.getLogger(__name__)
+
+FEATURES = ['min_lat', 'min_tec', 'pwall_lat', 'pwall_tec', 'ewall_lat', 'ewall_tec', 'width', 'depth',
+            'pwall_gradient', 'ewall_gradient']
+KEY_COLUMNS = ['year', 'month', 'index', 'mlt']
+
+
+def _window_sum(x, size, axis, wrap):
+    """Sum over a centered window of odd `size` along `axis` with a cumulative sum. Wrapping pads the axis
+    periodically, otherwise the window is truncated at the ends."""
+    half = (size - 1) // 2
+    n = x.shape[axis]
+    pad = [(0, 0)] * x.ndim
+    if wrap:
+        x = np.take(x, np.arange(-half, n + half) % n, axis=axis)
+    else:
+        pad[axis] = (half, half)
+        x = np.pad(x, pad)
+    pad[axis] = (1, 0)
+    cumulative = np.pad(np.cumsum(x, axis=axis), pad)
+    return np.take(cumulative, np.arange(size, n + size), axis=axis) - np.take(cumulative, np.arange(n), axis=axis)
+
+
+def box_mean(tec, size=7):
+    """Separable nan-aware box filter, wrapping in mlt.
+
+    Parameters
+    ----------
+    tec: numpy.ndarray (mlat, mlt, ...)
+    size: int
+        odd window size
+
+    Returns
+    -------
+    numpy.ndarray (mlat, mlt, ...)
+        NaN where the window holds no finite value
+    """
+    finite = np.isfinite(tec)
+    sums = np.where(finite, tec, 0.)
+    counts = finite.astype(float)
+    for axis, wrap in [(1, True), (0, False)]:
+        sums = _window_sum(sums, size, axis, wrap)
+        counts = _window_sum(counts, size, axis, wrap)
+    return np.divide(sums, counts, out=np.full(sums.shape, np.nan), where=counts > .5)
+
+
+def trough_features(tec, labels, mlat_vals, avg_size=7):
+    """Features of every (mlt column, map).
+
+    Parameters
+    ----------
+    tec: numpy.ndarray (mlat, mlt, n_maps)
+    labels: numpy.ndarray (mlat, mlt, n_maps) bool
+    mlat_vals: numpy.ndarray (mlat, )
+    avg_size: int
+
+    Returns
+    -------
+    features: dict
+        name -> numpy.ndarray (mlt, n_maps), NaN where a column has no labeled cell
+    """
+    labels = np.asarray(labels, dtype=bool)
+    smooth = box_mean(tec, avg_size)
+    labeled = labels.any(axis=0)
+    cols = np.arange(tec.shape[1])[:, None]
+    maps = np.arange(tec.shape[2])[None, :]
+    masked = np.where(labels & np.isfinite(smooth), smooth, np.inf)
+    min_idx = np.argmin(masked, axis=0)
+    # labeled cells with the highest and lowest latitude, whatever the order of the mlat axis
+    lat = np.where(labels, mlat_vals[:, None, None], np.nan)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        pwall_idx = np.argmax(np.where(labels, mlat_vals[:, None, None], -np.inf), axis=0)
+        ewall_idx = np.argmin(np.where(labels, mlat_vals[:, None, None], np.inf), axis=0)
+        features = {
+            'min_lat': mlat_vals[min_idx],
+            'min_tec': np.min(masked, axis=0),
+            'pwall_lat': np.nanmax(lat, axis=0),
+            'pwall_tec': smooth[pwall_idx, cols, maps],
+            'ewall_lat': np.nanmin(lat, axis=0),
+            'ewall_tec': smooth[ewall_idx, cols, maps],
+        }
+        features['min_tec'][~np.isfinite(features['min_tec'])] = np.nan
+        features['width'] = features['pwall_lat'] - features['ewall_lat']
+        features['depth'] = np.nanmean([features['pwall_tec'], features['ewall_tec']], axis=0) - features['min_tec']
+        features['pwall_gradient'] = ((features['pwall_tec'] - features['min_tec']) /
+                                      (features['pwall_lat'] - features['min_lat']))
+        features['ewall_gradient'] = ((features['ewall_tec'] - features['min_tec']) /
+                                      (features['min_lat'] - features['ewall_lat']))
+    for name in FEATURES:
+        values = features[name].astype(float)
+        values[~labeled | ~np.isfinite(values)] = np.nan
+        features[name] = values
+    return features
+
+
+def month_features(args):
+    """Feature rows of the selected maps of one month file."""
+    fn, year, month, indices, mlat_vals, mlt_vals, avg_size = args
+    tec, labels, _ = utils.read_map_indices(fn, indices)
+    features = trough_features(tec, labels, mlat_vals, avg_size)
+    col, map_i = np.nonzero(labels.any(axis=0))
+    table = {
+        'year': np.full(col.shape, year),
+        'month': np.full(col.shape, month),
+        'index': np.asarray(indices)[map_i],
+        'mlt': mlt_vals[col],
+    }
+    for name in FEATURES:
+        table[name] = features[name][col, map_i]
+    return table
+
+
+def feature_table(maps, data_file_name, mlat_vals, mlt_vals, avg_size=7, max_workers=None):
+    """Features of all `maps`, each month file is processed once in a process pool.
+
+    Parameters
+    ----------
+    maps: list
+        (year, month, index) tuples
+    data_file_name: str
+        month file name pattern, see `config.data_file_name`
+    mlat_vals, mlt_vals: numpy.ndarray
+    avg_size: int
+    max_workers: int
+
+    Returns
+    -------
+    table: dict
+        column name -> numpy.ndarray
+    """
+    by_month = {}
+    for year, month, index in sorted({(int(y), int(m), int(i)) for y, m, i in maps}):
+        by_month.setdefault((year, month), []).append(index)
+    jobs = [(data_file_name.format(year=year, month=month), year, month, indices, mlat_vals, mlt_vals, avg_size)
+            for (year, month), indices in by_month.items()]
+    columns = KEY_COLUMNS + FEATURES
+    parts = {name: [] for name in columns}
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for (year, month), part in zip(by_month, executor.map(month_features, jobs)):
+            logger.info(f"Extracted {part['year'].shape[0]} feature rows from {year:04d}-{month:02d}")
+            for name in columns:
+                parts[name].append(part[name])
+    dtypes = {'year': int, 'month': int, 'index': int}
+    return {name: np.concatenate(parts[name]) if parts[name] else np.empty(0, dtype=dtypes.get(name, float))
+            for name in columns}
+
+
+def save_table(table, fn):
+    """Write a feature table as `.npz` or, if `fn` ends with `.csv`, as csv."""
+    if fn.endswith('.csv'):
+        with open(fn, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(list(table))
+            writer.writerows(zip(*table.values()))
+    else:
+        np.savez(fn, **table)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Extract trough features of the labeled maps")
+    parser.add_argument('out_file', help=".npz or .csv")
+    parser.add_argument('--avg-size', type=int, default=7, help="size of the smoothing window")
+    parser.add_argument('--jobs', type=int, default=None, help="number of worker processes")
+    args = parser.parse_args(argv)
+
+    from teclab import config
+    table = feature_table(config.progress_store.done_list(), config.data_file_name, config.mlat_vals,
+                          config.mlt_vals, args.avg_size, args.jobs)
+    save_table(table, args.out_file)
+    print(f"wrote {table['year'].shape[0]} rows to {os.path.abspath(args.out_file)}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
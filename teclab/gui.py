@@ -3,10 +3,11 @@ from PyQt5 import QtCore, QtGui
 import pyqtgraph as pg
 from pyqtgraph import parametertree
 import numpy as np
-import matplotlib.pyplot as plt
 
 from teclab import image_items
 from teclab import config
+from teclab import sampling
+from teclab import instrument
 
 # Base PyQtGraph configuration
 pg.setConfigOption('background', (100, 100, 100))
@@ -19,6 +20,7 @@ param_descriptor = [
         'children': [
             {'name': 'vmin', 'type': 'float', 'value': 0},
             {'name': 'vmax', 'type': 'float', 'value': 20},
+            {'name': 'Auto Range', 'type': 'bool', 'value': True},
         ]
     },
     {
@@ -26,6 +28,17 @@ param_descriptor = [
         'type': 'group',
         'children': [
             {'name': 'Brush Size', 'type': 'int', 'value': 15},
+            {'name': 'Load Proposals', 'type': 'bool', 'value': True},
+        ]
+    },
+    {
+        'name': 'Cross Section',
+        'type': 'group',
+        'children': [
+            {'name': 'Averaging Width', 'type': 'int', 'value': config.cross_section_avg_width, 'step': 2,
+             'limits': (1, 49)},
+            {'name': 'Median Width', 'type': 'int', 'value': config.cross_section_median_width, 'step': 2,
+             'limits': (1, 15)},
         ]
     },
     {
@@ -35,15 +48,51 @@ param_descriptor = [
             {'name': 'Unsure', 'type': 'bool', 'value': False},
         ]
     },
+    {
+        'name': 'Sampling',
+        'type': 'group',
+        'children': [
+            {'name': 'Strategy', 'type': 'list', 'limits': list(sampling.STRATEGIES), 'value': 'Uniform'},
+            {'name': 'Sequential', 'type': 'bool', 'value': False},
+            {'name': 'Carry Labels Forward', 'type': 'bool', 'value': True},
+            {'name': 'Max Empty Fraction', 'type': 'float', 'value': 1.0, 'limits': (0, 1), 'step': .05},
+        ]
+    },
+    {
+        'name': 'Debug',
+        'type': 'group',
+        'children': [
+            {'name': 'Operation', 'type': 'list', 'limits': ['App.map_next', 'App.map_save', 'App.load_map'],
+             'value': 'App.map_next'},
+            {'name': 'Profile Next', 'type': 'action'},
+        ]
+    },
 ]
 
+# spans whose latency is shown in the status bar
+status_spans = {'App.map_next', 'App.map_save'}
+
 
 class Gui(QMainWindow):
+    # emitted from the save worker thread, delivered on the GUI thread
+    save_finished = QtCore.pyqtSignal(str)
+    # journal, its number of operations when the labels were snapshotted
+    journal_saved = QtCore.pyqtSignal(object, int)
+    # emitted from any thread which finishes an instrumented span
+    latency_recorded = QtCore.pyqtSignal(str, float)
+    # emitted from the dataset loader thread with an error message, empty on success
+    dataset_loaded = QtCore.pyqtSignal(str)
 
     def __init__(self, app, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.app = app
+        # colour range shown now, and the one last set by hand which maps without statistics are shown with
         self.pcm_params = {'vmin': 0, 'vmax': 20}
+        self.manual_color_params = dict(self.pcm_params)
+        # colour range of each map taken from the map statistics
+        self.auto_range = True
+        self._setting_color_range = False
+        self.load_proposals = True
 
         splitter = QSplitter()
 
@@ -54,18 +103,21 @@ class Gui(QMainWindow):
         graphics_layout = pg.GraphicsLayoutWidget(drawing_area_widget)
         drawing_area_layout.addWidget(graphics_layout)
         self.viewbox = graphics_layout.addViewBox(lockAspect=True, invertY=False, enableMenu=False)
-        self.tec_map_img = image_items.TecMapImageItem(config.theta_grid, config.radius_grid)
+        self.tec_map_img = image_items.TecMapImageItem(config.theta_grid, config.radius_grid, cache_dir=config.cache_dir)
         self.viewbox.addItem(self.tec_map_img)
         self.draw_img = image_items.DrawingImage('r', self.tec_map_img)
         self.viewbox.addItem(self.draw_img)
-        self.hover_img = image_items.HoverImage(np.zeros((1000, 1000)))
-        self.viewbox.addItem(self.hover_img)
+        self.brush_cursor = image_items.BrushCursor(15)
+        self.viewbox.addItem(self.brush_cursor)
         # Buttons
         button_area_widget = QWidget(drawing_area_widget)
         drawing_area_layout.addWidget(button_area_widget)
         button_area_layout = QHBoxLayout(button_area_widget)
         self._add_button("Clean", button_area_layout, self.map_clean)
+        self._add_button("Undo", button_area_layout, self.draw_img.undo)
+        self._add_button("Redo", button_area_layout, self.draw_img.redo)
         self._add_button("Save", button_area_layout, self.app.map_save)
+        self._add_button("Prev", button_area_layout, self.app.map_previous)
         self._add_button("Next", button_area_layout, self.app.map_next)
 
         # cross section plot
@@ -75,12 +127,20 @@ class Gui(QMainWindow):
         self.cross_section_line = self.cross_section_plot.plot()
         self.cross_section_mlat = pg.InfiniteLine(angle=0)
         self.cross_section_plot.addItem(self.cross_section_mlat)
-        self.proxy = pg.SignalProxy(self.hover_img.scene().sigMouseMoved, rateLimit=60, slot=self.mouseMoved)
+        self.proxy = pg.SignalProxy(self.draw_img.scene().sigMouseMoved, rateLimit=60, slot=self.mouseMoved)
+        self.draw_img.scene().sigMouseMoved.connect(self.move_cursor)
 
         # status bar
         self.status_bar = QStatusBar()
         self.setStatusBar(self.status_bar)
         self.status_bar.showMessage(self.app.map_indicator)
+        self.save_finished.connect(self.status_bar.showMessage)
+        self.journal_saved.connect(self.app._journal_saved)
+        self.dataset_loaded.connect(self.app._dataset_loaded)
+        self.latency_label = QLabel()
+        self.status_bar.addPermanentWidget(self.latency_label)
+        self.latency_recorded.connect(self.show_latency)
+        instrument.session.add_listener(self._span_finished)
 
         # PARAMETERS
         settings_area_widget = QWidget(splitter)
@@ -90,6 +150,13 @@ class Gui(QMainWindow):
         param_tree = parametertree.ParameterTree(parent=settings_area_widget, showHeader=False)
         param_tree.addParameters(self.param_object)
         settings_area_layout.addWidget(param_tree)
+        # preview of the last saved labels
+        preview_layout = pg.GraphicsLayoutWidget(settings_area_widget)
+        preview_layout.setMinimumHeight(250)
+        settings_area_layout.addWidget(preview_layout)
+        preview_viewbox = preview_layout.addViewBox(lockAspect=True, invertY=False, enableMenu=False)
+        self.preview_img = pg.ImageItem()
+        preview_viewbox.addItem(self.preview_img)
 
         # TOP LEVEL
         splitter.addWidget(drawing_area_widget)
@@ -103,7 +170,7 @@ class Gui(QMainWindow):
 
     def mouseMoved(self, evt):
         pos = evt[0]
-        if self.hover_img.sceneBoundingRect().contains(pos) and self.app.tec_map is not None:
+        if self.draw_img.sceneBoundingRect().contains(pos) and self.app.tec_map is not None:
             mousePoint = self.viewbox.mapSceneToView(pos)
             t, r = self.tec_map_img.ax.transData.inverted().transform((mousePoint.x(), mousePoint.y()))
             if t < config.theta_vals.min():
@@ -111,50 +178,130 @@ class Gui(QMainWindow):
             elif t > config.theta_vals.max():
                 t -= 2 * np.pi
             t_ind = np.argmin(abs(config.theta_vals - t))
-            lon_avg = 3
-            t_ind += lon_avg
-            padded_tec_map = np.pad(self.app.tec_map, ((0, 0), (lon_avg, lon_avg)), mode='edge')
-            cross_section_vals = np.nanmean(padded_tec_map[:, t_ind-lon_avg:t_ind+lon_avg+1], axis=1)
-            m = 3
-            pad_width = (m - 1) // 2
-            cross_section_vals = np.pad(cross_section_vals, (pad_width, pad_width), mode='edge')
-            cross_section_vals = np.nanmedian(np.column_stack([cross_section_vals[i:cross_section_vals.shape[0] + 1 - m + i] for i in range(m)]), axis=1)
-            self.cross_section_line.setData(cross_section_vals, 90 - config.radius_vals)
+            self.cross_section_line.setData(self.app.cross_sections[:, t_ind], 90 - config.radius_vals)
             self.cross_section_mlat.setPos(90 - r)
 
+    def move_cursor(self, pos):
+        if self.draw_img.sceneBoundingRect().contains(pos):
+            view_pos = self.viewbox.mapSceneToView(pos)
+            self.brush_cursor.move_to(view_pos.x(), view_pos.y())
+        else:
+            self.brush_cursor.hide()
+
     def get_labels(self):
         return self.draw_img.get_labels()
 
+    def closeEvent(self, event):
+        instrument.session.remove_listener(self._span_finished)
+        super().closeEvent(event)
+
+    def _span_finished(self, name, seconds):
+        if name in status_spans:
+            self.latency_recorded.emit(name, seconds)
+
+    def show_latency(self, name, seconds):
+        self.latency_label.setText(f"{name.split('.')[-1]}: {seconds * 1e3:.0f} ms")
+
+    def show_label_preview(self, labels):
+        self.preview_img.setImage(self.tec_map_img.renderer.render_mask(labels))
+
     def update_map_indicator(self):
         self.status_bar.showMessage(self.app.map_indicator)
 
-    def update_tec_map(self, reset=False):
-        self.tec_map_img.set_tec_map(self.app.tec_map, **self.pcm_params)
+    def color_params(self, color_range=None):
+        """Colour range a map with `color_range` from the map statistics will be shown with."""
+        if self.auto_range and color_range is not None:
+            return {'vmin': color_range[0], 'vmax': color_range[1]}
+        return dict(self.manual_color_params)
+
+    def set_color_params(self, vmin, vmax):
+        """Change the colour range shown in the parameter tree without re-rendering the current map."""
+        self.pcm_params.update(vmin=vmin, vmax=vmax)
+        self._setting_color_range = True
+        try:
+            self.param_object.child('Image', 'vmin').setValue(vmin)
+            self.param_object.child('Image', 'vmax').setValue(vmax)
+        finally:
+            self._setting_color_range = False
+
+    def update_tec_map(self, reset=False, prepared=None, proposal=None, labels=None, unsure=False, journal=None,
+                       color_range=None):
+        self.set_color_params(**self.color_params(color_range))
+        if prepared is None:
+            self.tec_map_img.set_tec_map(self.app.tec_map, **self.pcm_params)
+        else:
+            self.tec_map_img.set_prepared(prepared, **self.pcm_params)
         if reset:
-            self.draw_img.reset_img()
-            self.param_object.child('Misc', 'Unsure').setValue(False)
+            if labels is not None:
+                self.draw_img.set_labels(labels)
+            elif proposal is not None and self.load_proposals:
+                self.draw_img.set_labels(proposal)
+            else:
+                self.draw_img.reset_img()
+            self.param_object.child('Misc', 'Unsure').setValue(unsure)
+            n_recovered = self.draw_img.start_journal(journal)
+            if n_recovered:
+                self.status_bar.showMessage(f"{self.app.map_indicator}: recovered {n_recovered} unsaved strokes")
 
     def map_clean(self):
-        print("clean")
+        self.draw_img.clear()
 
     def keyPressEvent(self, event):
-        if event.key() == QtCore.Qt.Key_Space:
+        ctrl = event.modifiers() & QtCore.Qt.ControlModifier
+        shift = event.modifiers() & QtCore.Qt.ShiftModifier
+        if ctrl and event.key() == QtCore.Qt.Key_Z:
+            if shift:
+                self.draw_img.redo()
+            else:
+                self.draw_img.undo()
+        elif ctrl and event.key() == QtCore.Qt.Key_Y:
+            self.draw_img.redo()
+        elif event.key() == QtCore.Qt.Key_Space:
             print("SPACE")
+        elif event.key() == QtCore.Qt.Key_Right:
+            self.app.map_next()
+        elif event.key() == QtCore.Qt.Key_Left:
+            self.app.map_previous()
         event.accept()
 
     def parameter_changed(self, param, changes):
         for param, change, data in changes:
             path = self.param_object.childPath(param)
             if path[0] == 'Image':
-                self.pcm_params[path[1]] = data
-                self.update_tec_map()
+                if path[1] == 'Auto Range':
+                    self.auto_range = data
+                elif not self._setting_color_range:
+                    self.pcm_params[path[1]] = data
+                    self.manual_color_params = dict(self.pcm_params)
+                    self.tec_map_img.set_color_range(**self.pcm_params)
             if path[0] == 'Editing':
                 if path[1] == 'Brush Size':
                     self.draw_img.set_kernel(data)
-                    self.hover_img.set_kernel(data)
+                    self.brush_cursor.set_kernel(data)
+                if path[1] == 'Load Proposals':
+                    self.load_proposals = data
+            if path[0] == 'Cross Section':
+                if path[1] == 'Averaging Width':
+                    self.app.set_cross_section_param('avg_width', data)
+                if path[1] == 'Median Width':
+                    self.app.set_cross_section_param('median_width', data)
             if path[0] == 'Misc':
                 if path[1] == 'Unsure':
                     self.app.current_map['unsure'] = data
+            if path[0] == 'Sampling':
+                if path[1] == 'Strategy':
+                    self.app.set_sampling_strategy(data)
+                if path[1] == 'Sequential':
+                    self.app.set_sequential(data)
+                if path[1] == 'Carry Labels Forward':
+                    self.app.carry_labels = data
+                if path[1] == 'Max Empty Fraction':
+                    self.app.set_max_empty_fraction(data)
+            if path[0] == 'Debug':
+                if path[1] == 'Profile Next':
+                    operation = self.param_object.child('Debug', 'Operation').value()
+                    instrument.session.profile_next(operation)
+                    self.status_bar.showMessage(f"Profiling the next {operation}")
 
     def _add_button(self, name, layout, callback, no_focus=True):
         button = QPushButton(name)
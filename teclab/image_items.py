@@ -1,10 +1,16 @@
+import os
+import logging
+
 import pyqtgraph as pg
 import numpy as np
 from PyQt5.Qt import Qt
-import matplotlib.pyplot as plt
-from scipy.stats import binned_statistic_2d
 
 from teclab import utils
+from teclab import rendering
+from teclab import strokes
+from teclab import instrument
+
+logger = logging.getLogger(__name__)
 
 
 class PolarImageItem(pg.ImageItem):
@@ -13,71 +19,89 @@ class PolarImageItem(pg.ImageItem):
 
 class TecMapImageItem(pg.ImageItem):
 
-    def __init__(self, theta, r, **kwargs):
+    def __init__(self, theta, r, cache_dir=None, **kwargs):
         self.theta = theta
         self.r = r
 
-        self.fig = plt.figure(figsize=(10, 10), dpi=100, tight_layout=True)
-        plt.close(self.fig)
-        self.ax = self.fig.add_subplot(projection='polar')
+        self.renderer = rendering.PolarRenderer(theta, r, cache_dir=cache_dir)
+        self.ax = self.renderer.ax
+        self.pcm_kwargs = {}
+        self.pixel_values = None
         rgba = self.update_and_get_pixels()
         super().__init__(rgba, opacity=1, border=pg.mkPen('r', width=3), **kwargs)
 
+    @instrument.timed()
     def set_tec_map(self, tec_map_data, **pcm_kwargs):
         rgba = self.update_and_get_pixels(tec_map_data, **pcm_kwargs)
         self.setImage(rgba)
 
+    @instrument.timed()
+    def prepare(self, tec_map_data, **pcm_kwargs):
+        """Do the rendering work for a map ahead of time (safe to call from a worker thread), `pcm_kwargs`
+        override the current colour range.
+
+        Returns
+        -------
+        prepared: dict
+            pass to `set_prepared`
+        """
+        pcm_kwargs = dict(self.pcm_kwargs, **pcm_kwargs)
+        pixel_values = self.renderer.gather(tec_map_data)
+        rgba = self.renderer.render(values=pixel_values, **pcm_kwargs)
+        return {'pixel_values': pixel_values, 'rgba': rgba, 'pcm_kwargs': pcm_kwargs}
+
+    @instrument.timed()
+    def set_prepared(self, prepared, **pcm_kwargs):
+        """Show a map prepared with `prepare`, re-colouring it if the colour range changed since."""
+        self.pcm_kwargs.update(pcm_kwargs)
+        self.pixel_values = prepared['pixel_values']
+        if prepared['pcm_kwargs'] == self.pcm_kwargs:
+            self.setImage(prepared['rgba'])
+        else:
+            self.setImage(self.renderer.render(values=self.pixel_values, **self.pcm_kwargs))
+
+    @instrument.timed()
+    def set_color_range(self, **pcm_kwargs):
+        """Re-colour the current map, only the colormap lookup and overlay blend are repeated."""
+        self.pcm_kwargs.update(pcm_kwargs)
+        self.setImage(self.renderer.render(values=self.pixel_values, **self.pcm_kwargs))
+
+    @instrument.timed()
     def update_and_get_pixels(self, polar_img=None, **pcm_kwargs):
-        self.ax.clear()
-        if polar_img is not None:
-            self.ax.pcolormesh(self.theta, self.r, polar_img, shading='nearest', **pcm_kwargs)
-        self.format_polar_mag_ax()
-        self.fig.patch.set_alpha(0)
-        self.ax.patch.set_alpha(0)
-        self.fig.canvas.draw()
-        rgba = np.array(self.fig.canvas.buffer_rgba())
-        plt.close(self.fig)
-        return np.swapaxes(rgba[::-1], 0, 1)
-
-    def format_polar_mag_ax(self):
-        self.ax.tick_params(axis='both', which='both', bottom=False, top=False, left=False, right=False, labelbottom=False,
-                       labeltop=False, labelleft=False, labelright=False)
-        self.ax.set_ylim(0, 60)
-        self.ax.set_xticks(np.arange(8) * np.pi / 4)
-        self.ax.set_xticklabels((np.arange(8) * 3 + 6) % 24)
-        self.ax.set_yticks([10, 20, 30, 40, 50])
-        self.ax.set_yticklabels([80, 70, 60, 50, 40])
-        self.ax.grid()
-        self.ax.tick_params(axis='x', which='both', bottom=True, labelbottom=True)
-        self.ax.tick_params(axis='y', which='both', left=True, labelleft=True, width=0, length=0)
-        self.ax.set_rlabel_position(80)
-
-
-class HoverImage(pg.ImageItem):
-
-    def __init__(self, image=None, **kargs):
-        super().__init__(image, opacity=1, compositionMode=pg.QtGui.QPainter.CompositionMode_Plus, **kargs)
-        self.set_kernel(15)
+        self.pcm_kwargs.update(pcm_kwargs)
+        self.pixel_values = None if polar_img is None else self.renderer.gather(polar_img)
+        return self.renderer.render(values=self.pixel_values, **self.pcm_kwargs)
+
+
+class BrushCursor(pg.QtWidgets.QGraphicsEllipseItem):
+    """Outline of the brush footprint which follows the mouse. Moving it only repaints its old and new bounding
+    rectangles."""
+
+    def __init__(self, size=15):
+        super().__init__()
+        self.setPen(pg.mkPen('w', width=1, cosmetic=True))
+        self.setBrush(pg.mkBrush(255, 255, 255, 60))
+        self.setAcceptedMouseButtons(Qt.NoButton)
+        self.setAcceptHoverEvents(False)
+        self.setZValue(10)
+        self.set_kernel(size)
+        self.hide()
 
     def set_kernel(self, size):
-        self.centerValue = int((size - 1) / 2)
-        self.kern = np.zeros((size, size), dtype=np.uint8) * 255
-        y, x = np.mgrid[-self.centerValue:size - self.centerValue, -self.centerValue:size - self.centerValue]
-        mask = x * x + y * y <= (size - 1) / 2 * (size - 1) / 2
-        self.kern[mask] = 255
-        self.setDrawKernel(self.kern, center=(self.centerValue, self.centerValue))
+        # the brush paints the pixels within (size - 1) / 2 of the center, cover their outer edges
+        radius = np.floor((size - 1) / 2) + .5
+        self.setRect(-radius, -radius, 2 * radius, 2 * radius)
 
-    def hoverEvent(self, event):
-        if not event.isExit():
-            self.image[:, :] = 0
-            self.updateImage()
-            self.drawAt(event.pos(), event)
-        else:
-            self.image[:, :] = 0
-            self.updateImage()
+    def move_to(self, x, y):
+        """Center the footprint on the pixel under image coordinates (x, y), the same pixel the brush paints."""
+        self.setPos(int(x) + .5, int(y) + .5)
+        if not self.isVisible():
+            self.show()
 
 
 class DrawingImage(pg.ImageItem):
+    """Label drawing layer. Brush strokes are recorded in a `strokes.StrokeJournal` once `start_journal` has been
+    called for the map, which provides `undo`, `redo` and `clear`."""
     colors = {'r': 0, 'g': 1, 'b': 2}
 
     def __init__(self, c, bg_img_item, **kargs):
@@ -88,110 +112,118 @@ class DrawingImage(pg.ImageItem):
         self.set_kernel(15)
         self.x = None
         self.y = None
+        self.journal = None
+        self._stroke_points = None
 
     def reset_img(self):
         self.setImage(np.zeros_like(self.image))
 
+    def get_mask(self):
+        return self.image[:, :, self.color_channel] > 0
+
+    def set_mask(self, mask):
+        img = np.zeros_like(self.image)
+        img[mask, self.color_channel] = 255
+        self.setImage(img)
+
+    def start_journal(self, path=None):
+        """Start recording strokes on top of the current drawing. If `path` holds the journal of an unsaved
+        drawing which started from the current one, that drawing is restored instead.
+
+        Returns
+        -------
+        n_recovered: int
+            number of strokes replayed from `path`
+        """
+        self.close_journal()
+        if path is not None and os.path.exists(path):
+            try:
+                self.journal = strokes.StrokeJournal.recover(path, base=self.get_mask())
+            except (OSError, ValueError):
+                logger.exception(f"Could not recover {path}")
+            if self.journal is not None:
+                self.set_mask(self.journal.render())
+                return len(self.journal)
+        self.journal = strokes.StrokeJournal(self.get_mask(), path=path)
+        return 0
+
+    def close_journal(self):
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+    def undo(self):
+        mask = None if self.journal is None else self.journal.undo()
+        if mask is not None:
+            self.set_mask(mask)
+
+    def redo(self):
+        mask = None if self.journal is None else self.journal.redo()
+        if mask is not None:
+            self.set_mask(mask)
+
+    def clear(self):
+        self.reset_img()
+        if self.journal is not None:
+            self.journal.record(strokes.CLEAR, 0, [])
+
+    @instrument.timed()
     def get_labels(self):
-        label_img = np.swapaxes(self.image, 0, 1)[:, :, self.color_channel]
-        y = np.arange(label_img.shape[0])
-        x = np.arange(label_img.shape[1])
-        X, Y = np.meshgrid(x, y)
-        xy = np.column_stack((X.ravel(), Y.ravel()))
-        tr = self.bg_img_item.ax.transData.inverted().transform(xy)
-
-        theta_grid = self.bg_img_item.theta
-        r_grid = self.bg_img_item.r
-        dt = np.diff(theta_grid[0]).mean()
-        dr = abs(np.diff(r_grid[:, 0]).mean())
-        theta_bins = np.concatenate((theta_grid[0] - dt / 2, [theta_grid[0, -1] + dt / 2]))
-        r_bins = np.concatenate(([r_grid[0, 0] + dr / 2], r_grid[:, 0] - dr / 2))[::-1]
-        tr[tr[:, 0] > theta_bins.max(), 0] -= 2 * np.pi
-        tr[tr[:, 0] < theta_bins.min(), 0] += 2 * np.pi
-
-        res = binned_statistic_2d(tr[:, 0], tr[:, 1], label_img.ravel(), bins=[theta_bins, r_bins])
-        labels = res.statistic.T[::-1] > .5
-        return labels
+        return self.bg_img_item.renderer.pixels_to_grid(self.image[:, :, self.color_channel])
+
+    @instrument.timed()
+    def set_labels(self, labels):
+        """Replace the drawing with (mlat, mlt) grid labels, e.g. an automatic proposal."""
+        img = np.zeros_like(self.image)
+        img[self.bg_img_item.renderer.gather(labels) > .5, self.color_channel] = 255
+        self.setImage(img)
 
     def set_kernel(self, size):
-        self.centerValue = int((size - 1) / 2)
-        self.kern = np.zeros((size, size, 3), dtype=np.uint8)
-        self.mask = np.zeros((size, size, 3), dtype=np.uint8)
-        y, x = np.mgrid[-self.centerValue:size - self.centerValue, -self.centerValue:size - self.centerValue]
-        self.mask[:, :, :] = (x * x + y * y <= (size - 1) / 2 * (size - 1) / 2)[:, :, None]
-        self.kern[:, :, self.color_channel] = 255
+        self.brush_radius = (size - 1) / 2
+        self.paint_value = np.zeros(3)
+        self.paint_value[self.color_channel] = 255
+
+    def draw_segment(self, p0, p1, erase=False):
+        """Paint (or erase) a brush stroke segment into the image buffer, the image item isn't updated."""
+        value = 0 if erase else self.paint_value
+        return strokes.draw_segment(self.image, p0, p1, self.brush_radius, value)
+
+    @staticmethod
+    def _pixel(pos):
+        return int(pos.x()), int(pos.y())
+
+    def _record(self, erase, points):
+        if self.journal is not None:
+            self.journal.record(strokes.ERASE if erase else strokes.PAINT, self.brush_radius, points)
 
     def mouseClickEvent(self, event):
-        if event.button() == Qt.LeftButton:
-            self.setDrawKernel(self.kern, self.mask, center=(self.centerValue, self.centerValue))
-            self.drawAt(event.pos(), event)
-        if event.button() == Qt.RightButton:
-            self.setDrawKernel(self.kern * 0, self.mask, center=(self.centerValue, self.centerValue))
-            self.drawAt(event.pos(), event)
+        if event.button() in [Qt.LeftButton, Qt.RightButton]:
+            p = self._pixel(event.pos())
+            erase = event.button() == Qt.RightButton
+            if self.draw_segment(p, p, erase=erase) is not None:
+                self.updateImage()
+            self._record(erase, [p])
 
     def mouseDragEvent(self, event):
+        if event.button() not in [Qt.LeftButton, Qt.RightButton]:
+            return
+        erase = event.button() == Qt.RightButton
         if event.isStart():
-            if event.button() == Qt.LeftButton:
-                self.setDrawKernel(self.kern, self.mask, center=(self.centerValue, self.centerValue))
-            if event.button() == Qt.RightButton:
-                self.setDrawKernel(self.kern * 0, self.mask, center=(self.centerValue, self.centerValue))
-        if event.button() in [Qt.LeftButton, Qt.RightButton]:
-
-            pos = event.pos()
-            x, y = int(np.round(pos.x())), int(np.round(pos.y()))
-            self.drawAt(event.pos(), event)
-            if self.x is None or self.y is None:
-                self.x = x
-                self.y = y
-                return
-            sx, sy = np.sign(x - self.x), np.sign(y - self.y)
-
-            if sx == 0:
-                self.x = x
-                self.y = y
-                if event.isFinish():
-                    self.x = None
-                    self.y = None
-                return
-
-            if sy == 0:
-                self.x = x
-                self.y = y
-                if event.isFinish():
-                    self.x = None
-                    self.y = None
-                return
-
-            X, Y = np.meshgrid(np.arange(1, abs(x - self.x)) * sx, np.arange(1, abs(y - self.y)) * sy)
-            slope = (y - self.y) / (x - self.x)
-            if sx == 1 and sy == 1:
-                gte = slope >= (2 * Y - 1) / (2 * X + 1)
-                lte = slope <= (2 * Y + 1) / (2 * X - 1)
-            elif sx == 1 and sy == -1:
-                lte = slope <= (2 * Y + 1) / (2 * X + 1)
-                gte = slope >= (2 * Y - 1) / (2 * X - 1)
-            elif sx == -1 and sy == -1:
-                lte = slope <= (2 * Y - 1) / (2 * X + 1)
-                gte = slope >= (2 * Y + 1) / (2 * X - 1)
-            elif sx == -1 and sy == 1:
-                lte = slope <= (2 * Y - 1) / (2 * X - 1)
-                gte = slope >= (2 * Y + 1) / (2 * X + 1)
-
-            result = lte * gte
-            pixels = np.where(result.T)
-
-            xs = sx * pixels[0] + self.x
-            ys = sy * pixels[1] + self.y
-            for x1, y1 in zip(xs, ys):
-                p = pg.QtCore.QPoint(x1, y1)
-                self.drawAt(p)
-
-            self.x = x
-            self.y = y
-
-            if event.isFinish():
-                self.x = None
-                self.y = None
+            self.x, self.y = self._pixel(event.buttonDownPos())
+            self._stroke_points = [(self.x, self.y)]
+        x, y = self._pixel(event.pos())
+        if self.x is None or self.y is None:
+            self.x, self.y = x, y
+            self._stroke_points = [(x, y)]
+        if self.draw_segment((self.x, self.y), (x, y), erase=erase) is not None:
+            self.updateImage()
+        self.x, self.y = x, y
+        self._stroke_points.append((x, y))
+        if event.isFinish():
+            self._record(erase, self._stroke_points)
+            self._stroke_points = None
+            self.x = None
+            self.y = None
 
     def hoverEvent(self, event):
         if not event.isExit():
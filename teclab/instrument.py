@@ -0,0 +1,206 @@
+"""Lightweight timing spans and counters for the hot paths.
+
+Wrap code with `span("name")` or decorate functions with `timed()` and count events with `count("name")`. Every
+span keeps a rolling histogram of its recent latencies, listeners are notified of every finished span (the GUI
+shows the last latency in its status bar) and `session` holds the totals of the whole session, summarized with
+`summary` / `format_summary` when the app exits. `profile_next("name")` captures a cProfile of the next run of
+a span.
+"""
+import io
+import os
+import time
+import pstats
+import cProfile
+import logging
+import functools
+import threading
+from collections import deque, Counter
+from contextlib import contextmanager
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class Histogram:
+    """Latencies of the last `window` runs of a span plus running totals.
+
+    Parameters
+    ----------
+    window: int
+    """
+    bucket_edges = np.logspace(-5, 2, 15)
+
+    def __init__(self, window=1000):
+        self.samples = deque(maxlen=window)
+        self.n = 0
+        self.total = 0.
+        self.max = 0.
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+        self.n += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    @property
+    def last(self):
+        return self.samples[-1] if self.samples else None
+
+    def buckets(self):
+        """Counts of the recent latencies in logarithmic buckets, (upper edge in seconds, count) pairs."""
+        counts = np.bincount(np.searchsorted(self.bucket_edges, list(self.samples)),
+                             minlength=self.bucket_edges.shape[0] + 1)
+        return list(zip(np.append(self.bucket_edges, np.inf).tolist(), counts.tolist()))
+
+    def summary(self):
+        recent = np.array(self.samples)
+        p50, p90, p99 = np.percentile(recent, [50, 90, 99]) if recent.size else (np.nan, ) * 3
+        return {'n': self.n, 'total': self.total, 'mean': self.total / max(self.n, 1), 'max': self.max,
+                'p50': float(p50), 'p90': float(p90), 'p99': float(p99), 'last': self.last}
+
+
+class Instrumentation:
+    """Registry of span histograms and counters, safe to use from any thread.
+
+    Parameters
+    ----------
+    window: int
+        size of the rolling histograms
+    profile_dir: str
+        where profiles captured with `profile_next` are written, not written if None
+    """
+
+    def __init__(self, window=1000, profile_dir=None):
+        self.window = window
+        self.profile_dir = profile_dir
+        self.histograms = {}
+        self.counters = Counter()
+        self.listeners = []
+        self._profile_requests = set()
+        self._profiling = False
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds):
+        with self._lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram(self.window)
+            self.histograms[name].add(seconds)
+            listeners = list(self.listeners)
+        for listener in listeners:
+            # the timed operation must not fail because of a listener
+            try:
+                listener(name, seconds)
+            except Exception:
+                logger.exception(f"Span listener {listener!r} failed")
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def add_listener(self, callback):
+        """`callback(name, seconds)` is called after every span, on the thread which ran it."""
+        with self._lock:
+            self.listeners.append(callback)
+
+    def remove_listener(self, callback):
+        """Stop calling a callback added with `add_listener`, does nothing if it isn't registered."""
+        with self._lock:
+            if callback in self.listeners:
+                self.listeners.remove(callback)
+
+    def profile_next(self, name):
+        """Capture a cProfile of the next run of span `name`."""
+        with self._lock:
+            self._profile_requests.add(name)
+
+    @contextmanager
+    def span(self, name):
+        profiler = self._start_profile(name)
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - t0
+            if profiler is not None:
+                self._finish_profile(name, profiler)
+            self.record(name, seconds)
+
+    def timed(self, name=None):
+        """Decorator running the function in a span, named `Class.method` or `module.function` by default."""
+        def decorator(func):
+            span_name = name
+            if span_name is None:
+                span_name = func.__qualname__
+                if '.' not in span_name:
+                    span_name = f"{func.__module__.rsplit('.', 1)[-1]}.{span_name}"
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(span_name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def summary(self):
+        """{'spans': {name: histogram summary}, 'counters': {name: count}}"""
+        with self._lock:
+            return {'spans': {name: h.summary() for name, h in sorted(self.histograms.items())},
+                    'counters': dict(sorted(self.counters.items()))}
+
+    def format_summary(self):
+        summary = self.summary()
+        lines = [f"{'span':45s} {'n':>7s} {'mean ms':>9s} {'p50 ms':>9s} {'p90 ms':>9s} {'p99 ms':>9s} "
+                 f"{'max ms':>9s}"]
+        for name, s in summary['spans'].items():
+            lines.append(f"{name:45s} {s['n']:7d} {s['mean'] * 1e3:9.2f} {s['p50'] * 1e3:9.2f} "
+                         f"{s['p90'] * 1e3:9.2f} {s['p99'] * 1e3:9.2f} {s['max'] * 1e3:9.2f}")
+        for name, n in summary['counters'].items():
+            lines.append(f"{name:45s} {n:7d}")
+        return "\n".join(lines)
+
+    def _start_profile(self, name):
+        with self._lock:
+            if name not in self._profile_requests or self._profiling:
+                return None
+            self._profile_requests.discard(name)
+            self._profiling = True
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            logger.warning(f"Could not profile {name}, another profiler is active")
+            with self._lock:
+                self._profiling = False
+            return None
+        return profiler
+
+    def _finish_profile(self, name, profiler):
+        profiler.disable()
+        with self._lock:
+            self._profiling = False
+        stats = pstats.Stats(profiler)
+        if self.profile_dir is not None:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            fn = os.path.join(self.profile_dir, f"{name}_{time.strftime('%Y%m%d_%H%M%S')}.prof")
+            stats.dump_stats(fn)
+            logger.info(f"Wrote profile of {name} to {fn}")
+        stats.stream = io.StringIO()
+        stats.sort_stats('cumulative').print_stats(25)
+        logger.info(f"Profile of {name}:\n{stats.stream.getvalue()}")
+
+
+# the instrumentation used throughout teclab
+session = Instrumentation()
+
+
+def span(name):
+    return session.span(name)
+
+
+def timed(name=None):
+    return session.timed(name)
+
+
+def count(name, n=1):
+    session.count(name, n)
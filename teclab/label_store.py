@@ -0,0 +1,303 @@
+"""Compact per-map label store.
+
+    python -m teclab.label_store import [--data-dir DIR]
+    python -m teclab.label_store write [--data-dir DIR] [--since TIMESTAMP]
+    python -m teclab.label_store report [--data-dir DIR]
+
+Labels are kept in a SQLite database next to the month files, one row per map keyed by (year, month, index) with
+the bit-packed, zlib compressed mask and the time it last changed. Maps without a row have no labels. The
+`LabelWriter` records every save here, `teclab.export` uses the modification times to update only the exported maps
+whose labels changed. `import` fills the store from the dense `labels` datasets of the month files, `write` goes the
+other way, both are lossless.
+"""
+import os
+import time
+import zlib
+import sqlite3
+import argparse
+import threading
+import logging
+
+import numpy as np
+import h5py
+
+from teclab import config, utils
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS labels (
+    year INTEGER NOT NULL,
+    month INTEGER NOT NULL,
+    idx INTEGER NOT NULL,
+    n_mlat INTEGER NOT NULL,
+    n_mlt INTEGER NOT NULL,
+    n_set INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    mtime REAL NOT NULL,
+    PRIMARY KEY (year, month, idx)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS labels_mtime ON labels (mtime);
+"""
+
+
+def encode(labels):
+    """Bit-pack and compress a label mask.
+
+    Parameters
+    ----------
+    labels: numpy.ndarray (mlat, mlt)
+
+    Returns
+    -------
+    bytes
+    """
+    return zlib.compress(np.packbits(np.asarray(labels, dtype=bool).ravel()).tobytes(), 1)
+
+
+def decode(data, shape):
+    """Inverse of `encode`.
+
+    Parameters
+    ----------
+    data: bytes
+    shape: tuple
+        (mlat, mlt)
+
+    Returns
+    -------
+    labels: numpy.ndarray (mlat, mlt) bool
+    """
+    packed = np.frombuffer(zlib.decompress(data), dtype=np.uint8)
+    return np.unpackbits(packed, count=shape[0] * shape[1]).reshape(shape).astype(bool)
+
+
+class LabelStore:
+    """Per-map labels in a SQLite database, see the module docstring.
+
+    Parameters
+    ----------
+    db_file: str
+    timeout: float
+        seconds to wait for another process holding the write lock
+    """
+
+    def __init__(self, db_file, timeout=30):
+        self.db_file = db_file
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_file, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+    def put_many(self, labels_by_key, mtime=None):
+        """Store several maps in one transaction, maps whose labels didn't change keep their modification time.
+
+        Parameters
+        ----------
+        labels_by_key: dict
+            (year, month, index) -> numpy.ndarray (mlat, mlt)
+        mtime: float
+            defaults to now
+
+        Returns
+        -------
+        changed: list
+            keys which were added or modified
+        """
+        mtime = time.time() if mtime is None else mtime
+        rows = []
+        for key, labels in labels_by_key.items():
+            labels = np.asarray(labels, dtype=bool)
+            rows.append((*(int(k) for k in key), *labels.shape, int(labels.sum()), encode(labels), mtime))
+        changed = []
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                for row in rows:
+                    old = self.conn.execute("SELECT data FROM labels WHERE year = ? AND month = ? AND idx = ?",
+                                            row[:3]).fetchone()
+                    if old is not None and old[0] == row[6]:
+                        continue
+                    self.conn.execute(
+                        "INSERT INTO labels (year, month, idx, n_mlat, n_mlt, n_set, data, mtime) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (year, month, idx) DO UPDATE SET "
+                        "n_mlat = excluded.n_mlat, n_mlt = excluded.n_mlt, n_set = excluded.n_set, "
+                        "data = excluded.data, mtime = excluded.mtime", row)
+                    changed.append(row[:3])
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        return changed
+
+    def put(self, year, month, index, labels, mtime=None):
+        """Store the labels of one map, returns whether they changed."""
+        return bool(self.put_many({(year, month, index): labels}, mtime))
+
+    def get(self, year, month, index):
+        """Labels of a map, None if the store has none."""
+        with self._lock:
+            row = self.conn.execute("SELECT n_mlat, n_mlt, data FROM labels WHERE year = ? AND month = ? AND idx = ?",
+                                    (int(year), int(month), int(index))).fetchone()
+        return None if row is None else decode(row[2], row[:2])
+
+    def get_month(self, year, month):
+        """index -> labels of every stored map of a month."""
+        with self._lock:
+            rows = self.conn.execute("SELECT idx, n_mlat, n_mlt, data FROM labels WHERE year = ? AND month = ?",
+                                     (int(year), int(month))).fetchall()
+        return {idx: decode(data, (n_mlat, n_mlt)) for idx, n_mlat, n_mlt, data in rows}
+
+    def mtime(self, year, month, index):
+        with self._lock:
+            row = self.conn.execute("SELECT mtime FROM labels WHERE year = ? AND month = ? AND idx = ?",
+                                    (int(year), int(month), int(index))).fetchone()
+        return None if row is None else row[0]
+
+    def changed_since(self, timestamp):
+        """(year, month, index) of the maps modified after `timestamp`, in time order."""
+        with self._lock:
+            rows = self.conn.execute("SELECT year, month, idx FROM labels WHERE mtime > ? ORDER BY year, month, idx",
+                                     (float(timestamp), )).fetchall()
+        return [tuple(row) for row in rows]
+
+    def months(self):
+        """(year, month) of every month with stored labels."""
+        with self._lock:
+            rows = self.conn.execute("SELECT DISTINCT year, month FROM labels ORDER BY year, month").fetchall()
+        return [tuple(row) for row in rows]
+
+    def stats(self):
+        """Number of stored maps, bytes of their encoded labels and of the same labels as dense bool arrays."""
+        with self._lock:
+            row = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0), "
+                                    "COALESCE(SUM(n_mlat * n_mlt), 0) FROM labels").fetchone()
+        return {'n_maps': row[0], 'encoded_bytes': row[1], 'dense_bytes': row[2]}
+
+
+def import_file(store, fn, year, month, block_size=64):
+    """Copy the labels of a month file into the store, maps without any labels are skipped. The file's
+    modification time is used as the modification time of the imported maps.
+
+    Returns
+    -------
+    n_changed: int
+    """
+    mtime = os.path.getmtime(fn)
+    n_changed = 0
+    with utils.file_lock(fn), h5py.File(fn, 'r') as f:
+        n_maps = f['labels'].shape[2]
+        for start in range(0, n_maps, block_size):
+            labels = utils.read_label_slice(f['labels'], slice(start, start + block_size))
+            indices = np.flatnonzero(labels.any(axis=(0, 1)))
+            entries = {(year, month, start + int(i)): labels[:, :, i] for i in indices}
+            n_changed += len(store.put_many(entries, mtime))
+    return n_changed
+
+
+def dense_labels(store, year, month, shape):
+    """The `labels` cube of a month rebuilt from the store.
+
+    Parameters
+    ----------
+    store: LabelStore
+    year, month: int
+    shape: tuple
+        (mlat, mlt, n_maps)
+
+    Returns
+    -------
+    labels: numpy.ndarray (mlat, mlt, n_maps) bool
+    """
+    labels = np.zeros(shape, dtype=bool)
+    for index, map_labels in store.get_month(year, month).items():
+        labels[:, :, index] = map_labels
+    return labels
+
+
+def write_file(store, fn, year, month, since=None):
+    """Write the stored labels of a month into its file, only the maps modified after `since` if given.
+
+    Returns
+    -------
+    n_written: int
+    """
+    if since is None:
+        entries = store.get_month(year, month)
+    else:
+        entries = {index: store.get(y, m, index) for y, m, index in store.changed_since(since)
+                   if (y, m) == (year, month)}
+    if entries:
+        utils.write_labels(fn, entries)
+    return len(entries)
+
+
+def month_files(data_dir):
+    """(year, month) -> file name of every month file in `data_dir`."""
+    map_tree = utils.get_map_tree(data_dir)
+    return {(year, month): os.path.join(data_dir, config.data_file_pattern.format(year=year, month=month))
+            for year in map_tree for month in map_tree[year]}
+
+
+def storage_report(store, data_dir):
+    """Disk use of the dense `labels` datasets against the store, and the bytes moved to save one map.
+
+    Returns
+    -------
+    dict
+    """
+    dense_disk, dense_maps, map_bytes = 0, 0, 0
+    for fn in month_files(data_dir).values():
+        with h5py.File(fn, 'r') as f:
+            dset = f['labels']
+            dense_disk += dset.id.get_storage_size()
+            dense_maps += dset.shape[2]
+            map_bytes = dset.shape[0] * dset.shape[1] * dset.dtype.itemsize
+    stats = store.stats()
+    store_disk = sum(os.path.getsize(fn) for fn in [store.db_file, store.db_file + '-wal'] if os.path.exists(fn))
+    return {
+        'dense_disk_bytes': dense_disk,
+        'store_disk_bytes': store_disk,
+        'dense_maps': dense_maps,
+        'stored_maps': stats['n_maps'],
+        'dense_bytes_per_save': map_bytes,
+        'store_bytes_per_save': stats['encoded_bytes'] / max(stats['n_maps'], 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert between month file labels and the compact label store")
+    parser.add_argument('command', choices=['import', 'write', 'report'])
+    parser.add_argument('--data-dir', help="dataset directory, see teclab.config")
+    parser.add_argument('--since', type=float, default=None,
+                        help="write: only maps modified after this unix timestamp")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    if args.data_dir:
+        config.set_data_dir(args.data_dir)
+    store = config.label_store
+    if args.command == 'import':
+        n = sum(import_file(store, fn, *key) for key, fn in month_files(config.data_base_dir).items())
+        print(f"imported {n} changed maps into {store.db_file}")
+    elif args.command == 'write':
+        files = month_files(config.data_base_dir)
+        n = sum(write_file(store, files[key], *key, since=args.since) for key in store.months() if key in files)
+        print(f"wrote {n} maps to the month files")
+    else:
+        report = storage_report(store, config.data_base_dir)
+        print(f"disk: {report['dense_disk_bytes'] / 2 ** 20:.2f} MB dense labels ({report['dense_maps']} maps), "
+              f"{report['store_disk_bytes'] / 2 ** 20:.2f} MB label store ({report['stored_maps']} maps)")
+        print(f"per save: {report['dense_bytes_per_save']} bytes dense slice, "
+              f"{report['store_bytes_per_save']:.0f} bytes encoded")
+    config.get_config().close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,115 @@
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class Prefetcher:
+    """Keeps the next `depth` maps sampled, loaded and prepared ahead of time.
+
+    Maps are drawn from `sampler` on the calling thread (sampling is cheap and the sampler isn't thread safe)
+    and `load` runs on a worker thread. When a map is popped, its status is compared with the status it had
+    when it was drawn and it is skipped if it has been labeled in the meantime.
+
+    Parameters
+    ----------
+    sampler: teclab.sampling.MapSampler
+    load: callable
+        `(year, month, index, datetime) -> entry`, run on the worker thread
+    depth: int
+    strategy: sampling strategy, see `teclab.sampling`
+    """
+
+    def __init__(self, sampler, load, depth=3, strategy=None):
+        self.sampler = sampler
+        self.load = load
+        self.depth = depth
+        self.strategy = strategy
+        self._queue = deque()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="Prefetcher")
+
+    def __len__(self):
+        return len(self._queue)
+
+    def set_strategy(self, strategy):
+        self.strategy = strategy
+        self.clear()
+        self.fill()
+
+    def clear(self):
+        """Drop the queued maps, a sampler which hands out leases (see `teclab.backend.LeaseSampler`) gets them
+        back."""
+        release = getattr(self.sampler, 'release', None)
+        while self._queue:
+            key, _, future = self._queue.popleft()
+            future.cancel()
+            if release is not None:
+                release(*key[:3])
+
+    def fill(self):
+        """Draw maps until `depth` are queued. Maps already queued are not drawn twice."""
+        queued = {key[:3] for key, _, _ in self._queue}
+        attempts = 0
+        while len(self._queue) < self.depth and attempts < 4 * self.depth:
+            attempts += 1
+            try:
+                key = self.sampler.sample(self.strategy)
+            except LookupError:
+                break
+            if key[:3] in queued:
+                continue
+            queued.add(key[:3])
+            status = self.sampler.get_status(*key[:3])
+            self._queue.append((key, status, self._executor.submit(self.load, *key)))
+
+    def pop(self):
+        """Next prepared map, waiting for it if it isn't ready yet.
+
+        Returns
+        -------
+        key: tuple
+            (year, month, index, datetime)
+        entry:
+            return value of `load`
+
+        Raises
+        ------
+        LookupError
+            nothing left to sample
+        RuntimeError
+            `load` failed, the map is dropped from the queue
+        """
+        self.fill()
+        while self._queue:
+            key, status, future = self._queue.popleft()
+            if self.sampler.get_status(*key[:3]) != status:
+                logger.info(f"Skipping prefetched map {key[:3]}, it was labeled in the meantime")
+                future.cancel()
+                self.fill()
+                continue
+            try:
+                entry = future.result()
+            except Exception as e:
+                self._drop(key)
+                raise RuntimeError(f"Failed to load map {tuple(int(k) for k in key[:3])}: {e}") from e
+            self.fill()
+            return key, entry
+        key = self.sampler.sample(self.strategy)
+        try:
+            return key, self.load(*key)
+        except Exception as e:
+            self._drop(key)
+            raise RuntimeError(f"Failed to load map {tuple(int(k) for k in key[:3])}: {e}") from e
+
+    def _drop(self, key):
+        """Leave a map which couldn't be loaded out of sampling (see `MapSampler.exclude`) and queue another
+        one."""
+        exclude = getattr(self.sampler, 'exclude', None)
+        if exclude is not None:
+            exclude(*key[:3])
+        self.fill()
+
+    def shutdown(self):
+        self.clear()
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,282 @@
+"""Automatic trough label proposals, used to seed the drawing layer of the GUI.
+
+    python -m teclab.prelabel [--method threshold] [--jobs N] [--force]
+    python -m teclab.prelabel --method model --train MODEL_FILE
+    python -m teclab.prelabel --method model --model MODEL_FILE
+
+The `threshold` method marks cells whose lightly smoothed TEC is depleted by more than `depletion` relative to a
+wide-window background and cleans the mask up with morphological opening and small object / hole removal. The
+`model` method replaces the threshold with a scikit-learn classifier trained on the cells of the done list.
+
+Proposals of every month file are stored in `config.proposal_dir` as `{year}_{month}_proposals.h5`, holding a
+bit-packed `labels` cube in the layout of `utils.read_label_slice` and the hash of the TEC they were computed
+from (`utils.tec_hash`). Month files whose TEC hasn't changed are skipped unless `--force` is given, saving labels
+doesn't make proposals stale.
+"""
+import os
+import glob
+import pickle
+import argparse
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import h5py
+
+from teclab import utils
+from teclab import features
+
+logger = logging.getLogger(__name__)
+
+PROPOSAL_FILE_PATTERN = "{year:04d}_{month:02d}_proposals.h5"
+
+
+def cell_features(tec, mlat_vals, mlt_vals, smooth_size=3, background_size=15):
+    """Per cell inputs of the pre-labelers.
+
+    Parameters
+    ----------
+    tec: numpy.ndarray (mlat, mlt, n_maps)
+    mlat_vals, mlt_vals: numpy.ndarray
+    smooth_size, background_size: int
+        odd box filter sizes, see `features.box_mean`
+
+    Returns
+    -------
+    numpy.ndarray (mlat, mlt, n_maps, 6)
+        smoothed TEC, background TEC, relative depletion, mlat, sin and cos of mlt
+    """
+    smooth = features.box_mean(tec, smooth_size)
+    background = features.box_mean(tec, background_size)
+    depletion = np.divide(background - smooth, background, out=np.full(smooth.shape, np.nan),
+                          where=np.isfinite(background) & (background > 0))
+    phase = 2 * np.pi * np.asarray(mlt_vals) / 24
+    shape = smooth.shape
+    return np.stack([smooth, background, depletion,
+                     np.broadcast_to(np.asarray(mlat_vals)[:, None, None], shape),
+                     np.broadcast_to(np.sin(phase)[None, :, None], shape),
+                     np.broadcast_to(np.cos(phase)[None, :, None], shape)], axis=-1)
+
+
+def _remove_small_objects(mask, min_size):
+    from skimage import measure
+
+    components = measure.label(mask, connectivity=1)
+    sizes = np.bincount(components.ravel())
+    sizes[0] = 0
+    return (sizes >= min_size)[components]
+
+
+def clean_mask(mask, opening_radius=1, min_size=20):
+    """Morphological cleanup of raw (mlat, mlt, n_maps) proposals, map by map: opening, then removal of
+    components and holes smaller than `min_size` cells."""
+    from skimage import morphology
+
+    footprint = morphology.disk(opening_radius)
+    cleaned = np.empty(mask.shape, dtype=bool)
+    for i in range(mask.shape[2]):
+        m = morphology.opening(mask[:, :, i], footprint).astype(bool)
+        m = _remove_small_objects(m, min_size)
+        cleaned[:, :, i] = ~_remove_small_objects(~m, min_size)
+    return cleaned
+
+
+def threshold_proposals(tec, mlat_vals, mlt_vals, depletion=.2, min_size=20):
+    """Proposals of the `threshold` method.
+
+    Parameters
+    ----------
+    tec: numpy.ndarray (mlat, mlt, n_maps)
+    mlat_vals, mlt_vals: numpy.ndarray
+    depletion: float
+        relative depletion threshold
+    min_size: int
+        smallest trough (and largest hole) in cells
+
+    Returns
+    -------
+    numpy.ndarray (mlat, mlt, n_maps) bool
+    """
+    x = cell_features(tec, mlat_vals, mlt_vals)
+    with np.errstate(invalid='ignore'):
+        mask = x[..., 2] > depletion
+    return clean_mask(mask, min_size=min_size)
+
+
+def model_proposals(model, tec, mlat_vals, mlt_vals, min_size=20):
+    """Proposals of the `model` method, `model` is a classifier returned by `train_model`."""
+    x = cell_features(tec, mlat_vals, mlt_vals)
+    flat = x.reshape((-1, x.shape[-1]))
+    mask = np.zeros(flat.shape[0], dtype=bool)
+    valid = np.isfinite(flat).all(axis=1)
+    if valid.any():
+        mask[valid] = model.predict(flat[valid]).astype(bool)
+    return clean_mask(mask.reshape(x.shape[:-1]), min_size=min_size)
+
+
+def train_model(maps, data_file_name, mlat_vals, mlt_vals, max_cells=500000, seed=0):
+    """Fit a gradient boosting classifier on the cells of labeled maps.
+
+    Parameters
+    ----------
+    maps: list
+        (year, month, index) tuples, e.g. the done list
+    data_file_name: str
+        month file name pattern, see `config.data_file_name`
+    mlat_vals, mlt_vals: numpy.ndarray
+    max_cells: int
+        the training cells are subsampled to at most this many
+    seed: int
+
+    Returns
+    -------
+    sklearn.ensemble.HistGradientBoostingClassifier
+    """
+    from sklearn.ensemble import HistGradientBoostingClassifier
+
+    by_month = {}
+    for year, month, index in sorted({(int(y), int(m), int(i)) for y, m, i in maps}):
+        by_month.setdefault((year, month), []).append(index)
+    x_parts, y_parts = [], []
+    for (year, month), indices in by_month.items():
+        tec, labels, _ = utils.read_map_indices(data_file_name.format(year=year, month=month), indices)
+        x = cell_features(tec, mlat_vals, mlt_vals).reshape((-1, 6))
+        y = labels.ravel()
+        valid = np.isfinite(x).all(axis=1)
+        x_parts.append(x[valid])
+        y_parts.append(y[valid])
+    if not x_parts:
+        raise ValueError("no labeled maps to train on")
+    x, y = np.concatenate(x_parts), np.concatenate(y_parts)
+    if x.shape[0] > max_cells:
+        keep = np.random.default_rng(seed).choice(x.shape[0], max_cells, replace=False)
+        x, y = x[keep], y[keep]
+    logger.info(f"Training pre-labeling model on {x.shape[0]} cells, {y.mean():.3f} labeled")
+    return HistGradientBoostingClassifier(random_state=seed).fit(x, y)
+
+
+def _source_attrs(proposal_file):
+    """Attributes describing the month file the proposals were computed from, empty if there are none."""
+    if not os.path.exists(proposal_file):
+        return {}
+    try:
+        with h5py.File(proposal_file, 'r') as f:
+            return {key: f.attrs[key] for key in ['tec_hash', 'source_mtime', 'source_size'] if key in f.attrs}
+    except OSError:
+        return {}
+
+
+def prelabel_file(args):
+    """Write the proposals of one month file, `block_size` maps at a time. Unless `force` is set, nothing is
+    written if the proposals were computed from the same TEC.
+
+    Returns
+    -------
+    (file name, number of maps) or None if the proposals were up to date
+    """
+    fn, proposal_file, mlat_vals, mlt_vals, method, model, block_size, force = args
+    stat = os.stat(fn)
+    digest = utils.tec_hash(fn)
+    if not force and _source_attrs(proposal_file).get('tec_hash') == digest:
+        with h5py.File(proposal_file, 'r+') as f:
+            f.attrs['source_mtime'], f.attrs['source_size'] = stat.st_mtime_ns, stat.st_size
+        return None
+    tmp_file = proposal_file + '.tmp'
+    with h5py.File(fn, 'r') as f:
+        n_mlat, n_mlt, n_maps = f['tec'].shape
+    with h5py.File(tmp_file, 'w') as f:
+        packed_mlt = (n_mlt + 7) // 8
+        labels = f.create_dataset('labels', shape=(n_mlat, packed_mlt, n_maps), dtype=np.uint8,
+                                  chunks=(n_mlat, packed_mlt, 1), compression='lzf')
+        labels.attrs['packed'] = True
+        labels.attrs['mlt_size'] = n_mlt
+        f.attrs['method'] = method
+        f.attrs['tec_hash'] = digest
+        f.attrs['source_mtime'], f.attrs['source_size'] = stat.st_mtime_ns, stat.st_size
+        for start in range(0, n_maps, block_size):
+            tec = utils.read_maps(fn, start, start + block_size)[0]
+            if method == 'model':
+                proposals = model_proposals(model, tec, mlat_vals, mlt_vals)
+            else:
+                proposals = threshold_proposals(tec, mlat_vals, mlt_vals)
+            labels[:, :, start:start + tec.shape[2]] = np.packbits(proposals, axis=1)
+    os.replace(tmp_file, proposal_file)
+    return os.path.basename(fn), n_maps
+
+
+def prelabel_dataset(data_dir, proposal_dir, mlat_vals, mlt_vals, method='threshold', model=None, force=False,
+                     max_workers=None, block_size=64):
+    """Write proposals for every month file of `data_dir` which doesn't have up to date proposals. Files which
+    weren't modified since their proposals were written are skipped without being opened, modified files are
+    only processed again if their TEC changed.
+
+    Returns
+    -------
+    list
+        (file name, number of maps) of the processed month files
+    """
+    os.makedirs(proposal_dir, exist_ok=True)
+    jobs = []
+    for fn in sorted(glob.glob(os.path.join(data_dir, "*_tec.h5"))):
+        year, month = (int(s) for s in os.path.basename(fn).split('_')[:2])
+        proposal_file = os.path.join(proposal_dir, PROPOSAL_FILE_PATTERN.format(year=year, month=month))
+        stat = os.stat(fn)
+        attrs = _source_attrs(proposal_file)
+        if not force and attrs.get('source_mtime') == stat.st_mtime_ns and attrs.get('source_size') == stat.st_size:
+            continue
+        jobs.append((fn, proposal_file, mlat_vals, mlt_vals, method, model, block_size, force))
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return [result for result in executor.map(prelabel_file, jobs) if result is not None]
+
+
+def read_proposal(proposal_dir, year, month, index):
+    """Proposed labels of a map, None if there are no proposals for its month.
+
+    Returns
+    -------
+    numpy.ndarray (mlat, mlt) bool
+    """
+    fn = os.path.join(proposal_dir, PROPOSAL_FILE_PATTERN.format(year=int(year), month=int(month)))
+    if not os.path.exists(fn):
+        return None
+    try:
+        with h5py.File(fn, 'r') as f:
+            return utils.read_label_slice(f['labels'], int(index))
+    except (OSError, KeyError, IndexError):
+        logger.warning(f"Could not read proposal {index} from {fn}")
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write automatic label proposals for all maps")
+    parser.add_argument('--method', choices=['threshold', 'model'], default='threshold')
+    parser.add_argument('--train', metavar='MODEL_FILE', help="train a model on the done list and save it")
+    parser.add_argument('--model', metavar='MODEL_FILE', help="model used by the `model` method")
+    parser.add_argument('--force', action='store_true', help="rewrite up to date proposals")
+    parser.add_argument('--jobs', type=int, default=None, help="number of worker processes")
+    args = parser.parse_args(argv)
+
+    from teclab import config
+    if args.train:
+        model = train_model(config.progress_store.done_list(), config.data_file_name, config.mlat_vals,
+                            config.mlt_vals)
+        with open(args.train, 'wb') as f:
+            pickle.dump(model, f)
+        print(f"saved model to {args.train}")
+        return 0
+    model = None
+    if args.method == 'model':
+        if args.model is None:
+            parser.error("--method model needs --model")
+        with open(args.model, 'rb') as f:
+            model = pickle.load(f)
+    results = prelabel_dataset(config.data_base_dir, config.proposal_dir, config.mlat_vals, config.mlt_vals,
+                               args.method, model, args.force, args.jobs)
+    for name, n_maps in results:
+        print(f"{name}: {n_maps} proposals")
+    print(f"wrote proposals for {len(results)} month files to {config.proposal_dir}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
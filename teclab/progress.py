@@ -0,0 +1,214 @@
+import os
+import json
+import time
+import getpass
+import sqlite3
+import threading
+import logging
+
+from teclab.sampling import UNLABELED, DONE, UNSURE
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS journal (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    year INTEGER NOT NULL,
+    month INTEGER NOT NULL,
+    idx INTEGER NOT NULL,
+    status INTEGER NOT NULL,
+    time REAL NOT NULL,
+    annotator TEXT
+);
+CREATE INDEX IF NOT EXISTS journal_map ON journal (year, month, idx);
+CREATE TABLE IF NOT EXISTS status (
+    year INTEGER NOT NULL,
+    month INTEGER NOT NULL,
+    idx INTEGER NOT NULL,
+    status INTEGER NOT NULL,
+    time REAL NOT NULL,
+    PRIMARY KEY (year, month, idx)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS status_status ON status (status);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class ProgressStore:
+    """Labeling progress kept in a local SQLite database.
+
+    Every status change is appended to the `journal` table and applied to the indexed `status` table in the same
+    transaction, so lookups never scan and nothing is rewritten on save. The database uses write-ahead logging
+    and immediate transactions so several annotator processes can share one dataset directory. Superseded
+    journal rows are dropped every `compact_every` writes.
+
+    Parameters
+    ----------
+    db_file: str
+    timeout: float
+        seconds to wait for another process holding the write lock
+    compact_every: int
+    annotator: str
+        recorded with every journal entry, defaults to the login name
+    """
+
+    def __init__(self, db_file, timeout=30, compact_every=1000, annotator=None):
+        self.db_file = db_file
+        self.compact_every = compact_every
+        self.annotator = annotator if annotator is not None else getpass.getuser()
+        self._n_writes = 0
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_file, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+    def set_status(self, year, month, index, status, annotator=None):
+        """Record a status change.
+
+        Parameters
+        ----------
+        year, month, index: int
+        status: int
+            `UNLABELED`, `DONE` or `UNSURE`
+        annotator: str
+            defaults to `self.annotator`
+        """
+        self.set_many([(year, month, index, status)], annotator)
+
+    def record(self, current_map, annotator=None):
+        """Record a saved map as done, or as unsure if `current_map['unsure']` is set."""
+        status = UNSURE if current_map['unsure'] else DONE
+        self.set_status(current_map['year'], current_map['month'], current_map['index'], status, annotator)
+
+    def set_many(self, changes, annotator=None):
+        """Record several status changes in one transaction.
+
+        Parameters
+        ----------
+        changes: list
+            (year, month, index, status) tuples
+        annotator: str
+            defaults to `self.annotator`
+        """
+        annotator = self.annotator if annotator is None else annotator
+        now = time.time()
+        rows = [(int(y), int(m), int(i), int(s), now) for y, m, i, s in changes]
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.executemany(
+                    "INSERT INTO journal (year, month, idx, status, time, annotator) VALUES (?, ?, ?, ?, ?, ?)",
+                    [row + (annotator, ) for row in rows])
+                self.conn.executemany(
+                    "INSERT INTO status (year, month, idx, status, time) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (year, month, idx) DO UPDATE SET status = excluded.status, time = excluded.time",
+                    rows)
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self._n_writes += len(rows)
+            compact = self._n_writes >= self.compact_every
+        if compact:
+            self.compact()
+
+    def get_status(self, year, month, index):
+        with self._lock:
+            row = self.conn.execute("SELECT status FROM status WHERE year = ? AND month = ? AND idx = ?",
+                                    (int(year), int(month), int(index))).fetchone()
+        return UNLABELED if row is None else row[0]
+
+    def __contains__(self, key):
+        return self.get_status(*key) != UNLABELED
+
+    def maps_with_status(self, status):
+        """(year, month, index) tuples of every map with `status`, in time order."""
+        with self._lock:
+            rows = self.conn.execute("SELECT year, month, idx FROM status WHERE status = ? ORDER BY year, month, idx",
+                                     (int(status), )).fetchall()
+        return [tuple(row) for row in rows]
+
+    def done_list(self):
+        return self.maps_with_status(DONE)
+
+    def unsure_list(self):
+        return self.maps_with_status(UNSURE)
+
+    def changes_since(self, journal_id):
+        """Journal entries newer than `journal_id`, for picking up changes made by other processes.
+
+        Returns
+        -------
+        changes: list
+            (id, year, month, index, status) tuples
+        """
+        with self._lock:
+            rows = self.conn.execute("SELECT id, year, month, idx, status FROM journal WHERE id > ? ORDER BY id",
+                                     (int(journal_id), )).fetchall()
+        return [tuple(row) for row in rows]
+
+    def compact(self):
+        """Drop journal entries which have been superseded by a later change of the same map."""
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = self.conn.execute(
+                    "DELETE FROM journal WHERE id NOT IN (SELECT MAX(id) FROM journal GROUP BY year, month, idx)")
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self._n_writes = 0
+        logger.info(f"Compacted progress journal, removed {cursor.rowcount} entries")
+        return cursor.rowcount
+
+    def import_json(self, done_list_file, unsure_list_file):
+        """One-time import of the `labeled.json` / `unsure.json` lists, skipped if it has already happened.
+
+        Returns
+        -------
+        bool
+            whether the lists were imported
+        """
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                if self.conn.execute("SELECT 1 FROM meta WHERE key = 'json_imported'").fetchone() is not None:
+                    self.conn.execute("ROLLBACK")
+                    return False
+                now = time.time()
+                rows = [(*key, DONE) for key in _read_json_list(done_list_file)]
+                rows += [(*key, UNSURE) for key in _read_json_list(unsure_list_file)]
+                rows = [(int(y), int(m), int(i), s, now) for y, m, i, s in rows]
+                self.conn.executemany(
+                    "INSERT INTO journal (year, month, idx, status, time, annotator) VALUES (?, ?, ?, ?, ?, 'json')",
+                    rows)
+                self.conn.executemany(
+                    "INSERT INTO status (year, month, idx, status, time) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (year, month, idx) DO UPDATE SET status = excluded.status, time = excluded.time",
+                    rows)
+                self.conn.execute("INSERT INTO meta (key, value) VALUES ('json_imported', ?)", (str(now), ))
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        logger.info(f"Imported {len(rows)} entries from {done_list_file} and {unsure_list_file}")
+        return True
+
+
+def _read_json_list(fn):
+    if not os.path.exists(fn):
+        return []
+    with open(fn) as f:
+        data = json.load(f)
+    if 'list' not in data:
+        return []
+    return data['list']
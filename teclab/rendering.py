@@ -0,0 +1,277 @@
+import os
+import hashlib
+import logging
+
+import numpy as np
+import matplotlib
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib import colormaps
+
+logger = logging.getLogger(__name__)
+
+
+def format_polar_mag_ax(ax):
+    ax.tick_params(axis='both', which='both', bottom=False, top=False, left=False, right=False, labelbottom=False,
+                   labeltop=False, labelleft=False, labelright=False)
+    ax.set_ylim(0, 60)
+    ax.set_xticks(np.arange(8) * np.pi / 4)
+    ax.set_xticklabels((np.arange(8) * 3 + 6) % 24)
+    ax.set_yticks([10, 20, 30, 40, 50])
+    ax.set_yticklabels([80, 70, 60, 50, 40])
+    ax.grid()
+    ax.tick_params(axis='x', which='both', bottom=True, labelbottom=True)
+    ax.tick_params(axis='y', which='both', left=True, labelleft=True, width=0, length=0)
+    ax.set_rlabel_position(80)
+
+
+def grid_bins(theta, r):
+    """Cell edges of the (mlat, mlt) grid in polar coordinates, the same cells pcolormesh draws with
+    `shading='nearest'`.
+
+    Parameters
+    ----------
+    theta, r: numpy.ndarray (mlat, mlt)
+
+    Returns
+    -------
+    theta_bins: numpy.ndarray (mlt + 1, ), increasing
+    r_bins: numpy.ndarray (mlat + 1, ), increasing
+    """
+    theta_centers = theta[0]
+    r_centers = np.sort(r[:, 0])
+    theta_bins = np.concatenate(([1.5 * theta_centers[0] - .5 * theta_centers[1]],
+                                 (theta_centers[1:] + theta_centers[:-1]) / 2,
+                                 [1.5 * theta_centers[-1] - .5 * theta_centers[-2]]))
+    r_bins = np.concatenate(([1.5 * r_centers[0] - .5 * r_centers[1]],
+                             (r_centers[1:] + r_centers[:-1]) / 2,
+                             [1.5 * r_centers[-1] - .5 * r_centers[-2]]))
+    return theta_bins, r_bins
+
+
+def pixel_cell_index(ax, theta, r, size):
+    """For every display pixel of `ax`'s figure, the flat index into an (mlat, mlt) map of the grid cell under
+    the pixel center, or -1 if the pixel isn't over the grid.
+
+    Parameters
+    ----------
+    ax: matplotlib polar axes, already laid out
+    theta, r: numpy.ndarray (mlat, mlt)
+    size: tuple
+        (width, height) of the canvas in pixels
+
+    Returns
+    -------
+    cell_index: numpy.ndarray (width, height)
+        indexed [x, y] with y increasing upward, like the image arrays of the image items
+    """
+    width, height = size
+    X, Y = np.meshgrid(np.arange(width) + .5, np.arange(height) + .5, indexing='ij')
+    tr = ax.transData.inverted().transform(np.column_stack((X.ravel(), Y.ravel())))
+    t, rad = tr[:, 0], tr[:, 1]
+    theta_bins, r_bins = grid_bins(theta, r)
+    t = np.where(t > theta_bins[-1], t - 2 * np.pi, t)
+    t = np.where(t < theta_bins[0], t + 2 * np.pi, t)
+    t_ind = np.searchsorted(theta_bins, t, side='right') - 1
+    r_ind = np.searchsorted(r_bins, rad, side='right') - 1
+    valid = ((t_ind >= 0) & (t_ind < theta.shape[1]) & (r_ind >= 0) & (r_ind < r.shape[0]) &
+             (rad <= ax.get_ylim()[1]))
+    # r_bins are increasing, map rows back to the order of the grid
+    rows = np.argsort(r[:, 0])[np.clip(r_ind, 0, r.shape[0] - 1)]
+    cell_index = np.where(valid, rows * theta.shape[1] + np.clip(t_ind, 0, theta.shape[1] - 1), -1)
+    return cell_index.reshape((width, height))
+
+
+def load_or_compute_cell_index(ax, theta, r, size, cache_dir=None):
+    """`pixel_cell_index`, persisted as a .npy file in `cache_dir`. The file name is derived from the grid, the
+    canvas size, the axes placement and the matplotlib version so a stale mapping is never loaded.
+
+    Parameters
+    ----------
+    ax: matplotlib polar axes, already laid out
+    theta, r: numpy.ndarray (mlat, mlt)
+    size: tuple
+    cache_dir: str
+        no persistence if None
+
+    Returns
+    -------
+    cell_index: numpy.ndarray (width, height)
+    """
+    if cache_dir is None:
+        return pixel_cell_index(ax, theta, r, size)
+    key = hashlib.sha1()
+    key.update(np.ascontiguousarray(theta, dtype=float).tobytes())
+    key.update(np.ascontiguousarray(r, dtype=float).tobytes())
+    key.update(repr((tuple(size), tuple(np.round(ax.get_window_extent().bounds, 3)), ax.get_ylim(),
+                     matplotlib.__version__)).encode())
+    fn = os.path.join(cache_dir, f"pixel_cell_index_{key.hexdigest()[:16]}.npy")
+    if os.path.exists(fn):
+        try:
+            cell_index = np.load(fn)
+            if cell_index.shape == tuple(size):
+                return cell_index
+        except (OSError, ValueError):
+            pass
+        logger.warning(f"Ignoring unreadable pixel to cell mapping {fn}")
+    cell_index = pixel_cell_index(ax, theta, r, size)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_file = fn + '.tmp.npy'
+        np.save(tmp_file, cell_index)
+        os.replace(tmp_file, fn)
+    except OSError:
+        logger.warning(f"Could not save pixel to cell mapping to {cache_dir}")
+    return cell_index
+
+
+class PolarRenderer:
+    """Renders (mlat, mlt) maps onto the polar magnetic axes without going through matplotlib for every map.
+
+    Once per grid the figure is laid out, the static polar grid, ticks and labels are drawn to a cached RGBA
+    overlay and every display pixel is assigned to the grid cell under it (`pixel_cell_index`). Rendering a map
+    is then a gather of the map values into display pixels (`gather`), a lookup into a 256 entry colormap table
+    (`colorize`) and a blend with the overlay. Changing the colour range only repeats the last two steps.
+
+    Parameters
+    ----------
+    theta, r: numpy.ndarray (mlat, mlt)
+    figsize: tuple
+        inches
+    dpi: int
+    cmap: str
+    cache_dir: str
+        where to persist the pixel to cell mapping, see `load_or_compute_cell_index`
+    """
+
+    def __init__(self, theta, r, figsize=(10, 10), dpi=100, cmap='viridis', cache_dir=None):
+        self.theta = theta
+        self.r = r
+        self.fig = Figure(figsize=figsize, dpi=dpi, tight_layout=True)
+        self.canvas = FigureCanvasAgg(self.fig)
+        self.ax = self.fig.add_subplot(projection='polar')
+        format_polar_mag_ax(self.ax)
+        self.fig.patch.set_alpha(0)
+        self.ax.patch.set_alpha(0)
+        self.canvas.draw()
+        self.size = self.canvas.get_width_height()
+        self.overlay = self._to_image(np.array(self.canvas.buffer_rgba()))
+        overlay_mask = self.overlay[:, :, 3] > 0
+        self._overlay_pixels = np.nonzero(overlay_mask)
+        self._overlay_rgba = self.overlay[overlay_mask].astype(float) / 255
+        self.cell_index = load_or_compute_cell_index(self.ax, theta, r, self.size, cache_dir)
+        flat_index = self.cell_index.ravel()
+        self._valid_pixels = np.flatnonzero(flat_index >= 0)
+        self._valid_cells = flat_index[self._valid_pixels]
+        self.cell_pixel_counts = np.bincount(self._valid_cells, minlength=theta.size)
+        self.set_cmap(cmap)
+
+    def set_cmap(self, cmap):
+        self.cmap = cmap
+        self.lut = (colormaps[cmap](np.linspace(0, 1, 256)) * 255).round().astype(np.uint8)
+        self.lut[:, 3] = 255
+
+    def gather(self, tec_map):
+        """Map values at every display pixel, NaN where there is no data.
+
+        Parameters
+        ----------
+        tec_map: numpy.ndarray (mlat, mlt)
+
+        Returns
+        -------
+        numpy.ndarray (width, height)
+        """
+        flat = np.append(np.asarray(tec_map, dtype=float).ravel(), np.nan)
+        return flat[self.cell_index]
+
+    def colorize(self, values, vmin=0, vmax=20):
+        """Apply the colormap to gathered pixel values, NaN pixels are transparent.
+
+        Parameters
+        ----------
+        values: numpy.ndarray (width, height)
+        vmin, vmax: float
+
+        Returns
+        -------
+        rgba: numpy.ndarray (width, height, 4) uint8
+        """
+        finite = np.isfinite(values)
+        if vmax > vmin:
+            scaled = (np.where(finite, values, vmin) - vmin) * (self.lut.shape[0] / (vmax - vmin))
+        else:
+            scaled = np.zeros(values.shape)
+        rgba = self.lut[np.clip(scaled, 0, self.lut.shape[0] - 1).astype(np.intp)]
+        rgba[~finite] = 0
+        return rgba
+
+    def render_mask(self, mask, color=(255, 0, 0, 255)):
+        """Render a boolean (mlat, mlt) map, e.g. saved labels, in a single colour with the overlay.
+
+        Parameters
+        ----------
+        mask: numpy.ndarray (mlat, mlt)
+        color: tuple
+            RGBA
+
+        Returns
+        -------
+        rgba: numpy.ndarray (width, height, 4) uint8
+        """
+        values = self.gather(np.asarray(mask, dtype=float))
+        rgba = np.zeros(values.shape + (4, ), dtype=np.uint8)
+        rgba[values > .5] = color
+        return self.composite(rgba)
+
+    def pixels_to_grid(self, pixel_img, threshold=.5):
+        """Average a display image (e.g. a brush mask) over each grid cell with a single `np.bincount`.
+
+        Parameters
+        ----------
+        pixel_img: numpy.ndarray (width, height)
+        threshold: float
+
+        Returns
+        -------
+        numpy.ndarray (mlat, mlt) bool
+            cells whose mean pixel value is above `threshold`, cells without pixels are False
+        """
+        sums = np.bincount(self._valid_cells, weights=np.asarray(pixel_img, dtype=float).ravel()[self._valid_pixels],
+                           minlength=self.theta.size)
+        mean = np.divide(sums, self.cell_pixel_counts, out=np.zeros(sums.shape), where=self.cell_pixel_counts > 0)
+        return (mean > threshold).reshape(self.theta.shape)
+
+    def composite(self, rgba):
+        """Blend the cached overlay over a colorized map in place."""
+        below = rgba[self._overlay_pixels].astype(float) / 255
+        above = self._overlay_rgba
+        alpha = above[:, 3:] + below[:, 3:] * (1 - above[:, 3:])
+        color = above[:, :3] * above[:, 3:] + below[:, :3] * below[:, 3:] * (1 - above[:, 3:])
+        color = np.divide(color, alpha, out=np.zeros_like(color), where=alpha > 0)
+        rgba[self._overlay_pixels] = (np.column_stack((color, alpha)) * 255).round().astype(np.uint8)
+        return rgba
+
+    def render(self, tec_map=None, vmin=0, vmax=20, values=None):
+        """Full rendering of a map (or just the overlay if `tec_map` is None).
+
+        Parameters
+        ----------
+        tec_map: numpy.ndarray (mlat, mlt)
+        vmin, vmax: float
+        values: numpy.ndarray (width, height)
+            previously gathered pixel values of the map, skips the gather step
+
+        Returns
+        -------
+        rgba: numpy.ndarray (width, height, 4) uint8
+        """
+        if values is None:
+            if tec_map is None:
+                return self.overlay.copy()
+            values = self.gather(tec_map)
+        return self.composite(self.colorize(values, vmin, vmax))
+
+    @staticmethod
+    def _to_image(buffer):
+        return np.ascontiguousarray(np.swapaxes(buffer[::-1], 0, 1))
@@ -0,0 +1,158 @@
+"""Rewrite the monthly `*tec.h5` files with a chunk layout aligned to single maps.
+
+    python -m teclab.repack SRC_DIR DST_DIR [--time-chunk 1] [--compression lzf] [--jobs N]
+
+`tec` is chunked as (mlat, mlt, time_chunk) and compressed, `labels` is bit-packed along mlt (see
+`utils.read_label_slice`) with the same chunking. Every repacked file is verified against its source and the
+average single map read latency of both datasets is reported.
+"""
+import os
+import glob
+import time
+import shutil
+import argparse
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import h5py
+
+from teclab import utils
+
+logger = logging.getLogger(__name__)
+
+COMPRESSION = {
+    'lzf': {'compression': 'lzf'},
+    'gzip': {'compression': 'gzip', 'compression_opts': 1},
+    'none': {},
+}
+
+
+def repack_file(src, dst, time_chunk=1, compression='lzf', block_size=64):
+    """Write a repacked copy of month file `src` to `dst`, copying `block_size` maps at a time.
+
+    Parameters
+    ----------
+    src, dst: str
+    time_chunk: int
+        number of maps per chunk
+    compression: str
+        key of `COMPRESSION`
+    block_size: int
+    """
+    filters = COMPRESSION[compression]
+    tmp_file = dst + '.tmp'
+    with h5py.File(src, 'r') as f_in, h5py.File(tmp_file, 'w') as f_out:
+        n_mlat, n_mlt, n_maps = f_in['tec'].shape
+        time_chunk = max(1, min(time_chunk, n_maps))
+        tec = f_out.create_dataset('tec', shape=(n_mlat, n_mlt, n_maps), dtype=f_in['tec'].dtype,
+                                   chunks=(n_mlat, n_mlt, time_chunk), shuffle=bool(filters), **filters)
+        packed_mlt = (n_mlt + 7) // 8
+        labels = f_out.create_dataset('labels', shape=(n_mlat, packed_mlt, n_maps), dtype=np.uint8,
+                                      chunks=(n_mlat, packed_mlt, time_chunk), **filters)
+        labels.attrs['packed'] = True
+        labels.attrs['mlt_size'] = n_mlt
+        f_out.create_dataset('start_time', data=f_in['start_time'][()])
+        for start in range(0, n_maps, block_size):
+            stop = min(start + block_size, n_maps)
+            tec[:, :, start:stop] = f_in['tec'][:, :, start:stop]
+            block_labels = utils.read_label_slice(f_in['labels'], slice(start, stop))
+            labels[:, :, start:stop] = np.packbits(block_labels, axis=1)
+        f_out.attrs['layout'] = 'per-map'
+    os.replace(tmp_file, dst)
+
+
+def verify_file(src, dst, block_size=64):
+    """Check that `dst` holds exactly the same maps as `src`.
+
+    Returns
+    -------
+    bool
+    """
+    with h5py.File(src, 'r') as f_a, h5py.File(dst, 'r') as f_b:
+        if f_a['tec'].shape != f_b['tec'].shape:
+            return False
+        if not np.array_equal(f_a['start_time'][()], f_b['start_time'][()]):
+            return False
+        for start in range(0, f_a['tec'].shape[2], block_size):
+            index = slice(start, start + block_size)
+            if not np.array_equal(f_a['tec'][:, :, index], f_b['tec'][:, :, index], equal_nan=True):
+                return False
+            if not np.array_equal(utils.read_label_slice(f_a['labels'], index),
+                                  utils.read_label_slice(f_b['labels'], index)):
+                return False
+    return True
+
+
+def _repack_and_verify(args):
+    src, dst, time_chunk, compression, verify = args
+    repack_file(src, dst, time_chunk, compression)
+    ok = verify_file(src, dst) if verify else None
+    return os.path.basename(src), os.path.getsize(src), os.path.getsize(dst), ok
+
+
+def read_latency(files, n_samples=50, seed=0):
+    """Average wall time of `utils.open_map` for random maps of `files`, in seconds."""
+    rng = np.random.default_rng(seed)
+    sizes = {}
+    for fn in files:
+        with h5py.File(fn, 'r') as f:
+            sizes[fn] = f['start_time'].shape[0]
+    samples = [(files[i], rng.integers(sizes[files[i]])) for i in rng.integers(len(files), size=n_samples)]
+    t0 = time.perf_counter()
+    for fn, index in samples:
+        utils.open_map({'h5_file': fn, 'index': index})
+    return (time.perf_counter() - t0) / max(n_samples, 1)
+
+
+def repack_dataset(src_dir, dst_dir, time_chunk=1, compression='lzf', max_workers=None, verify=True):
+    """Repack every month file of `src_dir` into `dst_dir` in parallel and copy `grid.h5` along.
+
+    Returns
+    -------
+    results: list
+        (file name, source bytes, repacked bytes, verified) tuples
+    """
+    os.makedirs(dst_dir, exist_ok=True)
+    files = sorted(glob.glob(os.path.join(src_dir, "*tec.h5")))
+    jobs = [(fn, os.path.join(dst_dir, os.path.basename(fn)), time_chunk, compression, verify) for fn in files]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(_repack_and_verify, jobs))
+    grid_file = os.path.join(src_dir, "grid.h5")
+    if os.path.exists(grid_file):
+        shutil.copy2(grid_file, os.path.join(dst_dir, "grid.h5"))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Repack TEC month files with a per-map chunk layout")
+    parser.add_argument('src_dir')
+    parser.add_argument('dst_dir')
+    parser.add_argument('--time-chunk', type=int, default=1, help="maps per chunk")
+    parser.add_argument('--compression', choices=list(COMPRESSION), default='lzf')
+    parser.add_argument('--jobs', type=int, default=None, help="number of worker processes")
+    parser.add_argument('--no-verify', action='store_true', help="skip the round trip check")
+    parser.add_argument('--samples', type=int, default=50, help="random map reads for the latency report")
+    args = parser.parse_args(argv)
+    if os.path.abspath(args.src_dir) == os.path.abspath(args.dst_dir):
+        parser.error("src_dir and dst_dir must differ")
+
+    results = repack_dataset(args.src_dir, args.dst_dir, args.time_chunk, args.compression, args.jobs,
+                             not args.no_verify)
+    failed = [name for name, _, _, ok in results if ok is False]
+    for name, src_size, dst_size, ok in results:
+        status = {True: "verified", False: "MISMATCH", None: "not verified"}[ok]
+        print(f"{name}: {src_size / 2 ** 20:.1f} MB -> {dst_size / 2 ** 20:.1f} MB, {status}")
+    if results:
+        names = [name for name, *_ in results]
+        before = read_latency([os.path.join(args.src_dir, name) for name in names], args.samples)
+        after = read_latency([os.path.join(args.dst_dir, name) for name in names], args.samples)
+        print(f"map read latency: {before * 1e3:.2f} ms -> {after * 1e3:.2f} ms")
+    if failed:
+        print(f"round trip verification failed for: {', '.join(failed)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,282 @@
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+UNLABELED = 0
+DONE = 1
+UNSURE = 2
+
+
+class IndexedSet:
+    """Set of integers supporting O(1) add, remove and uniform random choice."""
+
+    def __init__(self, items=()):
+        self._items = []
+        self._positions = {}
+        for item in items:
+            self.add(item)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, item):
+        return item in self._positions
+
+    def add(self, item):
+        if item in self._positions:
+            return
+        self._positions[item] = len(self._items)
+        self._items.append(item)
+
+    def discard(self, item):
+        position = self._positions.pop(item, None)
+        if position is None:
+            return
+        last = self._items.pop()
+        if position < len(self._items):
+            self._items[position] = last
+            self._positions[last] = position
+
+    def choice(self, rng):
+        return self._items[rng.integers(len(self._items))]
+
+
+class MapSampler:
+    """Status index over every map in `map_tree` with constant time sampling of unlabeled maps.
+
+    Maps are numbered in time order (year, month, index) and each has a status: `UNLABELED`, `DONE` or
+    `UNSURE`. Sets of unlabeled maps (overall and per month) and of unsure maps are maintained as the status
+    changes so that strategies can draw from them directly instead of rejection sampling.
+
+    Parameters
+    ----------
+    map_tree: dict
+        see `utils.get_map_tree`
+    done_list, unsure_list: list
+        (year, month, index) tuples
+    seed: int
+    """
+
+    def __init__(self, map_tree, done_list=(), unsure_list=(), seed=None):
+        self.rng = np.random.default_rng(seed)
+        self.months = []
+        self._offsets = {}
+        years, months, indices, datetimes = [], [], [], []
+        n = 0
+        for year in map_tree:
+            for month in map_tree[year]:
+                size = len(map_tree[year][month]['index'])
+                self._offsets[(int(year), int(month))] = (n, size)
+                self.months.append((year, month))
+                years.append(np.full(size, year))
+                months.append(np.full(size, month))
+                indices.append(np.asarray(map_tree[year][month]['index']))
+                datetimes.append(map_tree[year][month]['datetime'])
+                n += size
+        self.years = np.concatenate(years) if years else np.empty(0, dtype=int)
+        self.month_numbers = np.concatenate(months) if months else np.empty(0, dtype=int)
+        self.indices = np.concatenate(indices) if indices else np.empty(0, dtype=int)
+        self.datetimes = np.concatenate(datetimes) if datetimes else np.empty(0, dtype=object)
+        self.datetimes64 = self.datetimes.astype('datetime64[us]')
+        self.month_ids = np.repeat(np.arange(len(self.months)), [self._offsets[(int(y), int(m))][1] for y, m in self.months])
+
+        self.status = np.zeros(n, dtype=np.uint8)
+        # unlabeled maps left out of the sampling pools, see `set_excluded` and `exclude`
+        self.excluded = np.zeros(n, dtype=bool)
+        self.unloadable = np.zeros(n, dtype=bool)
+        for key in done_list:
+            flat = self.flat_index(*key)
+            if flat is not None:
+                self.status[flat] = DONE
+        for key in unsure_list:
+            flat = self.flat_index(*key)
+            if flat is not None:
+                self.status[flat] = UNSURE
+
+        unlabeled = np.flatnonzero(self.status == UNLABELED)
+        self.unlabeled = IndexedSet(unlabeled.tolist())
+        self.unsure = IndexedSet(np.flatnonzero(self.status == UNSURE).tolist())
+        self.unlabeled_by_month = [IndexedSet() for _ in self.months]
+        for flat, month_id in zip(unlabeled.tolist(), self.month_ids[unlabeled].tolist()):
+            self.unlabeled_by_month[month_id].add(flat)
+        self.months_with_unlabeled = IndexedSet(i for i, s in enumerate(self.unlabeled_by_month) if len(s))
+
+    def __len__(self):
+        return self.status.shape[0]
+
+    def flat_index(self, year, month, index):
+        """Position of a map in the status index, None if it isn't in the map tree."""
+        offset, size = self._offsets.get((int(year), int(month)), (0, 0))
+        if not 0 <= int(index) < size:
+            return None
+        return offset + int(index)
+
+    def key(self, flat):
+        """(year, month, index, datetime) of a position in the status index."""
+        return self.years[flat], self.month_numbers[flat], self.indices[flat], self.datetimes[flat]
+
+    def get_status(self, year, month, index):
+        return int(self.status[self.flat_index(year, month, index)])
+
+    def set_status(self, year, month, index, status):
+        """Update the status of a map and the sets used for sampling.
+
+        Parameters
+        ----------
+        year, month, index: int
+        status: int
+            `UNLABELED`, `DONE` or `UNSURE`
+        """
+        flat = self.flat_index(year, month, index)
+        if flat is None:
+            raise KeyError(f"map {(year, month, index)} is not in the map tree")
+        self.status[flat] = status
+        month_id = int(self.month_ids[flat])
+        month_pool = self.unlabeled_by_month[month_id]
+        if status == UNLABELED and not self.excluded[flat]:
+            self.unlabeled.add(flat)
+            month_pool.add(flat)
+            self.months_with_unlabeled.add(month_id)
+        else:
+            self.unlabeled.discard(flat)
+            month_pool.discard(flat)
+            if not len(month_pool):
+                self.months_with_unlabeled.discard(month_id)
+        if status == UNSURE:
+            self.unsure.add(flat)
+        else:
+            self.unsure.discard(flat)
+
+    def hold(self, year, month, index):
+        """Take a map out of the sampling pools without changing its status, e.g. while it is leased to an
+        annotator. `release` puts it back according to its status."""
+        flat = self.flat_index(year, month, index)
+        if flat is None:
+            raise KeyError(f"map {(year, month, index)} is not in the map tree")
+        month_id = int(self.month_ids[flat])
+        self.unlabeled.discard(flat)
+        self.unlabeled_by_month[month_id].discard(flat)
+        if not len(self.unlabeled_by_month[month_id]):
+            self.months_with_unlabeled.discard(month_id)
+        self.unsure.discard(flat)
+
+    def release(self, year, month, index):
+        self.set_status(year, month, index, self.get_status(year, month, index))
+
+    def set_excluded(self, excluded):
+        """Leave unlabeled maps out of sampling, e.g. maps which are mostly empty. Their status isn't changed and
+        they are sampled again once they are no longer excluded.
+
+        Parameters
+        ----------
+        excluded: numpy.ndarray (n_maps, ) bool
+            in the order of the status index
+        """
+        excluded = np.asarray(excluded, dtype=bool) | self.unloadable
+        changed = np.flatnonzero(self.excluded != excluded)
+        self.excluded = excluded
+        for flat in changed.tolist():
+            self.set_status(*self.key(flat)[:3], self.status[flat])
+
+    def exclude(self, year, month, index):
+        """Leave a map which couldn't be loaded out of sampling for the rest of the session, whatever is passed to
+        `set_excluded` later."""
+        flat = self.flat_index(year, month, index)
+        if flat is None:
+            raise KeyError(f"map {(year, month, index)} is not in the map tree")
+        self.unloadable[flat] = True
+        self.excluded[flat] = True
+        self.set_status(year, month, index, self.status[flat])
+
+    def counts(self):
+        """Number of maps in each status."""
+        counts = np.bincount(self.status, minlength=3)
+        return {'unlabeled': int(counts[UNLABELED]), 'done': int(counts[DONE]), 'unsure': int(counts[UNSURE])}
+
+    def sample(self, strategy=None):
+        """Draw a map using `strategy` (`Uniform` by default).
+
+        Returns
+        -------
+        year, month, index, datetime
+        """
+        if strategy is None:
+            strategy = Uniform()
+        flat = strategy.draw(self)
+        if flat is None:
+            raise LookupError(f"No maps left to sample with {strategy}")
+        return self.key(flat)
+
+
+class Uniform:
+    """Uniformly random unlabeled map."""
+
+    def draw(self, sampler):
+        if not len(sampler.unlabeled):
+            return None
+        return sampler.unlabeled.choice(sampler.rng)
+
+    def __repr__(self):
+        return f"{type(self).__name__}()"
+
+
+class StratifiedByMonth(Uniform):
+    """Uniformly random month which still has unlabeled maps, then a uniformly random unlabeled map from it."""
+
+    def draw(self, sampler):
+        if not len(sampler.months_with_unlabeled):
+            return None
+        month_id = sampler.months_with_unlabeled.choice(sampler.rng)
+        return sampler.unlabeled_by_month[month_id].choice(sampler.rng)
+
+
+class RevisitUnsure(Uniform):
+    """Uniformly random map marked as unsure."""
+
+    def draw(self, sampler):
+        if not len(sampler.unsure):
+            return None
+        return sampler.unsure.choice(sampler.rng)
+
+
+class DateRange(Uniform):
+    """Uniformly random unlabeled map with `start <= datetime < end`.
+
+    Draws positions in the range and keeps the first unlabeled one, falling back to an exact draw over the
+    unlabeled maps in the range when the range is mostly labeled.
+
+    Parameters
+    ----------
+    start, end: numpy.datetime64 or str
+    max_tries: int
+    """
+
+    def __init__(self, start, end, max_tries=32):
+        self.start = np.datetime64(start)
+        self.end = np.datetime64(end)
+        self.max_tries = max_tries
+
+    def draw(self, sampler):
+        lo, hi = np.searchsorted(sampler.datetimes64, [self.start, self.end])
+        if hi <= lo:
+            return None
+        for flat in sampler.rng.integers(lo, hi, self.max_tries):
+            if sampler.status[flat] == UNLABELED and not sampler.excluded[flat]:
+                return int(flat)
+        candidates = lo + np.flatnonzero((sampler.status[lo:hi] == UNLABELED) & ~sampler.excluded[lo:hi])
+        if candidates.shape[0] == 0:
+            return None
+        return int(sampler.rng.choice(candidates))
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.start}, {self.end})"
+
+
+# strategies selectable from the gui
+STRATEGIES = {
+    'Uniform': Uniform,
+    'Stratified by month': StratifiedByMonth,
+    'Revisit unsure': RevisitUnsure,
+}
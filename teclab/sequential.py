@@ -0,0 +1,183 @@
+"""Step through the dataset in time order.
+
+`SequentialNavigator` keeps a cursor over the maps of a `MapSampler` (which numbers them in time order) and
+prepares the maps just ahead of it on a worker thread, like the `Prefetcher` does for random sampling.
+`MapWindow` keeps the maps around the cursor in the `MapCache`: it reads ahead with one hyperslab read per month
+file and evicts the maps left behind, so the read of the next month file happens in the background well before
+the cursor crosses into it.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from teclab import sampling
+
+logger = logging.getLogger(__name__)
+
+
+class MapWindow:
+    """Sliding window of maps kept in a `MapCache` around a cursor.
+
+    Parameters
+    ----------
+    cache: teclab.cache.MapCache
+    data_file_name: str
+        month file name pattern, see `config.data_file_name`
+    sampler: teclab.sampling.MapSampler
+    behind, ahead: int
+        maps kept before and loaded after the cursor, the window is refilled once less than `ahead // 2` maps
+        ahead of the cursor are loaded
+    """
+
+    def __init__(self, cache, data_file_name, sampler, behind=2, ahead=24):
+        self.cache = cache
+        self.data_file_name = data_file_name
+        self.sampler = sampler
+        self.behind = behind
+        self.ahead = ahead
+        self.n_reads = 0
+        # flat index range currently loaded
+        self._lo = self._hi = 0
+
+    def _file(self, flat):
+        return self.data_file_name.format(year=int(self.sampler.years[flat]),
+                                          month=int(self.sampler.month_numbers[flat]))
+
+    def _segments(self, lo, hi):
+        """Split the flat range `lo:hi` at month boundaries, (file, first index, stop index) per month."""
+        if hi <= lo:
+            return []
+        month_ids = self.sampler.month_ids[lo:hi]
+        bounds = np.concatenate([[0], np.flatnonzero(np.diff(month_ids)) + 1, [hi - lo]]) + lo
+        return [(self._file(a), int(self.sampler.indices[a]), int(self.sampler.indices[b - 1]) + 1)
+                for a, b in zip(bounds[:-1], bounds[1:])]
+
+    def advance(self, flat):
+        """Make sure the maps `flat - behind` to `flat + ahead` are cached and drop the ones behind.
+
+        Parameters
+        ----------
+        flat: int
+            cursor position, see `MapSampler.flat_index`
+        """
+        n = len(self.sampler)
+        lo = max(flat - self.behind, 0)
+        hi = min(flat + self.ahead + 1, n)
+        in_window = self._lo <= flat < self._hi
+        if in_window and (self._hi - flat > self.ahead // 2 or self._hi == n):
+            return
+        for fn, start, stop in self._segments(self._hi if in_window else lo, hi):
+            self.cache.load_block(fn, start, stop)
+            self.n_reads += 1
+        for a, b in [(self._lo, min(self._hi, lo)), (max(self._lo, hi), self._hi)]:
+            for fn, start, stop in self._segments(a, b):
+                for index in range(start, stop):
+                    self.cache.invalidate(fn, index)
+        logger.debug(f"Map window moved to {lo}:{hi}")
+        self._lo, self._hi = lo, hi
+
+
+class SequentialNavigator:
+    """Cursor over the maps of a `MapSampler` in time order, the maps up to `depth` steps ahead are prepared on
+    a worker thread.
+
+    Parameters
+    ----------
+    sampler: teclab.sampling.MapSampler
+    load: callable
+        `(year, month, index, datetime) -> entry`, run on the worker thread
+    window: MapWindow
+        optional, advanced on the worker thread before each load
+    depth: int
+    """
+
+    def __init__(self, sampler, load, window=None, depth=3):
+        self.sampler = sampler
+        self.load = load
+        self.window = window
+        self.depth = depth
+        self.position = None
+        self._entries = {}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="Sequential")
+
+    def first_unlabeled(self):
+        """Flat index of the earliest unlabeled map, the first map if everything is labeled."""
+        unlabeled = np.flatnonzero(self.sampler.status == sampling.UNLABELED)
+        return int(unlabeled[0]) if unlabeled.shape[0] else 0
+
+    def seek(self, year=None, month=None, index=None):
+        """Put the cursor on a map, on the earliest unlabeled map if no map is given. The map is returned by
+        the next `step(0)`."""
+        flat = self.first_unlabeled() if year is None else self.sampler.flat_index(year, month, index)
+        if flat is None:
+            raise KeyError(f"map {(year, month, index)} is not in the map tree")
+        self.position = flat
+        self._schedule()
+
+    def step(self, offset=1):
+        """Move the cursor by `offset` maps.
+
+        Returns
+        -------
+        key: tuple
+            (year, month, index, datetime)
+        entry:
+            return value of `load`
+
+        Raises
+        ------
+        LookupError
+            stepping past the first or last map
+        RuntimeError
+            `load` failed, the cursor stays on the map so the next step moves past it
+        """
+        if self.position is None:
+            self.seek()
+        flat = self.position + offset
+        if not 0 <= flat < len(self.sampler):
+            raise LookupError("No more maps in this direction")
+        self.position = flat
+        future = self._entries.get(flat)
+        if future is None:
+            future = self._submit(flat)
+        try:
+            entry = future.result()
+        except Exception as e:
+            self._entries.pop(flat, None)
+            self._schedule()
+            raise RuntimeError(f"Failed to load map {tuple(int(k) for k in self.sampler.key(flat)[:3])}: {e}") from e
+        self._schedule()
+        return self.sampler.key(flat), entry
+
+    def invalidate(self, year, month, index):
+        """Prepare a map again the next time it is needed, e.g. after its labels were saved."""
+        future = self._entries.pop(self.sampler.flat_index(year, month, index), None)
+        if future is not None:
+            future.cancel()
+
+    def _submit(self, flat):
+        future = self._executor.submit(self._prepare, flat, self.position)
+        self._entries[flat] = future
+        return future
+
+    def _prepare(self, flat, cursor):
+        if self.window is not None:
+            self.window.advance(cursor)
+        return self.load(*self.sampler.key(flat))
+
+    def _schedule(self):
+        """Keep the entries from one step behind to `depth` steps ahead of the cursor."""
+        keep = range(max(self.position - 1, 0), min(self.position + self.depth + 1, len(self.sampler)))
+        for flat in list(self._entries):
+            if flat not in keep:
+                self._entries.pop(flat).cancel()
+        for flat in keep:
+            if flat not in self._entries:
+                self._submit(flat)
+
+    def shutdown(self):
+        for future in self._entries.values():
+            future.cancel()
+        self._entries.clear()
+        self._executor.shutdown(wait=True)
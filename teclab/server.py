@@ -0,0 +1,372 @@
+"""Local labeling service for several annotators sharing one dataset directory.
+
+    python -m teclab.server [--data-dir DIR] [--host localhost] [--port 6010] [--lease-timeout 600]
+    python -m teclab --server localhost:6010
+
+The server owns the dataset: maps are served from its `MapCache`, every label save goes through its single
+`LabelWriter` and progress is recorded in its `ProgressStore`. Clients lease unlabeled maps, a leased map is not
+handed to anyone else until it is saved, released, its client disconnects or the lease times out. Clients connect
+with `multiprocessing.connection`, which unpickles every message, so only clients with the shared authkey are
+accepted: the `TECLAB_AUTHKEY` environment variable or else the random key the server writes to `server.key` in
+the dataset directory (readable by its owner only), see `load_authkey`.
+"""
+import os
+import time
+import socket
+import getpass
+import secrets
+import argparse
+import threading
+import ipaddress
+import logging
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client
+
+from teclab import sampling
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 6010
+AUTHKEY_ENV = "TECLAB_AUTHKEY"
+# shortest authkey accepted for a server reachable from other machines
+MIN_REMOTE_AUTHKEY_BYTES = 16
+
+
+def load_authkey(key_file=None, create=False):
+    """The authkey shared by the server and its clients, `TECLAB_AUTHKEY` if it is set and the contents of
+    `key_file` otherwise. There is no built-in default.
+
+    Parameters
+    ----------
+    key_file: str
+        see `config.authkey_file`
+    create: bool
+        write a random key to `key_file` if it doesn't exist, readable by the owner only
+
+    Returns
+    -------
+    bytes
+
+    Raises
+    ------
+    FileNotFoundError
+        no key in the environment or in `key_file`
+    """
+    key = os.environ.get(AUTHKEY_ENV)
+    if key:
+        return key.encode()
+    if key_file is None:
+        raise FileNotFoundError(f"No authkey, set {AUTHKEY_ENV}")
+    if create:
+        try:
+            fd = os.open(key_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            pass
+        else:
+            with os.fdopen(fd, 'w') as f:
+                f.write(secrets.token_hex(32))
+            logger.info(f"Wrote a new authkey to {key_file}")
+    if not os.path.exists(key_file):
+        raise FileNotFoundError(f"No authkey, set {AUTHKEY_ENV} or copy the server's {os.path.basename(key_file)} "
+                                f"to {key_file}")
+    with open(key_file) as f:
+        return f.read().strip().encode()
+
+
+def is_loopback(host):
+    try:
+        return ipaddress.ip_address(socket.gethostbyname(host)).is_loopback
+    except (OSError, ValueError):
+        return False
+
+
+def parse_address(address):
+    """`host:port` string -> (host, port)"""
+    host, _, port = address.rpartition(':')
+    return host or 'localhost', int(port)
+
+
+class LabelService:
+    """Dataset state shared by all clients, the methods are called from the connection threads.
+
+    Parameters
+    ----------
+    config: teclab.config.Config
+    lease_timeout: float
+        seconds after which a lease can be handed to another client
+    max_tries: int
+        samples drawn per lease before giving up on finding a map which isn't leased
+    """
+
+    def __init__(self, config, lease_timeout=600, max_tries=64):
+        self.config = config
+        self.lease_timeout = lease_timeout
+        self.max_tries = max_tries
+        self.leases = {}
+        self._lock = threading.Lock()
+
+    def _active_lease(self, key, now):
+        lease = self.leases.get(key)
+        if lease is not None and lease[1] < now:
+            self._drop_lease(key)
+            return None
+        return lease
+
+    def _drop_lease(self, key):
+        del self.leases[key]
+        self.config.map_sampler.release(*key)
+
+    def _expire_leases(self, now):
+        for key in [key for key, (_, expiry) in self.leases.items() if expiry < now]:
+            self._drop_lease(key)
+
+    def lease(self, client_id, strategy=None):
+        """Lease an unlabeled map drawn with `strategy`.
+
+        Returns
+        -------
+        year, month, index, datetime
+
+        Raises
+        ------
+        LookupError
+            no map left which isn't labeled or leased
+        """
+        now = time.time()
+        with self._lock:
+            self._expire_leases(now)
+            for _ in range(self.max_tries):
+                key = self.config.map_sampler.sample(strategy)
+                if self._active_lease(key[:3], now) is None:
+                    self.leases[key[:3]] = (client_id, now + self.lease_timeout)
+                    # leased maps aren't drawn again until they are released
+                    self.config.map_sampler.hold(*key[:3])
+                    return key
+        raise LookupError(f"No maps left to lease with {strategy}")
+
+    def release(self, client_id, year, month, index):
+        with self._lock:
+            key = (int(year), int(month), int(index))
+            if self.leases.get(key, (None, ))[0] == client_id:
+                self._drop_lease(key)
+
+    def release_all(self, client_id):
+        with self._lock:
+            for key in [key for key, (owner, _) in self.leases.items() if owner == client_id]:
+                self._drop_lease(key)
+
+    def get_map(self, year, month, index):
+        """tec, labels (mlat, mlt) of a map"""
+        tec, labels, _ = self.config.map_cache.get(self.config.data_file_name.format(year=year, month=month), index)
+        return tec, labels
+
+    def save(self, client_id, annotator, current_map, labels):
+        """Write the labels of a map and record its status, returns once both are on disk. The write doesn't
+        wait for the writer's `batch_delay`.
+
+        Raises
+        ------
+        PermissionError
+            the map is leased by another client
+        """
+        key = (int(current_map['year']), int(current_map['month']), int(current_map['index']))
+        h5_file = self.config.data_file_name.format(year=key[0], month=key[1])
+        current_map = dict(current_map, h5_file=h5_file)
+        with self._lock:
+            lease = self._active_lease(key, time.time())
+            if lease is not None and lease[0] != client_id:
+                raise PermissionError(f"map {key} is leased by another annotator")
+            if lease is not None:
+                self._drop_lease(key)
+            self.config.map_cache.update_labels(h5_file, key[2], labels)
+            status = sampling.UNSURE if current_map['unsure'] else sampling.DONE
+            self.config.map_sampler.set_status(*key, status)
+            write = self.config.label_writer.submit(current_map, labels, urgent=True)
+        write.result()
+        self.config.progress_store.record(current_map, annotator)
+        logger.info(f"{annotator} saved map {key}")
+
+    def counts(self):
+        with self._lock:
+            counts = self.config.map_sampler.counts()
+            counts['leased'] = len(self.leases)
+        return counts
+
+
+class LabelServer:
+    """Accepts client connections and serves each one on its own thread.
+
+    Parameters
+    ----------
+    service: LabelService
+    address: tuple
+        (host, port), port 0 picks a free port, see `self.address`
+    authkey: bytes
+        defaults to `load_authkey` with the `server.key` of the service's dataset, created if needed
+
+    Raises
+    ------
+    ValueError
+        listening on an address other machines can reach with an authkey shorter than `MIN_REMOTE_AUTHKEY_BYTES`
+    """
+    methods = {'lease', 'release', 'get_map', 'save', 'counts'}
+
+    def __init__(self, service, address=('localhost', 0), authkey=None):
+        self.service = service
+        self._authkey = authkey if authkey is not None else load_authkey(service.config.authkey_file, create=True)
+        if not is_loopback(address[0]) and len(self._authkey) < MIN_REMOTE_AUTHKEY_BYTES:
+            raise ValueError(f"Refusing to listen on {address[0]} with an authkey shorter than "
+                             f"{MIN_REMOTE_AUTHKEY_BYTES} bytes, clients can run code on the server")
+        self.listener = Listener(address, authkey=self._authkey)
+        self.address = self.listener.address
+        self._thread = None
+        self._closed = False
+        self._next_client_id = 0
+
+    def start(self):
+        """Serve on a background thread."""
+        self._thread = threading.Thread(target=self.serve_forever, name="LabelServer", daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        while not self._closed:
+            try:
+                conn = self.listener.accept()
+            except (OSError, AuthenticationError):
+                if self._closed:
+                    break
+                logger.exception("Failed to accept a client")
+                continue
+            if self._closed:
+                conn.close()
+                break
+            self._next_client_id += 1
+            threading.Thread(target=self._serve_client, args=(conn, self._next_client_id),
+                             name=f"LabelClient-{self._next_client_id}", daemon=True).start()
+
+    def _serve_client(self, conn, client_id):
+        annotator = str(client_id)
+        try:
+            annotator = conn.recv()
+            logger.info(f"Client {client_id} connected as {annotator}")
+            while True:
+                try:
+                    method, args = conn.recv()
+                except EOFError:
+                    break
+                if method not in self.methods:
+                    conn.send(('error', 'ValueError', f"unknown method {method!r}"))
+                    continue
+                try:
+                    if method == 'save':
+                        result = self.service.save(client_id, annotator, *args)
+                    elif method in ('get_map', 'counts'):
+                        result = getattr(self.service, method)(*args)
+                    else:
+                        result = getattr(self.service, method)(client_id, *args)
+                except Exception as e:
+                    if not isinstance(e, (LookupError, PermissionError)):
+                        logger.exception(f"{method} from {annotator} failed")
+                    conn.send(('error', type(e).__name__, str(e)))
+                else:
+                    conn.send(('ok', result))
+        except (EOFError, OSError):
+            pass
+        finally:
+            self.service.release_all(client_id)
+            conn.close()
+            logger.info(f"Client {client_id} ({annotator}) disconnected")
+
+    def close(self):
+        self._closed = True
+        # unblock accept()
+        try:
+            Client(self.address, authkey=self._authkey).close()
+        except OSError:
+            pass
+        self.listener.close()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+
+class LabelClient:
+    """Connection to a `LabelServer`, safe to share between threads.
+
+    Parameters
+    ----------
+    address: tuple
+        (host, port)
+    authkey: bytes
+        defaults to `load_authkey` with the `server.key` of the configured dataset directory
+    annotator: str
+        recorded with every save, defaults to the login name
+    """
+    errors = {'LookupError': LookupError, 'PermissionError': PermissionError, 'KeyError': KeyError}
+
+    def __init__(self, address, authkey=None, annotator=None):
+        if authkey is None:
+            from teclab import config
+            authkey = load_authkey(config.authkey_file)
+        self.conn = Client(tuple(address), authkey=authkey)
+        self.conn.send(annotator if annotator is not None else getpass.getuser())
+        self._lock = threading.Lock()
+
+    def _call(self, method, *args):
+        with self._lock:
+            self.conn.send((method, args))
+            reply = self.conn.recv()
+        if reply[0] == 'error':
+            raise self.errors.get(reply[1], RuntimeError)(reply[2])
+        return reply[1]
+
+    def lease(self, strategy=None):
+        return self._call('lease', strategy)
+
+    def release(self, year, month, index):
+        return self._call('release', year, month, index)
+
+    def get_map(self, year, month, index):
+        return self._call('get_map', year, month, index)
+
+    def save(self, current_map, labels):
+        current_map = {k: current_map[k] for k in ('year', 'month', 'index', 'unsure')}
+        return self._call('save', current_map, labels)
+
+    def counts(self):
+        return self._call('counts')
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a TEC dataset to several annotators")
+    parser.add_argument('--data-dir', help="dataset directory, see teclab.config")
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--lease-timeout', type=float, default=600, help="seconds")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    from teclab import config
+    if args.data_dir:
+        config.set_data_dir(args.data_dir)
+    service = LabelService(config.get_config(), args.lease_timeout)
+    server = LabelServer(service, (args.host, args.port))
+    print(f"serving {config.data_base_dir} on {server.address[0]}:{server.address[1]}")
+    if not os.environ.get(AUTHKEY_ENV):
+        print(f"clients need ${AUTHKEY_ENV} or a copy of {config.authkey_file}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        config.get_config().close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
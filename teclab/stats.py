@@ -0,0 +1,211 @@
+"""Per-map summary statistics of the whole archive.
+
+    python -m teclab.stats [--data-dir DIR] [--jobs N]
+
+For every map: TEC percentiles (`PERCENTILES`), the fraction of NaN cells and the median TEC of each magnetic
+latitude band (`BAND_EDGES`). The statistics are computed in a process pool, one month file per job, and stored in
+`map_stats.h5` next to the dataset index with one group per month file. Re-running only recomputes files whose TEC
+changed (`utils.tec_hash`, checked for files whose modification time or size changed), so saving labels doesn't
+make the statistics stale. The app uses them to pick the colour range of a map when
+it loads and to leave mostly empty maps out of sampling.
+"""
+import os
+import glob
+import argparse
+import warnings
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import h5py
+
+from teclab import utils
+from teclab.check import FILE_NAME_RE
+
+logger = logging.getLogger(__name__)
+
+STATS_FILE_NAME = "map_stats.h5"
+PERCENTILES = (1, 2, 5, 25, 50, 75, 95, 98, 99)
+BAND_EDGES = (30, 40, 50, 60, 70, 80, 90)
+
+
+def map_stats(tec, mlat_vals, band_edges=BAND_EDGES):
+    """Statistics of a block of maps.
+
+    Parameters
+    ----------
+    tec: numpy.ndarray (mlat, mlt, n)
+    mlat_vals: numpy.ndarray (mlat, )
+    band_edges: tuple
+
+    Returns
+    -------
+    dict
+        'percentiles' (n, len(PERCENTILES)), 'nan_fraction' (n, ) and 'band_median' (n, len(band_edges) - 1),
+        NaN for maps without data
+    """
+    n_maps = tec.shape[2]
+    if n_maps == 0:
+        return {'percentiles': np.empty((0, len(PERCENTILES))), 'nan_fraction': np.empty(0),
+                'band_median': np.empty((0, len(band_edges) - 1))}
+    cells = tec.reshape(-1, n_maps)
+    bands = np.digitize(mlat_vals, band_edges) - 1
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        percentiles = np.nanpercentile(cells, PERCENTILES, axis=0).T
+        band_median = np.stack([np.nanmedian(tec[bands == band].reshape(-1, n_maps), axis=0)
+                                for band in range(len(band_edges) - 1)], axis=1)
+    return {
+        'percentiles': percentiles,
+        'nan_fraction': np.isnan(cells).mean(axis=0),
+        'band_median': band_median,
+    }
+
+
+def file_stats(args):
+    """`utils.tec_hash` and statistics of every map of a month file, read `block_size` maps at a time. The
+    statistics are None if the hash equals `known_hash`. Runs in a worker process."""
+    fn, mlat_vals, block_size, known_hash = args
+    digest = utils.tec_hash(fn, block_size)
+    if digest == known_hash:
+        return digest, None
+    with h5py.File(fn, 'r') as f:
+        n_maps = f['tec'].shape[2]
+        blocks = [map_stats(f['tec'][:, :, start:start + block_size], mlat_vals)
+                  for start in range(0, max(n_maps, 1), block_size)]
+    return digest, {name: np.concatenate([block[name] for block in blocks]) for name in blocks[0]}
+
+
+def compute_stats(data_dir, mlat_vals, stats_file=None, max_workers=None, block_size=64):
+    """Bring the statistics file of `data_dir` up to date.
+
+    Parameters
+    ----------
+    data_dir: str
+    mlat_vals: numpy.ndarray
+    stats_file: str
+        defaults to `STATS_FILE_NAME` inside `data_dir`
+    max_workers: int
+    block_size: int
+
+    Returns
+    -------
+    computed: list
+        names of the month files whose statistics were (re)computed
+    """
+    stats_file = stats_file if stats_file is not None else os.path.join(data_dir, STATS_FILE_NAME)
+    current = {}
+    for fn in glob.glob(os.path.join(data_dir, "*tec.h5")):
+        stat = os.stat(fn)
+        current[os.path.basename(fn)] = (stat.st_mtime_ns, stat.st_size)
+    with h5py.File(stats_file, 'a') as f:
+        if tuple(f.attrs.get('percentiles', ())) != PERCENTILES or \
+                tuple(f.attrs.get('band_edges', ())) != BAND_EDGES:
+            for name in list(f):
+                del f[name]
+        stale = sorted(name for name, (mtime, size) in current.items()
+                       if name not in f or f[name].attrs['mtime'] != mtime or f[name].attrs['size'] != size)
+        known_hashes = {name: f[name].attrs.get('tec_hash') if name in f else None for name in stale}
+        removed = [name for name in f if name not in current]
+    jobs = [(os.path.join(data_dir, name), np.asarray(mlat_vals), block_size, known_hashes[name]) for name in stale]
+    if len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(file_stats, jobs))
+    else:
+        results = [file_stats(job) for job in jobs]
+    with h5py.File(stats_file, 'a') as f:
+        f.attrs['percentiles'] = PERCENTILES
+        f.attrs['band_edges'] = BAND_EDGES
+        for name in removed:
+            del f[name]
+        computed = []
+        for name, (digest, result) in zip(stale, results):
+            if result is not None:
+                if name in f:
+                    del f[name]
+                group = f.create_group(name)
+                for key, values in result.items():
+                    group.create_dataset(key, data=values)
+                group.attrs['tec_hash'] = digest
+                computed.append(name)
+            f[name].attrs['mtime'], f[name].attrs['size'] = current[name]
+    if computed or removed:
+        logger.info(f"Map statistics: computed {len(computed)} files, removed {len(removed)}")
+    return computed
+
+
+class MapStats:
+    """Statistics loaded from a statistics file, see `compute_stats`.
+
+    Parameters
+    ----------
+    stats_file: str
+    """
+
+    def __init__(self, stats_file):
+        self.months = {}
+        with h5py.File(stats_file, 'r') as f:
+            self.percentiles = tuple(int(p) for p in f.attrs['percentiles'])
+            self.band_edges = tuple(f.attrs['band_edges'])
+            for name in f:
+                match = FILE_NAME_RE.search(name)
+                if match:
+                    self.months[(int(match[1]), int(match[2]))] = {key: f[name][key][()] for key in f[name]}
+
+    def get(self, year, month, index):
+        """Statistics of a map, None if there are none."""
+        month_stats = self.months.get((int(year), int(month)))
+        if month_stats is None or not 0 <= int(index) < month_stats['nan_fraction'].shape[0]:
+            return None
+        return {key: values[int(index)] for key, values in month_stats.items()}
+
+    def color_range(self, year, month, index, percentiles=(2, 98)):
+        """(vmin, vmax) of a map from two of the stored percentiles, None if unknown."""
+        map_stats = self.get(year, month, index)
+        if map_stats is None:
+            return None
+        lo, hi = (map_stats['percentiles'][self.percentiles.index(p)] for p in percentiles)
+        if not (np.isfinite(lo) and np.isfinite(hi) and hi > lo):
+            return None
+        return float(lo), float(hi)
+
+    def nan_fraction(self, sampler):
+        """NaN fraction of every map of a `MapSampler`, in its order. NaN for maps without statistics."""
+        values = np.full(len(sampler), np.nan)
+        for (year, month), month_stats in self.months.items():
+            start = sampler.flat_index(year, month, 0)
+            if start is None:
+                continue
+            n = min(month_stats['nan_fraction'].shape[0], int((sampler.month_ids == sampler.month_ids[start]).sum()))
+            values[start:start + n] = month_stats['nan_fraction'][:n]
+        return values
+
+
+def load_stats(stats_file):
+    """`MapStats` of a statistics file, None if it doesn't exist."""
+    if not os.path.exists(stats_file):
+        return None
+    return MapStats(stats_file)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compute per-map statistics of a TEC dataset")
+    parser.add_argument('--data-dir', help="dataset directory, see teclab.config")
+    parser.add_argument('--jobs', type=int, default=None, help="number of worker processes")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    from teclab import config
+    if args.data_dir:
+        config.set_data_dir(args.data_dir)
+    computed = compute_stats(config.data_base_dir, config.mlat_vals, config.stats_file, args.jobs)
+    stats = MapStats(config.stats_file)
+    nan_fraction = np.concatenate([s['nan_fraction'] for s in stats.months.values()]) if stats.months else np.empty(0)
+    print(f"computed statistics of {len(computed)} files, {nan_fraction.shape[0]} maps in {config.stats_file}")
+    for threshold in [.5, .8, .95]:
+        print(f"maps more than {threshold:.0%} empty: {int((nan_fraction > threshold).sum())}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
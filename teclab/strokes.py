@@ -0,0 +1,254 @@
+import os
+import json
+import zlib
+import base64
+
+import numpy as np
+
+
+def capsule_mask(p0, p1, radius, shape):
+    """Pixels within `radius` of the segment `p0`-`p1`, i.e. a thick line with round caps.
+
+    Parameters
+    ----------
+    p0, p1: tuple
+        (x, y) pixel coordinates
+    radius: float
+    shape: tuple
+        shape of the image, only the first two dimensions are used
+
+    Returns
+    -------
+    region: tuple of slices
+        bounding box of the capsule clipped to the image, None if it is entirely outside
+    mask: numpy.ndarray
+        boolean mask over `region`
+    """
+    (x0, y0), (x1, y1) = p0, p1
+    pad = int(np.ceil(radius))
+    lo_x, hi_x = max(min(x0, x1) - pad, 0), min(max(x0, x1) + pad + 1, shape[0])
+    lo_y, hi_y = max(min(y0, y1) - pad, 0), min(max(y0, y1) + pad + 1, shape[1])
+    if lo_x >= hi_x or lo_y >= hi_y:
+        return None, None
+    x, y = np.ogrid[lo_x:hi_x, lo_y:hi_y]
+    dx, dy = x1 - x0, y1 - y0
+    length2 = dx * dx + dy * dy
+    if length2 == 0:
+        t = 0
+    else:
+        t = np.clip(((x - x0) * dx + (y - y0) * dy) / length2, 0, 1)
+    ex = x - (x0 + t * dx)
+    ey = y - (y0 + t * dy)
+    mask = ex * ex + ey * ey <= radius * radius
+    return (slice(lo_x, hi_x), slice(lo_y, hi_y)), mask
+
+
+def draw_segment(image, p0, p1, radius, value):
+    """Paint a thick segment into `image` with one masked write.
+
+    Parameters
+    ----------
+    image: numpy.ndarray (x, y, ...)
+    p0, p1: tuple
+        (x, y) pixel coordinates
+    radius: float
+    value: scalar or numpy.ndarray
+        pixel value written under the capsule, e.g. an RGB triple
+
+    Returns
+    -------
+    region: tuple of slices
+        the part of the image which may have changed, None if nothing did
+    """
+    region, mask = capsule_mask(p0, p1, radius, image.shape)
+    if region is None:
+        return None
+    image[region][mask] = value
+    return region
+
+
+def draw_polyline(image, points, radius, value):
+    """Paint consecutive segments of `points`, a single point paints a disk."""
+    points = [tuple(p) for p in points]
+    if len(points) == 1:
+        points = points * 2
+    for p0, p1 in zip(points[:-1], points[1:]):
+        draw_segment(image, p0, p1, radius, value)
+
+
+PAINT = 'paint'
+ERASE = 'erase'
+CLEAR = 'clear'
+
+
+def apply_stroke(mask, stroke):
+    """Replay a stroke record on a boolean pixel mask.
+
+    Parameters
+    ----------
+    mask: numpy.ndarray (x, y) bool
+    stroke: dict
+        'mode' (`PAINT`, `ERASE` or `CLEAR`), and for painting and erasing 'radius' and 'points' [(x, y), ...]
+    """
+    if stroke['mode'] == CLEAR:
+        mask[:] = False
+    else:
+        draw_polyline(mask, stroke['points'], stroke['radius'], stroke['mode'] == PAINT)
+
+
+class StrokeJournal:
+    """Brush strokes applied to a drawing since it was loaded, for undo / redo and crash recovery.
+
+    The journal holds the pixel mask the drawing started from (`base`) and a list of stroke records, the current
+    drawing is the base with the strokes replayed on top. Undo moves the last stroke to the redo list and replays
+    the rest, so no per-stroke snapshot is kept. Once there are more than `max_strokes` strokes the oldest one is
+    painted into the base and can't be undone anymore.
+
+    With a `path`, the base and every operation are appended to that file as JSON lines and flushed, so the
+    drawing can be rebuilt with `recover` after a crash or a missed save.
+
+    Parameters
+    ----------
+    base: numpy.ndarray (x, y) bool
+    max_strokes: int
+    path: str
+    """
+
+    def __init__(self, base, max_strokes=200, path=None):
+        self.base = np.array(base, dtype=bool)
+        self.max_strokes = max_strokes
+        self.strokes = []
+        self.undone = []
+        self.path = path
+        self._file = None
+        self._n_saved = 0
+        self._n_ops = 0
+        if path is not None:
+            self._file = open(path, 'w')
+            self._write({'op': 'base', 'shape': list(self.base.shape), 'data': _encode_mask(self.base)})
+
+    def __len__(self):
+        return len(self.strokes)
+
+    @property
+    def n_ops(self):
+        """Number of strokes, undos and redos so far, see `mark_saved`."""
+        return self._n_ops
+
+    def _write(self, record):
+        if self._file is not None:
+            self._file.write(json.dumps(record, separators=(',', ':')) + '\n')
+            self._file.flush()
+
+    def record(self, mode, radius, points):
+        """Add a stroke which has already been drawn, `points` is the polyline of the brush center."""
+        stroke = {'mode': mode}
+        if mode != CLEAR:
+            stroke.update(radius=float(radius), points=[[int(x), int(y)] for x, y in points])
+        self._push(stroke)
+        self._write(dict(stroke, op='stroke'))
+
+    def _push(self, stroke):
+        self.strokes.append(stroke)
+        self.undone = []
+        self._n_ops += 1
+        if len(self.strokes) > self.max_strokes:
+            apply_stroke(self.base, self.strokes.pop(0))
+
+    def undo(self):
+        """Rewind the last stroke, returns the resulting mask or None if there was nothing to undo."""
+        if not self.strokes:
+            return None
+        self.undone.append(self.strokes.pop())
+        self._n_ops += 1
+        self._write({'op': 'undo'})
+        return self.render()
+
+    def redo(self):
+        """Replay the last undone stroke, returns the resulting mask or None if there was nothing to redo."""
+        if not self.undone:
+            return None
+        self.strokes.append(self.undone.pop())
+        self._n_ops += 1
+        self._write({'op': 'redo'})
+        return self.render()
+
+    def render(self):
+        """The current drawing, the base with every stroke replayed."""
+        mask = self.base.copy()
+        for stroke in self.strokes:
+            apply_stroke(mask, stroke)
+        return mask
+
+    def mark_saved(self, n_ops=None):
+        """The drawing as of `n_ops` operations (default: the current one) has been saved, `close` removes the
+        journal file unless more has been drawn since."""
+        self._n_saved = self._n_ops if n_ops is None else n_ops
+
+    def close(self):
+        """Close the journal file and remove it if there is nothing in it which hasn't been saved."""
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        if self._n_ops == self._n_saved:
+            os.remove(self.path)
+
+    @classmethod
+    def recover(cls, path, max_strokes=200, base=None):
+        """Rebuild a journal from its file and keep appending to it. A partly written last line is dropped.
+
+        Parameters
+        ----------
+        path: str
+        max_strokes: int
+        base: numpy.ndarray (x, y) bool
+            the drawing the map starts from now, a journal which started from a different one was written before
+            the map was saved again and is out of date
+
+        Returns
+        -------
+        StrokeJournal or None
+            None if the journal has no strokes, undos or redos, or is out of date
+        """
+        with open(path) as f:
+            lines = f.read().splitlines()
+        records = []
+        for line in lines:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                break
+        if not records or records[0].get('op') != 'base':
+            raise ValueError(f"{path} is not a stroke journal")
+        if len(records) < len(lines):
+            with open(path, 'w') as f:
+                f.write(''.join(line + '\n' for line in lines[:len(records)]))
+        if not any(record.get('op') in ('stroke', 'undo', 'redo') for record in records[1:]):
+            return None
+        journal_base = _decode_mask(records[0]['data'], records[0]['shape'])
+        if base is not None and not np.array_equal(journal_base, base):
+            return None
+        journal = cls(journal_base, max_strokes)
+        for record in records[1:]:
+            op = record.pop('op')
+            if op == 'stroke':
+                journal._push(record)
+            elif op == 'undo' and journal.strokes:
+                journal.undone.append(journal.strokes.pop())
+            elif op == 'redo' and journal.undone:
+                journal.strokes.append(journal.undone.pop())
+        journal.path = path
+        journal._file = open(path, 'a')
+        # replayed operations aren't saved yet
+        journal._n_ops = len(records) - 1
+        return journal
+
+
+def _encode_mask(mask):
+    return base64.b64encode(zlib.compress(np.packbits(mask.ravel()).tobytes())).decode('ascii')
+
+
+def _decode_mask(data, shape):
+    packed = np.frombuffer(zlib.decompress(base64.b64decode(data)), dtype=np.uint8)
+    return np.unpackbits(packed, count=int(np.prod(shape))).reshape(shape).astype(bool)
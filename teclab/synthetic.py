@@ -0,0 +1,153 @@
+"""Synthetic TEC datasets laid out like the real archive, for tests, benchmarks and trying the app out.
+
+    python -m teclab.synthetic OUT_DIR [--months 2] [--shape 60 180] [--labeled-fraction .3]
+
+OUT_DIR receives hourly `{year}_{month}_tec.h5` month files, `grid.h5` and the `labeled.json` / `unsure.json`
+progress lists. Labeled maps get the synthetic trough as their labels.
+"""
+import os
+import json
+import argparse
+
+import numpy as np
+import h5py
+
+from teclab import utils
+
+
+def grid_values(shape):
+    """mlat and mlt values of a grid with `shape` (mlat, mlt) covering 30-90 mlat and 0-24 mlt."""
+    mlat_vals = 30 + (np.arange(shape[0]) + .5) * 60 / shape[0]
+    mlt_vals = np.arange(shape[1]) * 24 / shape[1]
+    return mlat_vals, mlt_vals
+
+
+def month_times(year, month, n_maps=None):
+    """Hourly start times of a month, in seconds since the epoch."""
+    start = np.datetime64(f"{year:04d}-{month:02d}", 'h')
+    end = (np.datetime64(f"{year:04d}-{month:02d}", 'M') + 1).astype('datetime64[h]')
+    times = np.arange(start, end, np.timedelta64(1, 'h'))
+    if n_maps is not None:
+        times = times[:n_maps]
+    return times.astype('datetime64[s]').astype(float)
+
+
+def trough_maps(shape, n_maps, rng, nan_fraction=.1):
+    """TEC decreasing with latitude with a depleted band whose latitude varies with mlt and from map to map.
+
+    Returns
+    -------
+    tec: numpy.ndarray (mlat, mlt, n_maps)
+    troughs: numpy.ndarray (mlat, mlt, n_maps) bool
+        cells within the band
+    """
+    mlat_vals, mlt_vals = grid_values(shape)
+    center = (60 + 5 * rng.standard_normal(n_maps))[None, :] + 3 * np.cos(2 * np.pi * mlt_vals / 24)[:, None]
+    width = 2 + 2 * rng.random(n_maps)
+    distance = (mlat_vals[:, None, None] - center[None]) / width
+    background = 5 + 15 * (90 - mlat_vals[:, None, None]) / 60
+    tec = background * (1 - .5 * np.exp(-distance ** 2)) * (1 + .1 * rng.standard_normal(distance.shape))
+    tec[rng.random(tec.shape) < nan_fraction] = np.nan
+    return tec, np.abs(distance) <= 1
+
+
+def write_month_file(data_dir, year, month, shape=(20, 36), n_maps=None, seed=0, troughs=False):
+    """Write a `{year}_{month}_tec.h5` file with hourly maps and empty labels. The maps are uniform noise unless
+    `troughs`, see `trough_maps`.
+
+    Returns
+    -------
+    fn: str
+    """
+    start_time = month_times(year, month, n_maps)
+    rng = np.random.default_rng(seed)
+    if troughs:
+        tec, _ = trough_maps(shape, start_time.shape[0], rng)
+    else:
+        tec = rng.random(shape + (start_time.shape[0],)) * 20
+        tec[rng.random(tec.shape) < .1] = np.nan
+    fn = os.path.join(data_dir, f"{year:04d}_{month:02d}_tec.h5")
+    with h5py.File(fn, 'w') as f:
+        f.create_dataset('tec', data=tec)
+        f.create_dataset('labels', data=np.zeros(tec.shape, dtype=bool))
+        f.create_dataset('start_time', data=start_time)
+    return fn
+
+
+def write_grid(data_dir, shape):
+    mlat_vals, mlt_vals = grid_values(shape)
+    with h5py.File(os.path.join(data_dir, "grid.h5"), 'w') as f:
+        f.create_dataset('mlat', data=mlat_vals)
+        f.create_dataset('mlt', data=mlt_vals)
+
+
+def generate_dataset(data_dir, months=((2012, 6), ), shape=(60, 180), n_maps=None, labeled_fraction=0.,
+                     unsure_fraction=0., seed=0):
+    """Write a complete synthetic dataset.
+
+    Parameters
+    ----------
+    data_dir: str
+    months: list
+        (year, month) of the month files
+    shape: tuple
+        (mlat, mlt)
+    n_maps: int
+        maps per month file, the whole month (hourly) if None
+    labeled_fraction, unsure_fraction: float
+        fractions of the maps listed in `labeled.json` and `unsure.json`
+    seed: int
+
+    Returns
+    -------
+    dict
+        'files', 'done_list' and 'unsure_list'
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    write_grid(data_dir, shape)
+    files, done_list, unsure_list = [], [], []
+    for i, (year, month) in enumerate(months):
+        fn = write_month_file(data_dir, year, month, shape, n_maps, seed + i, troughs=True)
+        files.append(fn)
+        with h5py.File(fn, 'r') as f:
+            n = f['start_time'].shape[0]
+        status = rng.random(n)
+        done = np.flatnonzero(status < labeled_fraction)
+        unsure = np.flatnonzero((status >= labeled_fraction) & (status < labeled_fraction + unsure_fraction))
+        if done.size:
+            _, troughs = trough_maps(shape, n, np.random.default_rng(seed + i))
+            utils.write_labels(fn, {index: troughs[:, :, index] for index in done})
+        done_list += [[year, month, int(index)] for index in done]
+        unsure_list += [[year, month, int(index)] for index in unsure]
+    for name, entries in [("labeled.json", done_list), ("unsure.json", unsure_list)]:
+        with open(os.path.join(data_dir, name), 'w') as f:
+            json.dump({'list': entries}, f)
+    return {'files': files, 'done_list': done_list, 'unsure_list': unsure_list}
+
+
+def month_range(year, month, n_months):
+    """(year, month) of `n_months` consecutive months."""
+    return [((year * 12 + month - 1 + i) // 12, (month - 1 + i) % 12 + 1) for i in range(n_months)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic TEC dataset")
+    parser.add_argument('out_dir')
+    parser.add_argument('--start', type=int, nargs=2, default=(2012, 6), metavar=('YEAR', 'MONTH'))
+    parser.add_argument('--months', type=int, default=2, help="number of month files")
+    parser.add_argument('--shape', type=int, nargs=2, default=(60, 180), metavar=('MLAT', 'MLT'))
+    parser.add_argument('--maps', type=int, default=None, help="maps per month file, default the whole month")
+    parser.add_argument('--labeled-fraction', type=float, default=0.)
+    parser.add_argument('--unsure-fraction', type=float, default=0.)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    info = generate_dataset(args.out_dir, month_range(*args.start, args.months), tuple(args.shape), args.maps,
+                            args.labeled_fraction, args.unsure_fraction, args.seed)
+    print(f"wrote {len(info['files'])} month files to {args.out_dir}, {len(info['done_list'])} labeled and "
+          f"{len(info['unsure_list'])} unsure maps")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,14 +1,30 @@
 import numpy as np
-import glob
-import datetime
 import h5py
-import os
-import json
+import hashlib
+import warnings
+import threading
 
+from teclab import dataset_index
+from teclab import instrument
 
+
+_file_locks = {}
+_file_locks_lock = threading.Lock()
+
+
+def file_lock(fn):
+    """Lock serializing the h5 accesses to `fn` within this process, HDF5 refuses to open a file for writing
+    while another thread has it open for reading.
+    """
+    with _file_locks_lock:
+        return _file_locks.setdefault(fn, threading.RLock())
+
+
+@instrument.timed()
 def get_map_tree(data_dir):
     """Search through dataset at location `data_dir` and get a tree structure which
-    indicates what maps are in the dataset.
+    indicates what maps are in the dataset. The per-file timestamps are kept in a persistent index
+    (see `teclab.dataset_index`) so only new or modified files are opened.
 
     year: [
         month:
@@ -24,93 +40,205 @@ def get_map_tree(data_dir):
     -------
     map_tree: dict
     """
-    files = glob.glob(os.path.join(data_dir, "*tec.h5"))
-    timestamps = []
-    for file in files:
-        with h5py.File(file, 'r') as f:
-            timestamps.append(f['start_time'][()])
-    timestamps = np.concatenate(timestamps)
-    datetimes = np.array([datetime.datetime.utcfromtimestamp(ts) for ts in timestamps])
-    years = np.array([dt.year for dt in datetimes])
-    months = np.array([dt.month for dt in datetimes])
-    tree = {}
-    for yr in np.unique(years):
-        for mn in range(1, 13):
-            mask = (years == yr) * (months == mn)
-            if mask.sum() == 0:
-                continue
-            if yr not in tree:
-                tree[yr] = {}
-            tree[yr][mn] = {}
-            tree[yr][mn]['index'] = np.arange(mask.sum())
-            tree[yr][mn]['datetime'] = datetimes[mask]
-    return tree
+    return dataset_index.load_index(data_dir).map_tree()
 
 
 def update_h5(current_map, new_labels):
-    """Write `labels` to its corresponding h5 file.
+    """Write `labels` to its corresponding h5 file. Only the `[:, :, index]` slice is written.
 
     Parameters
     ----------
     current_map: dict
     new_labels: numpy.ndarray
     """
-    with h5py.File(current_map['h5_file'], 'r+') as f:
-        labels = f['labels'][()]
-        labels[:, :, current_map['index']] = new_labels
-        f['labels'][()] = labels
+    write_labels(current_map['h5_file'], {int(current_map['index']): new_labels})
 
 
-def update_done_list(fn, done_list: list, current_map):
-    """If not unsure about the current map, add it to the done list and write the done list to its json file.
+@instrument.timed()
+def write_labels(fn, labels_by_index, skip_unchanged=False):
+    """Write several label slices to one h5 file in place, opening the file once.
 
     Parameters
     ----------
     fn: str
-    done_list: list
+    labels_by_index: dict
+        index -> numpy.ndarray (mlat, mlt)
+    skip_unchanged: bool
+        compare each slice with the one in the file first and don't write it again if they're equal
+
+    Returns
+    -------
+    n_written: int
+    """
+    n_written = 0
+    with file_lock(fn), h5py.File(fn, 'r+') as f:
+        for index in sorted(labels_by_index):
+            labels = labels_by_index[index]
+            if skip_unchanged and np.array_equal(read_label_slice(f['labels'], index), labels):
+                continue
+            write_label_slice(f['labels'], index, labels)
+            n_written += 1
+    return n_written
+
+
+@instrument.timed()
+def open_map(current_map):
+    """Read a single map from its h5 file. Only the `[:, :, index]` slab of each dataset is read.
+
+    Parameters
+    ----------
     current_map: dict
+
+    Returns
+    -------
+    tec, labels: numpy.ndarray (mlat, mlt)
+    start_time: float
     """
-    index_tuple = (int(current_map['year']), int(current_map['month']), int(current_map['index']))
-    if not current_map['unsure'] and index_tuple not in done_list:
-        done_list.append(index_tuple)
-        with open(fn, 'w') as f:
-            json.dump({'list': done_list}, f)
+    index = int(current_map['index'])
+    with file_lock(current_map['h5_file']), h5py.File(current_map['h5_file'], 'r') as f:
+        return f['tec'][:, :, index], read_label_slice(f['labels'], index), f['start_time'][index]
 
 
-def update_unsure_list(fn, unsure_list: list, current_map):
-    """Update `unsure_list` so that it agrees with `current_map`, then write the updated list to the
-    `unsure_list` json.
+@instrument.timed()
+def read_maps(fn, start, stop):
+    """Read the contiguous block of maps `start:stop` from an h5 file with one hyperslab read per dataset.
 
     Parameters
     ----------
     fn: str
-    unsure_list: list
-    current_map: dict
+    start, stop: int
+
+    Returns
+    -------
+    tec, labels: numpy.ndarray (mlat, mlt, stop - start)
+    start_time: numpy.ndarray (stop - start, )
     """
-    index_tuple = (int(current_map['year']), int(current_map['month']), int(current_map['index']))
-    if current_map['unsure'] and index_tuple not in unsure_list:
-        unsure_list.append(index_tuple)
-    elif not current_map['unsure'] and index_tuple in unsure_list:
-        unsure_list.remove(index_tuple)
+    with file_lock(fn), h5py.File(fn, 'r') as f:
+        stop = min(stop, f['start_time'].shape[0])
+        start = max(start, 0)
+        labels = read_label_slice(f['labels'], slice(start, stop))
+        return f['tec'][:, :, start:stop], labels, f['start_time'][start:stop]
 
-    with open(fn, 'w') as f:
-        json.dump({'list': unsure_list}, f)
 
+@instrument.timed()
+def read_map_indices(fn, indices):
+    """Read an arbitrary set of maps from an h5 file, opening it once.
 
-def open_map(current_map):
-    index = current_map['index']
-    tec, labels, start_time = open_h5(current_map['h5_file'])
-    return tec[:, :, index], labels[:, :, index], start_time[index]
+    Parameters
+    ----------
+    fn: str
+    indices: list
+        strictly increasing
+
+    Returns
+    -------
+    tec, labels: numpy.ndarray (mlat, mlt, len(indices))
+    start_time: numpy.ndarray (len(indices), )
+    """
+    indices = [int(i) for i in indices]
+    with file_lock(fn), h5py.File(fn, 'r') as f:
+        return f['tec'][:, :, indices], read_label_slice(f['labels'], indices), f['start_time'][indices]
 
 
+@instrument.timed()
 def open_h5(fn):
-    with h5py.File(fn, 'r') as f:
+    with file_lock(fn), h5py.File(fn, 'r') as f:
         tec = f['tec'][()]
-        labels = f['labels'][()]
+        labels = read_label_slice(f['labels'], slice(None))
         start_time = f['start_time'][()]
     return tec, labels, start_time
 
 
+def tec_hash(fn, block_size=64):
+    """Content hash of the `tec` dataset of a month file. Unlike the file's modification time it doesn't change
+    when labels are saved, so it tells whether results derived from the TEC are out of date.
+
+    Parameters
+    ----------
+    fn: str
+    block_size: int
+        maps read at a time
+
+    Returns
+    -------
+    str
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with file_lock(fn), h5py.File(fn, 'r') as f:
+        tec = f['tec']
+        digest.update(f"{tec.shape}{tec.dtype.str}".encode())
+        for start in range(0, tec.shape[2], block_size):
+            digest.update(np.ascontiguousarray(tec[:, :, start:start + block_size]).tobytes())
+    return digest.hexdigest()
+
+
+def read_label_slice(dset, index):
+    """Read `labels[:, :, index]` from either dataset layout: a boolean (mlat, mlt, time) cube, or the bit-packed
+    uint8 (mlat, ceil(mlt / 8), time) cube written by `teclab.repack` (marked by the `packed` attribute).
+
+    Parameters
+    ----------
+    dset: h5py.Dataset
+    index: int, slice or increasing list
+
+    Returns
+    -------
+    labels: numpy.ndarray bool
+    """
+    if not dset.attrs.get('packed', False):
+        return dset[:, :, index]
+    return np.unpackbits(dset[:, :, index], axis=1, count=int(dset.attrs['mlt_size'])).astype(bool)
+
+
+def write_label_slice(dset, index, labels):
+    """Write `labels[:, :, index]` in either dataset layout, see `read_label_slice`.
+
+    Parameters
+    ----------
+    dset: h5py.Dataset
+    index: int
+    labels: numpy.ndarray (mlat, mlt)
+    """
+    if dset.attrs.get('packed', False):
+        dset[:, :, index] = np.packbits(np.asarray(labels, dtype=bool), axis=1)
+    else:
+        dset[:, :, index] = labels
+
+
+def cross_section_profiles(tec_map, avg_width=7, median_width=3):
+    """Smoothed latitude profile of a map at every mlt, computed in one vectorized pass. Column `j` of the result
+    is the `nanmean` over the `avg_width` mlt columns centered on `j` (edge padded), followed by a running
+    `nanmedian` of width `median_width` along mlat (edge padded).
+
+    Parameters
+    ----------
+    tec_map: numpy.ndarray (mlat, mlt)
+    avg_width, median_width: int
+        odd window sizes
+
+    Returns
+    -------
+    profiles: numpy.ndarray (mlat, mlt)
+    """
+    half = (avg_width - 1) // 2
+    padded = np.pad(tec_map, ((0, 0), (half, half)), mode='edge')
+    finite = np.isfinite(padded)
+    sums = np.pad(np.cumsum(np.where(finite, padded, 0), axis=1), ((0, 0), (1, 0)))
+    counts = np.pad(np.cumsum(finite, axis=1), ((0, 0), (1, 0)))
+    window = 2 * half + 1
+    sums = sums[:, window:] - sums[:, :-window]
+    counts = counts[:, window:] - counts[:, :-window]
+    profiles = np.divide(sums, counts, out=np.full(sums.shape, np.nan), where=counts > 0)
+    pad_width = (median_width - 1) // 2
+    if pad_width > 0:
+        padded = np.pad(profiles, ((pad_width, pad_width), (0, 0)), mode='edge')
+        windows = np.lib.stride_tricks.sliding_window_view(padded, 2 * pad_width + 1, axis=0)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            profiles = np.nanmedian(windows, axis=-1)
+    return profiles
+
+
 def get_random_map_id(start_time=np.datetime64("2013-12-03T00:00:00"), end_time=np.datetime64("2019-12-30T00:00:00")):
     dset_range = (end_time.astype('datetime64[h]') - start_time.astype('datetime64[h]')).astype(int)
     hours_offset = np.random.randint(0, dset_range)
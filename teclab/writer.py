@@ -0,0 +1,216 @@
+import atexit
+import threading
+import logging
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from teclab import utils
+
+logger = logging.getLogger(__name__)
+
+
+class LabelWriter:
+    """Background write-behind queue for label saves.
+
+    Saves are keyed by (h5 file, index); saving the same map again before it has been written replaces the
+    queued labels, so only the latest version is written. A worker thread waits `batch_delay` seconds after
+    the first queued save and then writes everything that is pending, opening each h5 file once and writing
+    only the changed `[:, :, index]` slices. `flush` blocks until the queue is empty and `close` (also
+    registered with `atexit`) flushes and stops the worker so no label is lost on exit.
+
+    A failed write resolves its futures with the exception but keeps the labels: they are still returned by
+    `pending_labels` and are written again after `retry_delay` seconds, by `flush`, or replaced by the next save
+    of the same map.
+
+    With a `label_store`, saves of maps whose `current_map` has a year and month are also recorded there. Slices
+    whose labels equal the ones already in the h5 file aren't written again.
+
+    Parameters
+    ----------
+    batch_delay: float
+        seconds to wait for more saves before writing a batch
+    label_store: teclab.label_store.LabelStore
+    retry_delay: float
+        seconds to wait before writing failed saves again
+    """
+
+    def __init__(self, batch_delay=1.0, label_store=None, retry_delay=5.0):
+        self.batch_delay = batch_delay
+        self.label_store = label_store
+        self.retry_delay = retry_delay
+        self._pending = {}
+        self._in_flight = {}
+        self._failed = {}
+        self._retry_at = 0
+        self._generations = {}
+        self._cond = threading.Condition()
+        self._writing = False
+        self._flush_requested = False
+        self._urgent = False
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="LabelWriter", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    @property
+    def n_pending(self):
+        with self._cond:
+            return len(self._pending)
+
+    @property
+    def n_failed(self):
+        with self._cond:
+            return len(self._failed)
+
+    def generation(self, fn):
+        """Number of batches written to `fn` so far, a reader which sees it change during a read may have read
+        labels which were overwritten."""
+        with self._cond:
+            return self._generations.get(fn, 0)
+
+    def submit(self, current_map, labels, urgent=False):
+        """Queue `labels` to be written to the map described by `current_map`.
+
+        Parameters
+        ----------
+        current_map: dict
+        labels: numpy.ndarray (mlat, mlt)
+        urgent: bool
+            write the queue without waiting for `batch_delay`, for callers which wait for the write
+
+        Returns
+        -------
+        concurrent.futures.Future
+            resolved once these labels (or a later save of the same map) have been written
+        """
+        key = (current_map['h5_file'], int(current_map['index']))
+        map_key = None
+        if 'year' in current_map and 'month' in current_map:
+            map_key = (int(current_map['year']), int(current_map['month']), int(current_map['index']))
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("LabelWriter is closed")
+            self._failed.pop(key, None)
+            futures = self._pending.pop(key, (None, []))[1]
+            self._pending[key] = (np.array(labels, dtype=bool), futures + [future], map_key)
+            self._urgent = self._urgent or urgent
+            self._cond.notify_all()
+        return future
+
+    def pending_labels(self, fn, index):
+        """Labels queued for a map which haven't been written yet, or None."""
+        with self._cond:
+            key = (fn, int(index))
+            entry = self._pending.get(key, self._in_flight.get(key, self._failed.get(key)))
+        return None if entry is None else entry[0]
+
+    def flush(self, timeout=None):
+        """Write everything that is queued now, including failed saves, and wait for it to finish.
+
+        Returns
+        -------
+        bool
+            False if `timeout` expired first or some labels couldn't be written
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._requeue_failed()
+            self._flush_requested = True
+            self._cond.notify_all()
+            while self._pending or self._writing:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            self._flush_requested = False
+            return not self._failed
+
+    def close(self):
+        if self._closed:
+            return
+        self.flush()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            if self._failed:
+                logger.error(f"Labels of {len(self._failed)} maps could not be written: {sorted(self._failed)}")
+        self._thread.join()
+        atexit.unregister(self.close)
+
+    def _requeue_failed(self):
+        """Move the failed saves back into the queue, call with `_cond` held."""
+        self._pending.update(self._failed)
+        self._failed = {}
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    if not self._failed:
+                        self._cond.wait()
+                    elif time.monotonic() >= self._retry_at:
+                        self._requeue_failed()
+                    else:
+                        self._cond.wait(self._retry_at - time.monotonic())
+                if self._closed and not self._pending:
+                    return
+                deadline = time.monotonic() + self.batch_delay
+                while not (self._flush_requested or self._urgent or self._closed):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch, self._pending = self._pending, {}
+                self._urgent = False
+                self._in_flight = batch
+                self._writing = True
+            failed = {}
+            try:
+                failed = self._write_batch(batch)
+            finally:
+                with self._cond:
+                    for key, (labels, _, map_key) in failed.items():
+                        if key not in self._pending:
+                            self._failed[key] = (labels, [], map_key)
+                    if failed:
+                        self._retry_at = time.monotonic() + self.retry_delay
+                    self._in_flight = {}
+                    self._writing = False
+                    self._cond.notify_all()
+
+    def _write_batch(self, batch):
+        """Write a batch, one h5 file at a time.
+
+        Returns
+        -------
+        failed: dict
+            the entries of the batch which couldn't be written
+        """
+        failed = {}
+        by_file = {}
+        for (fn, index), (labels, futures, map_key) in batch.items():
+            by_file.setdefault(fn, {})[index] = (labels, futures, map_key)
+        for fn, entries in by_file.items():
+            futures = [future for _, fs, _ in entries.values() for future in fs]
+            try:
+                n_written = utils.write_labels(fn, {index: labels for index, (labels, _, _) in entries.items()},
+                                               skip_unchanged=True)
+                if n_written:
+                    with self._cond:
+                        self._generations[fn] = self._generations.get(fn, 0) + 1
+                tracked = {map_key: labels for labels, _, map_key in entries.values() if map_key is not None}
+                if self.label_store is not None and tracked:
+                    self.label_store.put_many(tracked)
+            except Exception as e:
+                logger.exception(f"Failed to write labels to {fn}, retrying in {self.retry_delay} s")
+                failed.update({(fn, index): entry for index, entry in entries.items()})
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            logger.info(f"Wrote {n_written} label slices to {fn}, {len(entries) - n_written} unchanged")
+            for future in futures:
+                future.set_result(fn)
+        return failed
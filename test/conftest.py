@@ -0,0 +1,28 @@
+import os
+import pytest
+
+from teclab import config
+from teclab.synthetic import write_month_file, generate_dataset, month_range
+
+
+@pytest.fixture
+def month_file(tmp_path):
+    return write_month_file(str(tmp_path), 2012, 6, n_maps=48)
+
+
+@pytest.fixture
+def synthetic_config(tmp_path):
+    """`teclab.config` pointed at a small synthetic dataset, restored afterwards."""
+    data_dir = str(tmp_path / 'tec_data')
+    info = generate_dataset(data_dir, month_range(2012, 11, 3), shape=(30, 45), n_maps=30, labeled_fraction=.2,
+                            unsure_fraction=.1)
+    previous = config.get_config().data_base_dir
+    yield config.set_data_dir(data_dir), info
+    config.set_data_dir(previous)
+
+
+@pytest.fixture(scope='session')
+def qt_app():
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    import pyqtgraph as pg
+    return pg.mkQApp()
@@ -0,0 +1,142 @@
+import sys
+import time
+import subprocess
+from concurrent.futures import Future
+import numpy as np
+
+
+def wait_for_dataset(app, qt_app, timeout=30):
+    deadline = time.monotonic() + timeout
+    while app.prefetcher is None and time.monotonic() < deadline:
+        qt_app.processEvents()
+        time.sleep(.01)
+    assert app.prefetcher is not None
+
+
+def test_startup_imports():
+    # the pre-labeling dependencies are only needed by `python -m teclab.prelabel`
+    code = "import sys, teclab.app; print(any(m.split('.')[0] == 'skimage' for m in sys.modules))"
+    assert subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout == "False\n"
+
+
+def test_async_save(qt_app, synthetic_config, monkeypatch):
+    from teclab.app import App
+    from teclab.gui import Gui
+    from teclab import strokes
+    app = App()
+    app.gui = Gui(app)
+    app._window_shown(None)
+    # the dataset is loaded on a worker thread, the prefetcher is created once it is ready
+    assert app.prefetcher is None
+    wait_for_dataset(app, qt_app)
+    app.map_next()
+    saves = []
+
+    def save(current_map, labels):
+        saves.append(Future())
+        return saves[-1]
+
+    monkeypatch.setattr(app.backend, 'save', save)
+    labels = np.zeros(app.gui.get_labels().shape, dtype=bool)
+    labels[5:10, 10:20] = True
+    app.gui.draw_img.set_labels(labels)
+    journal = app.gui.draw_img.journal
+    journal.record(strokes.PAINT, 2, [(5, 5)])
+    app.map_save()
+    # the preview shows the saved labels before the write has finished
+    np.testing.assert_array_equal(app.gui.preview_img.image, app.gui.tec_map_img.renderer.render_mask(labels))
+    map_id = (int(app.current_map['year']), int(app.current_map['month']), int(app.current_map['index']))
+    saves[-1].set_exception(OSError("disk full"))
+    qt_app.processEvents()
+    assert app.gui.status_bar.currentMessage() == f"Save FAILED for {map_id}: disk full"
+    assert journal._n_saved == 0
+
+    app.map_save()
+    # drawn after the labels were snapshotted, so it isn't covered by the save
+    journal.record(strokes.PAINT, 2, [(8, 8)])
+    saves[-1].set_result(None)
+    qt_app.processEvents()
+    assert app.gui.status_bar.currentMessage() == f"Saved {map_id}"
+    assert journal._n_saved == journal.n_ops - 1
+    app.prefetcher.shutdown()
+    app.gui.draw_img.close_journal()
+    app.gui.close()
+
+
+def test_manual_color_range(qt_app, synthetic_config):
+    from teclab.app import App
+    from teclab.gui import Gui
+    app = App()
+    gui = app.gui = Gui(app)
+    gui.param_object.child('Image', 'vmin').setValue(3)
+    assert gui.color_params() == {'vmin': 3, 'vmax': 20}
+    # showing a map with its automatic range doesn't change the range maps without statistics get
+    gui.set_color_params(5, 30)
+    assert gui.param_object.child('Image', 'vmax').value() == 30
+    assert gui.color_params() == {'vmin': 3, 'vmax': 20}
+    assert gui.color_params((1, 2)) == {'vmin': 1, 'vmax': 2}
+    # editing the shown range makes it the manual one
+    gui.param_object.child('Image', 'vmax').setValue(25)
+    assert gui.color_params() == {'vmin': 5, 'vmax': 25}
+    gui.param_object.child('Image', 'Auto Range').setValue(False)
+    assert gui.color_params((1, 2)) == {'vmin': 5, 'vmax': 25}
+    gui.close()
+
+
+def test_closed_gui_stops_listening(qt_app, synthetic_config):
+    from PyQt5 import sip
+    from teclab.app import App
+    from teclab.gui import Gui
+    from teclab import instrument
+    app = App()
+    gui = app.gui = Gui(app)
+    n_listeners = len(instrument.session.listeners)
+    gui.close()
+    assert len(instrument.session.listeners) == n_listeners - 1
+    sip.delete(gui)
+    with instrument.session.span('App.map_next'):
+        pass
+
+
+def test_lazy_values_load_independently():
+    import threading
+    from teclab.config import lazy
+    started, release = threading.Event(), threading.Event()
+
+    class Values:
+        @lazy
+        def slow(self):
+            started.set()
+            release.wait(10)
+            return 1
+
+        @lazy
+        def fast(self):
+            return 2
+
+    values = Values()
+    loader = threading.Thread(target=lambda: values.slow)
+    loader.start()
+    assert started.wait(10)
+    # doesn't wait for `slow`
+    assert values.fast == 2
+    release.set()
+    loader.join()
+    assert values.slow == 1
+
+
+def test_max_empty_fraction_waits_for_the_dataset(qt_app, synthetic_config, monkeypatch):
+    from teclab import config
+    from teclab.app import App
+    from teclab.gui import Gui
+    app = App()
+    app.gui = Gui(app)
+    applied = []
+    monkeypatch.setattr(app, '_apply_max_empty_fraction', lambda: applied.append(app.max_empty_fraction))
+    app.set_max_empty_fraction(.5)
+    assert applied == [] and 'map_sampler' not in config.get_config().__dict__
+    app._window_shown(None)
+    wait_for_dataset(app, qt_app)
+    assert applied == [.5]
+    app.prefetcher.shutdown()
+    app.gui.close()
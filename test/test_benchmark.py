@@ -0,0 +1,40 @@
+import os
+import json
+import numpy as np
+import h5py
+
+from teclab import benchmark, synthetic, utils
+
+
+def test_generate_dataset(tmp_path):
+    data_dir = str(tmp_path)
+    info = synthetic.generate_dataset(data_dir, synthetic.month_range(2012, 12, 2), shape=(30, 40), n_maps=10,
+                                      labeled_fraction=.5, unsure_fraction=.2)
+    assert [os.path.basename(fn) for fn in info['files']] == ["2012_12_tec.h5", "2013_01_tec.h5"]
+    with open(os.path.join(data_dir, "labeled.json")) as f:
+        assert json.load(f) == {'list': info['done_list']}
+    assert info['done_list'] and not {tuple(k) for k in info['done_list']} & {tuple(k) for k in info['unsure_list']}
+    with h5py.File(os.path.join(data_dir, "grid.h5"), 'r') as f:
+        assert f['mlat'].shape == (30, ) and f['mlt'].shape == (40, )
+    year, month, index = info['done_list'][0]
+    tec, labels, _ = utils.open_map({'h5_file': info['files'][[2012, 2013].index(year)], 'index': index})
+    assert tec.shape == (30, 40) and labels.any()
+    map_tree = utils.get_map_tree(data_dir)
+    assert sum(m['index'].shape[0] for y in map_tree.values() for m in y.values()) == 20
+
+
+def test_benchmark_suite(tmp_path):
+    out, baseline = str(tmp_path / 'results.json'), str(tmp_path / 'baseline.json')
+    assert benchmark.main(['--size', 'tiny', '--out', out]) == 0
+    with open(out) as f:
+        results = json.load(f)['results']
+    for name in ['get_map_tree', 'open_map', 'update_h5', 'get_next_map[labeled=0.99]', 'cross_sections',
+                 'TecMapImageItem.update_and_get_pixels', 'DrawingImage.get_labels']:
+        assert np.isfinite(results[name]['median'])
+
+    faster = {name: dict(summary, median=summary['median'] / 100) for name, summary in results.items()}
+    assert {name for name, *_ in benchmark.compare(results, faster)} == set(results)
+    assert benchmark.compare(results, results) == []
+    with open(baseline, 'w') as f:
+        json.dump({'meta': {'size': 'tiny'}, 'results': faster}, f)
+    assert benchmark.main(['--size', 'tiny', '--baseline', baseline]) == 1
@@ -0,0 +1,63 @@
+import numpy as np
+import h5py
+
+from teclab import utils
+from teclab.cache import MapCache
+
+
+def test_open_map_reads_slab(month_file):
+    with h5py.File(month_file, 'r') as f:
+        tec = f['tec'][()]
+        start_time = f['start_time'][()]
+    m_tec, m_labels, m_time = utils.open_map({'h5_file': month_file, 'index': 5})
+    np.testing.assert_array_equal(m_tec, tec[:, :, 5])
+    assert m_labels.shape == tec.shape[:2]
+    assert m_time == start_time[5]
+
+
+def test_cache_neighbours_and_labels(month_file):
+    cache = MapCache(neighbours=2)
+    tec, labels, _ = cache.get(month_file, 10)
+    assert cache.misses == 1 and len(cache) == 5
+    cache.get(month_file, 12)
+    cache.get(month_file, 8)
+    assert cache.misses == 1 and cache.hits == 2
+
+    new_labels = np.ones_like(labels)
+    cache.update_labels(month_file, 10, new_labels)
+    assert cache.get(month_file, 10)[1].all()
+    np.testing.assert_array_equal(cache.get(month_file, 10)[0], tec)
+
+
+def test_cache_byte_budget(month_file):
+    tec, labels, _ = utils.open_map({'h5_file': month_file, 'index': 0})
+    entry_bytes = tec.nbytes + labels.nbytes
+    cache = MapCache(max_bytes=3 * entry_bytes, neighbours=0)
+    for i in range(6):
+        cache.get(month_file, i)
+    assert len(cache) == 3
+    assert cache.nbytes <= cache.max_bytes
+    assert (month_file, 5) in cache and (month_file, 0) not in cache
+    cache.invalidate(month_file)
+    assert len(cache) == 0 and cache.nbytes == 0
+
+
+def test_cache_rereads_blocks_written_during_the_read(month_file, monkeypatch):
+    generation = [0]
+    read_maps = utils.read_maps
+    reads = []
+
+    def read_during_write(fn, start, stop):
+        result = read_maps(fn, start, stop)
+        reads.append(start)
+        if len(reads) == 1:
+            # a save of map 5 finishes after its old labels were read
+            utils.write_labels(fn, {5: np.ones((20, 36), dtype=bool)})
+            generation[0] += 1
+        return result
+
+    monkeypatch.setattr(utils, 'read_maps', read_during_write)
+    cache = MapCache(neighbours=1, pending_labels=lambda fn, index: None,
+                     write_generation=lambda fn: generation[0])
+    assert cache.get(month_file, 5)[1].all()
+    assert len(reads) == 2
@@ -0,0 +1,62 @@
+import os
+import json
+import numpy as np
+import h5py
+
+from teclab import check, utils
+from teclab.synthetic import generate_dataset, month_range
+
+
+def test_check_dataset(tmp_path):
+    data_dir = str(tmp_path / 'data')
+    cache_file = str(tmp_path / 'cache' / 'integrity.json')
+    info = generate_dataset(data_dir, month_range(2012, 6, 3), shape=(20, 36), n_maps=12, labeled_fraction=.3,
+                            unsure_fraction=.2)
+    done, unsure = info['done_list'], info['unsure_list']
+    report = check.check_dataset(data_dir, done, unsure, cache_file, max_workers=2)
+    assert report['errors'] == [] and report['warnings'] == []
+    assert len(report['checked']) == 3
+
+    # unchanged files aren't opened again, touched files are hashed but not re-checked
+    os.utime(info['files'][1])
+    report = check.check_dataset(data_dir, done, unsure, cache_file)
+    assert report['checked'] == [] and len(report['unchanged']) == 3
+
+    fn_6, fn_7, fn_8 = info['files']
+    unlabeled = next(i for i in range(12) if [2012, 7, i] not in done + unsure)
+    utils.write_labels(fn_7, {unlabeled: np.ones((20, 36), dtype=bool)})
+    with h5py.File(fn_8, 'r+') as f:
+        start_time = f['start_time'][()]
+        start_time[5] = start_time[4]
+        start_time[9] = start_time[0] - 3600 * 24 * 40
+        f['start_time'][...] = start_time
+    report = check.check_dataset(data_dir, done + [[2012, 6, 50]], unsure, cache_file, max_workers=2)
+    assert report['checked'] == ['2012_07_tec.h5', '2012_08_tec.h5']
+    errors = '\n'.join(report['errors'])
+    assert f"(2012, 7, {unlabeled}) has labels" in errors
+    assert "2012_08_tec.h5: 1 duplicate start times" in errors
+    assert "2012_08_tec.h5: start times decrease at indices [9]" in errors
+    assert "2012_08_tec.h5: 1 start times outside 2012-08" in errors
+    assert "progress done: (2012, 6, 50) is not a map" in errors
+
+    year, month, index = done[0]
+    utils.write_labels(info['files'][[6, 7, 8].index(month)], {index: np.zeros((20, 36), dtype=bool)})
+    report = check.check_dataset(data_dir, done, unsure, cache_file)
+    assert report['warnings'] == [f"{(year, month, index)} is done but has no labels"]
+
+
+def test_check_shapes(tmp_path):
+    data_dir = str(tmp_path)
+    generate_dataset(data_dir, month_range(2012, 6, 1), shape=(20, 36), n_maps=12)
+    with h5py.File(os.path.join(data_dir, "2013_01_tec.h5"), 'w') as f:
+        f.create_dataset('tec', data=np.zeros((20, 30, 5)))
+        f.create_dataset('labels', data=np.zeros((20, 30, 4), dtype=bool))
+        f.create_dataset('start_time', data=np.arange(5.))
+    with open(os.path.join(data_dir, "unsure.json"), 'w') as f:
+        json.dump({'list': [[2013, 1, 4], [2013, 2, 0]]}, f)
+    errors = check.check_dataset(data_dir)['errors']
+    assert "2013_01_tec.h5: labels shape (20, 30, 4) != (20, 30, 5)" in errors
+    assert "2013_01_tec.h5: map shape [20, 30] != grid shape [20, 36]" in errors
+    assert "2013_01_tec.h5: 5 start times outside 2013-01" in errors
+    assert "unsure.json: (2013, 2, 0) is not a map of the dataset" in errors
+    assert not any("(2013, 1, 4)" in e for e in errors)
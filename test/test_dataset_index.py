@@ -0,0 +1,67 @@
+import os
+import glob
+import datetime
+import numpy as np
+import h5py
+
+from teclab import utils
+from teclab.dataset_index import DatasetIndex, load_index
+from conftest import write_month_file
+
+
+def legacy_map_tree(data_dir):
+    files = sorted(glob.glob(os.path.join(data_dir, "*tec.h5")))
+    timestamps = []
+    for file in files:
+        with h5py.File(file, 'r') as f:
+            timestamps.append(f['start_time'][()])
+    timestamps = np.concatenate(timestamps)
+    datetimes = np.array([datetime.datetime.utcfromtimestamp(ts) for ts in timestamps])
+    years = np.array([dt.year for dt in datetimes])
+    months = np.array([dt.month for dt in datetimes])
+    tree = {}
+    for yr in np.unique(years):
+        for mn in range(1, 13):
+            mask = (years == yr) * (months == mn)
+            if mask.sum() == 0:
+                continue
+            if yr not in tree:
+                tree[yr] = {}
+            tree[yr][mn] = {'index': np.arange(mask.sum()), 'datetime': datetimes[mask]}
+    return tree
+
+
+def assert_trees_equal(tree, expected):
+    assert list(tree.keys()) == list(expected.keys())
+    for yr in expected:
+        assert list(tree[yr].keys()) == list(expected[yr].keys())
+        for mn in expected[yr]:
+            np.testing.assert_array_equal(tree[yr][mn]['index'], expected[yr][mn]['index'])
+            assert list(tree[yr][mn]['datetime']) == list(expected[yr][mn]['datetime'])
+
+
+def test_map_tree_matches_scan(tmp_path):
+    data_dir = str(tmp_path)
+    write_month_file(data_dir, 2012, 12, n_maps=30)
+    write_month_file(data_dir, 2013, 1, n_maps=20)
+    write_month_file(data_dir, 2013, 2)
+    assert_trees_equal(utils.get_map_tree(data_dir), legacy_map_tree(data_dir))
+
+
+def test_index_refresh_is_incremental(tmp_path):
+    data_dir = str(tmp_path)
+    write_month_file(data_dir, 2013, 1, n_maps=20)
+    write_month_file(data_dir, 2013, 2, n_maps=20)
+    index = load_index(data_dir)
+    assert os.path.exists(index.index_file)
+
+    reloaded = DatasetIndex(data_dir)
+    reloaded.load()
+    assert reloaded.refresh() == []
+
+    fn = write_month_file(data_dir, 2013, 2, n_maps=10)
+    os.utime(fn, ns=(0, 0))
+    write_month_file(data_dir, 2013, 3, n_maps=5)
+    assert reloaded.refresh() == ['2013_02_tec.h5', '2013_03_tec.h5']
+    assert reloaded.files['2013_02_tec.h5']['shape'] == [20, 36, 10]
+    assert_trees_equal(reloaded.map_tree(), legacy_map_tree(data_dir))
@@ -0,0 +1,101 @@
+import os
+import numpy as np
+import pytest
+
+from teclab import utils, export
+from teclab.sampling import DONE, UNSURE
+from conftest import write_month_file
+
+
+def test_export_incremental(tmp_path):
+    data_dir, out_dir = str(tmp_path / 'data'), str(tmp_path / 'out')
+    os.makedirs(data_dir)
+    fn_6 = write_month_file(data_dir, 2012, 6, n_maps=24)
+    fn_7 = write_month_file(data_dir, 2012, 7, n_maps=24, seed=1)
+    pattern = os.path.join(data_dir, "{year:04d}_{month:02d}_tec.h5")
+    rng = np.random.default_rng(0)
+    labels = {(fn_6, 3): rng.random((20, 36)) > .5, (fn_7, 10): rng.random((20, 36)) > .5,
+              (fn_6, 12): rng.random((20, 36)) > .5}
+    for (fn, index), lab in labels.items():
+        utils.update_h5({'h5_file': fn, 'index': index}, lab)
+
+    maps = [(2012, 7, 10, DONE), (2012, 6, 12, UNSURE)]
+    assert export.export_maps(maps, pattern, out_dir, max_workers=2) == 2
+    maps.append((2012, 6, 3, DONE))
+    assert export.export_maps(maps, pattern, out_dir, max_workers=2) == 1
+    assert export.export_maps(maps, pattern, out_dir) == 0
+
+    tec, lab, metadata = export.open_export(out_dir)
+    assert tec.shape == lab.shape == (3, 20, 36)
+    assert [(int(m['month']), int(m['index']), m['status']) for m in metadata] == [
+        (6, 12, 'unsure'), (7, 10, 'done'), (6, 3, 'done')]
+    assert metadata[2]['datetime'] == '2012-06-01T03:00:00'
+    for row, m in enumerate(metadata):
+        fn = pattern.format(year=2012, month=int(m['month']))
+        tec_map, labels_map, _ = utils.open_map({'h5_file': fn, 'index': int(m['index'])})
+        np.testing.assert_array_equal(tec[row], tec_map.astype(np.float32))
+        np.testing.assert_array_equal(lab[row], labels[(fn, int(m['index']))])
+
+
+def test_export_interrupted_append(tmp_path):
+    data_dir, out_dir = str(tmp_path / 'data'), str(tmp_path / 'out')
+    os.makedirs(data_dir)
+    write_month_file(data_dir, 2012, 6, n_maps=24)
+    pattern = os.path.join(data_dir, "{year:04d}_{month:02d}_tec.h5")
+    export.export_maps([(2012, 6, 1, DONE)], pattern, out_dir)
+    # bytes of a map whose metadata never got written
+    with open(os.path.join(out_dir, export.TEC_FILE), 'ab') as f:
+        f.write(b'\0' * 100)
+    export.export_maps([(2012, 6, 1, DONE), (2012, 6, 2, DONE)], pattern, out_dir)
+    tec, _, metadata = export.open_export(out_dir)
+    assert os.path.getsize(os.path.join(out_dir, export.TEC_FILE)) == tec.nbytes
+    assert [int(m['index']) for m in metadata] == [1, 2]
+
+
+def test_export_interrupted_before_info(tmp_path, monkeypatch):
+    data_dir, out_dir = str(tmp_path / 'data'), str(tmp_path / 'out')
+    os.makedirs(data_dir)
+    write_month_file(data_dir, 2012, 6, n_maps=24)
+    write_month_file(data_dir, 2012, 7, n_maps=24, seed=1)
+    pattern = os.path.join(data_dir, "{year:04d}_{month:02d}_tec.h5")
+    export.export_maps([(2012, 6, 1, DONE)], pattern, out_dir)
+
+    # interrupted after the metadata of July was appended but before export.json was updated
+    write_info = export._write_info
+
+    def interrupted(info_file, info):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(export, '_write_info', interrupted)
+    maps = [(2012, 6, 1, DONE), (2012, 7, 4, DONE)]
+    with pytest.raises(KeyboardInterrupt):
+        export.export_maps(maps, pattern, out_dir)
+    assert len(export.read_metadata(out_dir)) == 2
+    monkeypatch.setattr(export, '_write_info', write_info)
+
+    assert export.export_maps(maps + [(2012, 7, 5, DONE)], pattern, out_dir) == 2
+    tec, _, metadata = export.open_export(out_dir)
+    assert len(export.read_metadata(out_dir)) == tec.shape[0] == 3
+    assert [(int(m['month']), int(m['index'])) for m in metadata] == [(6, 1), (7, 4), (7, 5)]
+    for row, m in enumerate(metadata):
+        assert int(m['row']) == row
+        fn = pattern.format(year=2012, month=int(m['month']))
+        tec_map = utils.open_map({'h5_file': fn, 'index': int(m['index'])})[0]
+        np.testing.assert_array_equal(tec[row], tec_map.astype(np.float32))
+
+
+def test_export_updates_status(tmp_path):
+    data_dir, out_dir = str(tmp_path / 'data'), str(tmp_path / 'out')
+    os.makedirs(data_dir)
+    write_month_file(data_dir, 2012, 6, n_maps=24)
+    pattern = os.path.join(data_dir, "{year:04d}_{month:02d}_tec.h5")
+    export.export_maps([(2012, 6, 1, DONE), (2012, 6, 2, DONE), (2012, 6, 3, UNSURE)], pattern, out_dir)
+    # map 1 was marked unsure and the export is re-run with --exclude-unsure, map 3 was reset
+    assert export.export_maps([(2012, 6, 2, DONE)], pattern, out_dir) == 0
+    _, _, metadata = export.open_export(out_dir)
+    assert [m['status'] for m in metadata] == [export.EXCLUDED, 'done', export.EXCLUDED]
+    # selected again, the row is reused instead of appended
+    assert export.export_maps([(2012, 6, 1, UNSURE), (2012, 6, 2, DONE)], pattern, out_dir) == 0
+    tec, _, metadata = export.open_export(out_dir)
+    assert tec.shape[0] == 3
+    assert [m['status'] for m in metadata] == ['unsure', 'done', export.EXCLUDED]
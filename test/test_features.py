@@ -0,0 +1,63 @@
+import os
+import warnings
+import numpy as np
+
+from teclab import utils, features
+from conftest import write_month_file
+
+
+def test_box_mean():
+    rng = np.random.default_rng(0)
+    tec = rng.random((12, 18, 3))
+    tec[rng.random(tec.shape) < .3] = np.nan
+    result = features.box_mean(tec, 5)
+    expected = np.empty(tec.shape)
+    for i in range(12):
+        for j in range(18):
+            window = tec[max(i - 2, 0):i + 3][:, np.arange(j - 2, j + 3) % 18]
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)
+                expected[i, j] = np.nanmean(window, axis=(0, 1))
+    np.testing.assert_allclose(result, expected)
+
+
+def test_trough_features():
+    mlat_vals = np.arange(40, 80, 2.)
+    tec = np.tile((10 - 5 * np.exp(-((mlat_vals - 60) / 4) ** 2))[:, None, None], (1, 8, 2))
+    labels = np.zeros(tec.shape, dtype=bool)
+    labels[8:13, :4, 0] = True
+    result = features.trough_features(tec, labels, mlat_vals, avg_size=1)
+    np.testing.assert_allclose(result['min_lat'][:4, 0], 60)
+    np.testing.assert_allclose(result['min_tec'][:4, 0], 5)
+    np.testing.assert_allclose(result['pwall_lat'][:4, 0], 64)
+    np.testing.assert_allclose(result['ewall_lat'][:4, 0], 56)
+    np.testing.assert_allclose(result['width'][:4, 0], 8)
+    np.testing.assert_allclose(result['depth'][:4, 0], 5 - 5 * np.exp(-1))
+    np.testing.assert_allclose(result['pwall_gradient'][:4, 0], (5 - 5 * np.exp(-1)) / 4)
+    for name in features.FEATURES:
+        assert np.isnan(result[name][4:, 0]).all() and np.isnan(result[name][:, 1]).all()
+    # reversed mlat axis gives the same features
+    reversed_result = features.trough_features(tec[::-1], labels[::-1], mlat_vals[::-1], avg_size=1)
+    for name in features.FEATURES:
+        np.testing.assert_allclose(reversed_result[name], result[name])
+
+
+def test_feature_table(tmp_path):
+    data_dir = str(tmp_path)
+    fn = write_month_file(data_dir, 2012, 6, n_maps=24)
+    labels = np.zeros((20, 36), dtype=bool)
+    labels[5:9, 10:20] = True
+    utils.update_h5({'h5_file': fn, 'index': 7}, labels)
+    mlat_vals, mlt_vals = np.linspace(40, 80, 20), np.linspace(0, 24, 36, endpoint=False)
+    pattern = os.path.join(data_dir, "{year:04d}_{month:02d}_tec.h5")
+    table = features.feature_table([(2012, 6, 7), (2012, 6, 2)], pattern, mlat_vals, mlt_vals, max_workers=1)
+    assert list(table) == features.KEY_COLUMNS + features.FEATURES
+    assert table['year'].shape == (10, )
+    assert set(table['index']) == {7}
+    np.testing.assert_allclose(table['mlt'], mlt_vals[10:20])
+    np.testing.assert_allclose(table['pwall_lat'], mlat_vals[8])
+
+    features.save_table(table, str(tmp_path / 'features.npz'))
+    features.save_table(table, str(tmp_path / 'features.csv'))
+    loaded = np.load(str(tmp_path / 'features.npz'))
+    np.testing.assert_allclose(loaded['min_tec'], table['min_tec'])
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+
+@pytest.mark.parametrize('size', [15, 4])
+def test_brush_cursor_matches_brush_footprint(qt_app, size):
+    from teclab import image_items, strokes
+    cursor = image_items.BrushCursor(size)
+    assert not cursor.isVisible()
+    cursor.move_to(40.7, 60.2)
+    assert cursor.isVisible()
+    assert (cursor.pos().x(), cursor.pos().y()) == (40.5, 60.5)
+
+    image = np.zeros((100, 100))
+    strokes.draw_segment(image, (40, 60), (40, 60), (size - 1) / 2, 1)
+    xs, ys = np.nonzero(image)
+    rect = cursor.mapRectToParent(cursor.rect())
+    # the painted pixels fill the outline's bounding box
+    assert (rect.left(), rect.right()) == (xs.min(), xs.max() + 1)
+    assert (rect.top(), rect.bottom()) == (ys.min(), ys.max() + 1)
+
+
+def test_brush_cursor_follows_brush_size(qt_app, synthetic_config):
+    import pyqtgraph as pg
+    from teclab.app import App
+    from teclab.gui import Gui
+    app = App()
+    gui = Gui(app)
+    app.gui = gui
+    assert gui.brush_cursor.rect().width() == 15
+    gui.param_object.child('Editing', 'Brush Size').setValue(5)
+    assert gui.brush_cursor.rect().width() == 5 and gui.draw_img.brush_radius == 2
+
+    center = gui.viewbox.mapViewToScene(gui.draw_img.mapToView(pg.QtCore.QPointF(50, 50)))
+    gui.move_cursor(center)
+    assert gui.brush_cursor.isVisible()
+    gui.move_cursor(gui.viewbox.mapViewToScene(gui.draw_img.mapToView(pg.QtCore.QPointF(-500, -500))))
+    assert not gui.brush_cursor.isVisible()
+    gui.close()
+
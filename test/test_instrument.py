@@ -0,0 +1,78 @@
+import time
+import logging
+import threading
+
+from teclab import instrument
+
+
+def test_spans_and_counters():
+    session = instrument.Instrumentation(window=5)
+    seen = []
+    session.add_listener(lambda name, seconds: seen.append(name))
+
+    @session.timed()
+    def work(x):
+        time.sleep(.001)
+        return x * 2
+
+    assert work.__name__ == 'work'
+    threads = [threading.Thread(target=work, args=(i, )) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    with session.span('block'):
+        session.count('event')
+        session.count('event', 2)
+
+    summary = session.summary()
+    name = 'test_spans_and_counters.<locals>.work'
+    assert summary['spans'][name]['n'] == 8
+    assert len(session.histograms[name].samples) == 5
+    assert sum(c for _, c in session.histograms[name].buckets()) == 5
+    assert summary['spans'][name]['p50'] >= .001
+    assert summary['counters'] == {'event': 3}
+    assert seen.count(name) == 8 and seen[-1] == 'block'
+    assert 'block' in session.format_summary()
+
+
+def test_span_records_failures():
+    session = instrument.Instrumentation()
+    try:
+        with session.span('failing'):
+            raise RuntimeError
+    except RuntimeError:
+        pass
+    assert session.summary()['spans']['failing']['n'] == 1
+
+
+def test_profile_next(tmp_path, caplog):
+    session = instrument.Instrumentation(profile_dir=str(tmp_path))
+    session.profile_next('op')
+    with caplog.at_level(logging.INFO, logger='teclab.instrument'):
+        for _ in range(2):
+            with session.span('op'):
+                sorted(range(1000))
+    assert len(list(tmp_path.glob('op_*.prof'))) == 1
+    assert sum('Profile of op' in r.message for r in caplog.records) == 1
+
+
+def test_listeners(caplog):
+    session = instrument.Instrumentation()
+    seen = []
+
+    def failing(name, seconds):
+        raise RuntimeError("wrapped C/C++ object has been deleted")
+
+    session.add_listener(failing)
+    session.add_listener(lambda name, seconds: seen.append(name))
+    with caplog.at_level(logging.ERROR, logger='teclab.instrument'):
+        with session.span('a'):
+            pass
+    assert seen == ['a'] and session.summary()['spans']['a']['n'] == 1
+    assert "Span listener" in caplog.text
+    session.remove_listener(failing)
+    session.remove_listener(failing)
+    with session.span('b'):
+        pass
+    assert session.listeners != [] and seen == ['a', 'b']
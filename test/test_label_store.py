@@ -0,0 +1,82 @@
+import os
+import numpy as np
+import h5py
+
+from teclab import label_store, utils, export
+from teclab.label_store import LabelStore
+from teclab.writer import LabelWriter
+from teclab.sampling import DONE
+from conftest import write_month_file
+
+
+def test_round_trip(month_file, tmp_path):
+    rng = np.random.default_rng(0)
+    for shape in [(20, 36), (7, 13)]:
+        for labels in [rng.random(shape) > .8, np.zeros(shape, dtype=bool), np.ones(shape, dtype=bool)]:
+            np.testing.assert_array_equal(label_store.decode(label_store.encode(labels), shape), labels)
+
+    labels = {index: rng.random((20, 36)) > .7 for index in [0, 5, 47]}
+    utils.write_labels(month_file, labels)
+    store = LabelStore(str(tmp_path / 'labels.sqlite'))
+    assert label_store.import_file(store, month_file, 2012, 6) == 3
+    assert label_store.import_file(store, month_file, 2012, 6) == 0
+    with h5py.File(month_file, 'r') as f:
+        dense = f['labels'][()]
+    np.testing.assert_array_equal(label_store.dense_labels(store, 2012, 6, dense.shape), dense)
+    assert store.get(2012, 6, 1) is None
+
+    other = write_month_file(str(tmp_path), 2012, 7, n_maps=48)
+    assert label_store.write_file(store, other, 2012, 6) == 3
+    with h5py.File(other, 'r') as f:
+        np.testing.assert_array_equal(f['labels'][()], dense)
+    stats = store.stats()
+    assert stats['n_maps'] == 3 and stats['encoded_bytes'] < stats['dense_bytes']
+    store.close()
+
+
+def test_change_tracking(month_file, tmp_path):
+    store = LabelStore(str(tmp_path / 'labels.sqlite'))
+    labels = np.zeros((20, 36), dtype=bool)
+    labels[3:6] = True
+    assert store.put(2012, 6, 1, labels, mtime=10)
+    assert store.put(2012, 6, 2, labels, mtime=20)
+    assert not store.put(2012, 6, 1, labels, mtime=30)
+    assert store.mtime(2012, 6, 1) == 10
+    assert store.changed_since(15) == [(2012, 6, 2)]
+
+    # the h5 file is written even though the store already has these labels
+    writer = LabelWriter(batch_delay=60, label_store=store)
+    writer.submit({'h5_file': month_file, 'year': 2012, 'month': 6, 'index': 1}, labels)
+    writer.flush()
+    np.testing.assert_array_equal(utils.open_map({'h5_file': month_file, 'index': 1})[1], labels)
+    writer.submit({'h5_file': month_file, 'year': 2012, 'month': 6, 'index': 4}, labels)
+    writer.close()
+    np.testing.assert_array_equal(utils.open_map({'h5_file': month_file, 'index': 4})[1], labels)
+    assert store.changed_since(20) == [(2012, 6, 4)]
+    store.close()
+
+
+def test_export_update_changed(tmp_path):
+    data_dir, out_dir = str(tmp_path / 'data'), str(tmp_path / 'out')
+    os.makedirs(data_dir)
+    fn = write_month_file(data_dir, 2012, 6, n_maps=24)
+    pattern = os.path.join(data_dir, "{year:04d}_{month:02d}_tec.h5")
+    store = LabelStore(os.path.join(data_dir, 'labels.sqlite'))
+    export.export_maps([(2012, 6, 2, DONE), (2012, 6, 5, DONE)], pattern, out_dir)
+    assert export.update_changed(out_dir, store) == 0
+
+    labels = np.random.default_rng(0).random((20, 36)) > .5
+    writer = LabelWriter(batch_delay=0, label_store=store)
+    writer.submit({'h5_file': fn, 'year': 2012, 'month': 6, 'index': 5}, labels)
+    writer.submit({'h5_file': fn, 'year': 2012, 'month': 6, 'index': 9}, labels)
+    writer.close()
+    assert export.update_changed(out_dir, store) == 1
+    assert export.update_changed(out_dir, store) == 0
+    _, exported, metadata = export.open_export(out_dir)
+    assert [int(m['index']) for m in metadata] == [2, 5]
+    np.testing.assert_array_equal(exported[1], labels)
+    assert not exported[0].any()
+
+    report = label_store.storage_report(store, data_dir)
+    assert report['stored_maps'] == 2 and report['store_bytes_per_save'] < report['dense_bytes_per_save']
+    store.close()
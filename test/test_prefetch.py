@@ -0,0 +1,81 @@
+import threading
+import numpy as np
+import pytest
+
+from teclab import sampling
+from teclab.dataset_index import build_map_tree
+from teclab.prefetch import Prefetcher
+
+
+@pytest.fixture
+def sampler():
+    times = np.arange(np.datetime64('2013-01-01T00'), np.datetime64('2013-01-01T12'), np.timedelta64(1, 'h'))
+    return sampling.MapSampler(build_map_tree(times.astype('datetime64[s]').astype(float)), seed=0)
+
+
+def test_prefetch_loads_in_background(sampler):
+    threads = []
+
+    def load(year, month, index, datetime):
+        threads.append(threading.current_thread())
+        return index * 10
+
+    prefetcher = Prefetcher(sampler, load, depth=3)
+    prefetcher.fill()
+    assert len(prefetcher) == 3
+    seen = set()
+    for _ in range(12):
+        key, entry = prefetcher.pop()
+        assert entry == key[2] * 10
+        assert key[2] not in seen
+        seen.add(key[2])
+        sampler.set_status(*key[:3], sampling.DONE)
+    assert threading.main_thread() not in threads
+    with pytest.raises(LookupError):
+        prefetcher.pop()
+    prefetcher.shutdown()
+
+
+def test_prefetch_skips_labeled(sampler):
+    prefetcher = Prefetcher(sampler, lambda *key: key, depth=4)
+    prefetcher.fill()
+    queued = [key for key, _, _ in prefetcher._queue]
+    for key in queued[:2]:
+        sampler.set_status(*key[:3], sampling.DONE)
+    key, entry = prefetcher.pop()
+    assert key == queued[2] and entry == key
+    prefetcher.set_strategy(sampling.RevisitUnsure())
+    assert len(prefetcher) == 0
+    prefetcher.shutdown()
+
+
+def test_prefetch_load_errors(sampler):
+    attempts = []
+
+    def load(year, month, index, datetime):
+        if index == 3:
+            attempts.append(index)
+            # h5py raises KeyError for a missing dataset, it mustn't look like an exhausted sampler
+            raise KeyError("Unable to open object 'tec'")
+        return index
+
+    prefetcher = Prefetcher(sampler, load, depth=2)
+    loaded, failed = set(), 0
+    while True:
+        try:
+            key, entry = prefetcher.pop()
+        except RuntimeError as e:
+            assert "(2013, 1, 3)" in str(e)
+            failed += 1
+            continue
+        except LookupError:
+            break
+        loaded.add(entry)
+        sampler.set_status(*key[:3], sampling.DONE)
+    # the broken map is skipped for the rest of the session instead of being sampled again
+    assert loaded == set(range(12)) - {3}
+    assert failed == 1 and attempts == [3]
+    assert sampler.get_status(2013, 1, 3) == sampling.UNLABELED
+    sampler.set_excluded(np.zeros(len(sampler), dtype=bool))
+    assert len(sampler.unlabeled) == 0
+    prefetcher.shutdown()
@@ -0,0 +1,60 @@
+import os
+import numpy as np
+import h5py
+
+from teclab import utils, prelabel
+
+
+def _trough_maps(n_maps=4, seed=0):
+    mlat_vals = np.arange(30, 90, 1.)
+    mlt_vals = np.arange(0, 24, .5)
+    rng = np.random.default_rng(seed)
+    profile = 20 - 10 * np.exp(-((mlat_vals - 60) / 3) ** 2)
+    tec = profile[:, None, None] * (1 + .05 * rng.standard_normal((mlat_vals.shape[0], mlt_vals.shape[0], n_maps)))
+    tec[rng.random(tec.shape) < .05] = np.nan
+    return tec, mlat_vals, mlt_vals
+
+
+def test_threshold_proposals():
+    tec, mlat_vals, mlt_vals = _trough_maps()
+    proposals = prelabel.threshold_proposals(tec, mlat_vals, mlt_vals)
+    assert proposals.shape == tec.shape
+    trough = np.abs(mlat_vals - 60) <= 1
+    assert proposals[trough].mean() > .95
+    assert proposals[np.abs(mlat_vals - 60) > 10].mean() < .01
+
+
+def test_prelabel_dataset(tmp_path):
+    data_dir, proposal_dir = str(tmp_path / 'data'), str(tmp_path / 'proposals')
+    os.makedirs(data_dir)
+    tec, mlat_vals, mlt_vals = _trough_maps(n_maps=6)
+    fn = os.path.join(data_dir, "2012_06_tec.h5")
+    with h5py.File(fn, 'w') as f:
+        f.create_dataset('tec', data=tec)
+        f.create_dataset('labels', data=np.zeros(tec.shape, dtype=bool))
+        f.create_dataset('start_time', data=np.arange(6) * 3600.)
+
+    results = prelabel.prelabel_dataset(data_dir, proposal_dir, mlat_vals, mlt_vals, max_workers=1, block_size=4)
+    assert results == [("2012_06_tec.h5", 6)]
+    assert prelabel.prelabel_dataset(data_dir, proposal_dir, mlat_vals, mlt_vals, max_workers=1) == []
+    proposal = prelabel.read_proposal(proposal_dir, 2012, 6, 5)
+    np.testing.assert_array_equal(proposal, prelabel.threshold_proposals(tec, mlat_vals, mlt_vals)[:, :, 5])
+    assert prelabel.read_proposal(proposal_dir, 2012, 7, 0) is None
+
+    # saving labels rewrites the month file but not its TEC
+    utils.update_h5({'h5_file': fn, 'index': 4}, np.ones(tec.shape[:2], dtype=bool))
+    assert prelabel.prelabel_dataset(data_dir, proposal_dir, mlat_vals, mlt_vals, max_workers=1) == []
+    with h5py.File(fn, 'r+') as f:
+        f['tec'][:, :, 5] = 20
+    assert prelabel.prelabel_dataset(data_dir, proposal_dir, mlat_vals, mlt_vals, max_workers=1) == \
+        [("2012_06_tec.h5", 6)]
+    assert not prelabel.read_proposal(proposal_dir, 2012, 6, 5).any()
+
+    # a model trained on labeled maps reproduces their labels
+    labels = np.abs(mlat_vals - 60)[:, None] <= 3
+    for index in range(3):
+        utils.update_h5({'h5_file': fn, 'index': index}, np.broadcast_to(labels, tec.shape[:2]))
+    pattern = os.path.join(data_dir, "{year:04d}_{month:02d}_tec.h5")
+    model = prelabel.train_model([(2012, 6, i) for i in range(3)], pattern, mlat_vals, mlt_vals)
+    proposals = prelabel.model_proposals(model, tec[:, :, 3:], mlat_vals, mlt_vals)
+    assert (proposals == labels[:, :, None]).mean() > .95
@@ -0,0 +1,59 @@
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+from teclab.progress import ProgressStore
+from teclab.sampling import UNLABELED, DONE, UNSURE
+from teclab.synthetic import generate_dataset, month_range
+
+
+def test_import_json(tmp_path):
+    done_file = tmp_path / 'labeled.json'
+    unsure_file = tmp_path / 'unsure.json'
+    done_file.write_text(json.dumps({'list': [[2012, 6, 3], [2012, 6, 1], [2013, 1, 0]]}))
+    unsure_file.write_text(json.dumps({}))
+    store = ProgressStore(str(tmp_path / 'progress.sqlite'))
+    assert store.import_json(str(done_file), str(unsure_file))
+    assert not store.import_json(str(done_file), str(unsure_file))
+    assert store.done_list() == [(2012, 6, 1), (2012, 6, 3), (2013, 1, 0)]
+    assert store.unsure_list() == []
+    assert (2012, 6, 3) in store and (2012, 6, 2) not in store
+
+
+def test_status_changes_and_compaction(tmp_path):
+    store = ProgressStore(str(tmp_path / 'progress.sqlite'), compact_every=1000)
+    store.record({'year': 2012, 'month': 6, 'index': 3, 'unsure': True})
+    assert store.get_status(2012, 6, 3) == UNSURE
+    store.record({'year': 2012, 'month': 6, 'index': 3, 'unsure': False})
+    store.set_status(2012, 6, 4, DONE)
+    store.set_status(2012, 6, 4, UNLABELED)
+    assert store.done_list() == [(2012, 6, 3)]
+    assert store.unsure_list() == []
+    assert len(store.changes_since(0)) == 4
+    assert store.compact() == 2
+    assert [change[1:] for change in store.changes_since(0)] == [(2012, 6, 3, DONE), (2012, 6, 4, UNLABELED)]
+
+
+def _label_month(args):
+    db_file, month = args
+    store = ProgressStore(db_file)
+    for index in range(20):
+        store.set_status(2012, month, index, DONE)
+    store.close()
+
+
+def test_concurrent_processes(tmp_path):
+    db_file = str(tmp_path / 'progress.sqlite')
+    ProgressStore(db_file).close()
+    with ProcessPoolExecutor(4) as executor:
+        list(executor.map(_label_month, [(db_file, month) for month in range(1, 9)]))
+    assert len(ProgressStore(db_file).done_list()) == 160
+
+
+def test_import_synthetic_progress(tmp_path):
+    info = generate_dataset(str(tmp_path), month_range(2012, 6, 2), shape=(10, 18), n_maps=10, labeled_fraction=.3,
+                            unsure_fraction=.2)
+    store = ProgressStore(str(tmp_path / 'progress.sqlite'))
+    assert store.import_json(str(tmp_path / 'labeled.json'), str(tmp_path / 'unsure.json'))
+    assert store.done_list() == sorted(tuple(key) for key in info['done_list'])
+    assert store.unsure_list() == sorted(tuple(key) for key in info['unsure_list'])
+    assert store.done_list() and store.unsure_list()
@@ -0,0 +1,105 @@
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import pytest
+
+from teclab import rendering
+
+
+@pytest.fixture(scope='module')
+def grid():
+    mlat = np.arange(30, 90, 1.) + .5
+    mlt = np.arange(0, 24, .2) + .1
+    return np.meshgrid(np.pi * (mlt - 6) / 12, 90 - mlat)
+
+
+@pytest.fixture(scope='module')
+def renderer(grid):
+    return rendering.PolarRenderer(*grid)
+
+
+def test_matches_pcolormesh(grid, renderer):
+    theta, r = grid
+    tec = 10 + 12 * np.sin(theta) * np.cos(r / 20)
+    tec[20:25, 40:50] = np.nan
+    rgba = renderer.render(tec, vmin=0, vmax=20)
+
+    fig = plt.figure(figsize=(10, 10), dpi=100, tight_layout=True)
+    ax = fig.add_subplot(projection='polar')
+    ax.pcolormesh(theta, r, tec, shading='nearest', vmin=0, vmax=20)
+    rendering.format_polar_mag_ax(ax)
+    fig.patch.set_alpha(0)
+    ax.patch.set_alpha(0)
+    fig.canvas.draw()
+    reference = np.swapaxes(np.array(fig.canvas.buffer_rgba())[::-1], 0, 1)
+    plt.close(fig)
+
+    assert rgba.shape == reference.shape
+    assert ((rgba[..., 3] > 0) == (reference[..., 3] > 0)).mean() > .99
+    opaque = (rgba[..., 3] == 255) & (reference[..., 3] == 255)
+    diff = abs(rgba[opaque].astype(int) - reference[opaque].astype(int)).max(axis=-1)
+    assert np.percentile(diff, 95) <= 10
+
+
+def test_pixel_cell_index(grid, renderer):
+    theta, r = grid
+    cell_index = renderer.cell_index
+    assert cell_index.shape == renderer.size
+    assert cell_index.max() < theta.size
+    # every grid cell is covered by at least one pixel except near the pole
+    covered = np.bincount(cell_index[cell_index >= 0], minlength=theta.size).reshape(theta.shape)
+    assert (covered[:-5] > 0).all()
+
+
+def test_color_range_only_recolors(grid, renderer):
+    tec = np.random.default_rng(0).random(grid[0].shape) * 20
+    values = renderer.gather(tec)
+    np.testing.assert_array_equal(renderer.render(values=values, vmin=2, vmax=8), renderer.render(tec, vmin=2, vmax=8))
+    assert np.isnan(values[0, 0])
+    assert renderer.render(values=values, vmin=2, vmax=8)[0, 0, 3] == 0
+
+
+def test_pixels_to_grid_matches_binned_statistic(grid, renderer):
+    from scipy.stats import binned_statistic_2d
+
+    theta, r = grid
+    width, height = renderer.size
+    pixel_img = np.zeros((width, height))
+    pixel_img[300:520, 200:700] = 255
+    pixel_img[600:610, 600:900] = 255
+
+    X, Y = np.meshgrid(np.arange(width) + .5, np.arange(height) + .5, indexing='ij')
+    tr = renderer.ax.transData.inverted().transform(np.column_stack((X.ravel(), Y.ravel())))
+    theta_bins, r_bins = rendering.grid_bins(theta, r)
+    tr[tr[:, 0] > theta_bins.max(), 0] -= 2 * np.pi
+    tr[tr[:, 0] < theta_bins.min(), 0] += 2 * np.pi
+    res = binned_statistic_2d(tr[:, 0], tr[:, 1], pixel_img.ravel(), bins=[theta_bins, r_bins])
+    expected = res.statistic.T[::-1] > .5
+
+    np.testing.assert_array_equal(renderer.pixels_to_grid(pixel_img), expected)
+
+
+def test_cell_index_persisted(grid, tmp_path):
+    first = rendering.PolarRenderer(*grid, cache_dir=str(tmp_path))
+    files = list(tmp_path.iterdir())
+    assert len(files) == 1
+    second = rendering.PolarRenderer(*grid, cache_dir=str(tmp_path))
+    np.testing.assert_array_equal(first.cell_index, second.cell_index)
+    other = rendering.PolarRenderer(*grid, figsize=(5, 5), cache_dir=str(tmp_path))
+    assert other.cell_index.shape == (500, 500)
+    assert len(list(tmp_path.iterdir())) == 2
+
+
+def test_render_mask(grid, renderer):
+    mask = np.zeros(grid[0].shape, dtype=bool)
+    mask[10:20, 30:60] = True
+    rgba = renderer.render_mask(mask, color=(0, 255, 0, 255))
+    assert rgba.shape == renderer.size + (4, )
+    # away from the overlay, exactly the pixels of the masked cells have the mask colour
+    clear = renderer.render()[..., 3] == 0
+    masked = np.append(mask.ravel(), False)[renderer.cell_index]
+    assert masked[clear].any()
+    assert (rgba[clear & masked] == (0, 255, 0, 255)).all()
+    assert (rgba[clear & ~masked] == 0).all()
+    np.testing.assert_array_equal(renderer.pixels_to_grid(masked), mask)
@@ -0,0 +1,34 @@
+import os
+import numpy as np
+import h5py
+
+from teclab import utils, repack
+from conftest import write_month_file
+
+
+def test_repack_round_trip(tmp_path):
+    src_dir, dst_dir = str(tmp_path / 'src'), str(tmp_path / 'dst')
+    os.makedirs(src_dir)
+    fn = write_month_file(src_dir, 2012, 6, shape=(20, 37), n_maps=30)
+    write_month_file(src_dir, 2012, 7, shape=(20, 37), n_maps=10)
+    labels = np.random.default_rng(0).random((20, 37)) > .7
+    utils.update_h5({'h5_file': fn, 'index': 4}, labels)
+
+    assert repack.main([src_dir, dst_dir, '--jobs', '2', '--samples', '5']) == 0
+    dst = os.path.join(dst_dir, '2012_06_tec.h5')
+    with h5py.File(dst, 'r') as f:
+        assert f['labels'].dtype == np.uint8 and f['labels'].shape == (20, 5, 30)
+        assert f['tec'].chunks == (20, 37, 1)
+
+    for index in [0, 4, 29]:
+        a = utils.open_map({'h5_file': fn, 'index': index})
+        b = utils.open_map({'h5_file': dst, 'index': index})
+        np.testing.assert_array_equal(a[0], b[0])
+        np.testing.assert_array_equal(a[1], b[1])
+        assert a[2] == b[2]
+    np.testing.assert_array_equal(utils.read_maps(dst, 2, 6)[1][:, :, 2], labels)
+
+    new_labels = ~labels
+    utils.write_labels(dst, {7: new_labels})
+    np.testing.assert_array_equal(utils.open_map({'h5_file': dst, 'index': 7})[1], new_labels)
+    assert not repack.verify_file(fn, dst)
@@ -0,0 +1,47 @@
+import datetime
+import numpy as np
+import pytest
+
+from teclab import sampling
+from teclab.dataset_index import build_map_tree
+
+
+@pytest.fixture
+def map_tree():
+    times = np.arange(np.datetime64('2013-01-30T00'), np.datetime64('2013-02-02T00'), np.timedelta64(1, 'h'))
+    return build_map_tree(times.astype('datetime64[s]').astype(float))
+
+
+def test_sampler_status(map_tree):
+    done = [(2013, 1, i) for i in range(48)]
+    sampler = sampling.MapSampler(map_tree, done, [(2013, 2, 0)], seed=0)
+    assert len(sampler) == 72
+    assert sampler.counts() == {'unlabeled': 23, 'done': 48, 'unsure': 1}
+    for _ in range(50):
+        year, month, index, dt = sampler.sample()
+        assert (year, month) == (2013, 2) and index > 0
+        assert dt == datetime.datetime(2013, 2, 1, index)
+    assert sampler.sample(sampling.RevisitUnsure())[:3] == (2013, 2, 0)
+
+    for index in range(1, 24):
+        sampler.set_status(2013, 2, index, sampling.DONE)
+    with pytest.raises(LookupError):
+        sampler.sample()
+    sampler.set_status(2013, 1, 3, sampling.UNLABELED)
+    assert sampler.sample(sampling.StratifiedByMonth())[:3] == (2013, 1, 3)
+
+
+def test_stratified_and_date_range(map_tree):
+    sampler = sampling.MapSampler(map_tree, seed=0)
+    months = [sampler.sample(sampling.StratifiedByMonth())[1] for _ in range(400)]
+    assert 150 < months.count(1) < 250
+
+    strategy = sampling.DateRange('2013-01-31T06', '2013-01-31T09')
+    draws = {sampler.sample(strategy)[2] for _ in range(100)}
+    assert draws == {30, 31, 32}
+    sampler.set_status(2013, 1, 30, sampling.DONE)
+    sampler.set_status(2013, 1, 32, sampling.UNSURE)
+    assert sampler.sample(strategy)[:3] == (2013, 1, 31)
+    sampler.set_status(2013, 1, 31, sampling.DONE)
+    with pytest.raises(LookupError):
+        sampler.sample(strategy)
@@ -0,0 +1,103 @@
+import os
+import threading
+import numpy as np
+import pytest
+
+from teclab import sampling, utils
+from teclab.cache import MapCache
+from teclab.sequential import MapWindow, SequentialNavigator
+from teclab.synthetic import generate_dataset, month_range
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    data_dir = str(tmp_path)
+    generate_dataset(data_dir, month_range(2012, 6, 3), shape=(20, 36), n_maps=10)
+    sampler = sampling.MapSampler(utils.get_map_tree(data_dir), done_list=[(2012, 6, 0), (2012, 6, 1)], seed=0)
+    return os.path.join(data_dir, "{year:04d}_{month:02d}_tec.h5"), sampler
+
+
+def test_window_reads_ahead_per_month(dataset):
+    pattern, sampler = dataset
+    cache = MapCache(neighbours=0)
+    window = MapWindow(cache, pattern, sampler, behind=2, ahead=8)
+    window.advance(0)
+    # maps 0-8 of the first month
+    assert window.n_reads == 1 and len(cache) == 9
+    for flat in range(1, 5):
+        window.advance(flat)
+    assert window.n_reads == 1
+    # crossing into the second month: one read for the rest of June and one for July
+    window.advance(5)
+    assert window.n_reads == 3
+    fn_6, fn_7 = pattern.format(year=2012, month=6), pattern.format(year=2012, month=7)
+    assert (fn_7, 3) in cache and (fn_6, 3) in cache and (fn_6, 2) not in cache
+    # jumping backwards reloads around the cursor without dropping what is still in the window
+    window.advance(1)
+    assert (fn_6, 0) in cache and (fn_6, 8) in cache and (fn_7, 0) not in cache
+    assert cache.misses == 0
+
+
+def test_navigator_steps_in_time_order(dataset):
+    pattern, sampler = dataset
+    cache = MapCache(neighbours=0)
+    window = MapWindow(cache, pattern, sampler, behind=2, ahead=8)
+    threads = set()
+
+    def load(year, month, index, datetime):
+        threads.add(threading.current_thread())
+        return cache.get(pattern.format(year=year, month=month), index)
+
+    navigator = SequentialNavigator(sampler, load, window, depth=3)
+    navigator.seek()
+    key, entry = navigator.step(0)
+    assert tuple(key[:3]) == (2012, 6, 2)
+    keys = [tuple(int(k) for k in navigator.step(1)[0][:3]) for _ in range(10)]
+    assert keys == [(2012, 6, i) for i in range(3, 10)] + [(2012, 7, i) for i in range(3)]
+    assert cache.misses == 0
+    assert threading.main_thread() not in threads
+    key, (tec, _, _) = navigator.step(-1)
+    assert tuple(key[:3]) == (2012, 7, 1)
+    np.testing.assert_array_equal(tec, utils.open_map({'h5_file': pattern.format(year=2012, month=7), 'index': 1})[0])
+
+    navigator.seek(2012, 8, 9)
+    with pytest.raises(LookupError):
+        navigator.step(1)
+    navigator.seek(2012, 6, 0)
+    with pytest.raises(LookupError):
+        navigator.step(-1)
+    navigator.shutdown()
+
+
+def test_navigator_invalidate(dataset):
+    pattern, sampler = dataset
+    versions = {}
+
+    def load(year, month, index, datetime):
+        versions[index] = versions.get(index, 0) + 1
+        return index, versions[index]
+
+    navigator = SequentialNavigator(sampler, load, depth=2)
+    navigator.seek(2012, 6, 5)
+    assert navigator.step(0)[1] == (5, 1)
+    assert navigator.step(1)[1] == (6, 1)
+    navigator.invalidate(2012, 6, 5)
+    assert navigator.step(-1)[1] == (5, 2)
+    navigator.shutdown()
+
+
+def test_navigator_load_errors(dataset):
+    pattern, sampler = dataset
+
+    def load(year, month, index, datetime):
+        if (month, index) == (6, 6):
+            raise OSError("corrupt map")
+        return index
+
+    navigator = SequentialNavigator(sampler, load, depth=2)
+    navigator.seek(2012, 6, 5)
+    assert navigator.step(0)[1] == 5
+    with pytest.raises(RuntimeError, match="corrupt map"):
+        navigator.step(1)
+    assert navigator.step(1)[1] == 7
+    navigator.shutdown()
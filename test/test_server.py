@@ -0,0 +1,157 @@
+import os
+import threading
+import multiprocessing
+import numpy as np
+import pytest
+
+from teclab import config, server, backend, prefetch, utils, sampling
+from teclab.synthetic import generate_dataset, month_range
+
+AUTHKEY = b'test'
+
+
+@pytest.fixture
+def service(tmp_path):
+    data_dir = str(tmp_path / 'tec_data')
+    generate_dataset(data_dir, month_range(2012, 6, 2), shape=(20, 36), n_maps=12)
+    cfg = config.Config(data_dir)
+    service = server.LabelService(cfg, lease_timeout=60)
+    label_server = server.LabelServer(service, authkey=AUTHKEY).start()
+    yield service, label_server.address
+    label_server.close()
+    cfg.close()
+
+
+def test_simulated_annotators(service):
+    service, address = service
+    n_clients = 4
+    leased = []
+    saved = {}
+    lock = threading.Lock()
+    errors = []
+
+    def annotate(name):
+        client = server.LabelClient(address, AUTHKEY, annotator=name)
+        try:
+            while True:
+                try:
+                    year, month, index, _ = client.lease()
+                except LookupError:
+                    break
+                key = (int(year), int(month), int(index))
+                with lock:
+                    leased.append(key)
+                tec, _ = client.get_map(*key)
+                labels = np.isfinite(tec) & (tec < 10)
+                client.save({'year': year, 'month': month, 'index': index, 'unsure': False}, labels)
+                with lock:
+                    saved[key] = (name, labels)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            client.close()
+
+    threads = [threading.Thread(target=annotate, args=(f"annotator{i}", )) for i in range(n_clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout=60)
+    assert not errors
+    # every map was handed out exactly once
+    assert len(leased) == len(set(leased)) == 24
+    assert service.counts() == {'unlabeled': 0, 'done': 24, 'unsure': 0, 'leased': 0}
+    service.config.label_writer.flush()
+    store = service.config.progress_store
+    assert sorted(store.done_list()) == sorted(saved)
+    annotators = dict(store.conn.execute("SELECT year || '-' || month || '-' || idx, annotator FROM journal"))
+    assert set(annotators.values()) <= {f"annotator{i}" for i in range(n_clients)}
+    for (year, month, index), (name, labels) in saved.items():
+        fn = service.config.data_file_name.format(year=year, month=month)
+        np.testing.assert_array_equal(utils.open_map({'h5_file': fn, 'index': index})[1], labels)
+        assert annotators[f"{year}-{month}-{index}"] == name
+
+
+def test_leases(service):
+    service, address = service
+    a = server.LabelClient(address, AUTHKEY, annotator='a')
+    b = server.LabelClient(address, AUTHKEY, annotator='b')
+    year, month, index, _ = a.lease()
+    current_map = {'year': year, 'month': month, 'index': index, 'unsure': True}
+    with pytest.raises(PermissionError):
+        b.save(current_map, np.zeros((20, 36), dtype=bool))
+    assert service.counts()['leased'] == 1
+    # leases of a disconnected client are released
+    a.close()
+    for _ in range(100):
+        if service.counts()['leased'] == 0:
+            break
+        threading.Event().wait(.01)
+    assert service.counts()['leased'] == 0
+    b.save(current_map, np.zeros((20, 36), dtype=bool))
+    assert service.config.map_sampler.get_status(year, month, index) == sampling.UNSURE
+
+    # expired leases are handed out again, otherwise the 23 unlabeled maps run out
+    service.lease_timeout = -1
+    leased = {tuple(b.lease()[:3]) for _ in range(30)}
+    assert (year, month, index) not in leased
+    service.lease_timeout = 60
+    b.close()
+    b = server.LabelClient(address, AUTHKEY, annotator='b')
+    for _ in range(100):
+        if service.counts()['leased'] == 0:
+            break
+        threading.Event().wait(.01)
+    for _ in range(23):
+        b.lease()
+    with pytest.raises(LookupError):
+        b.lease()
+    b.close()
+
+
+def test_remote_backend_prefetch(service):
+    service, address = service
+    remote = backend.RemoteBackend(address, AUTHKEY, annotator='remote')
+    prefetcher = prefetch.Prefetcher(remote.sampler, lambda *key: remote.load(*key[:3]), depth=3)
+    prefetcher.fill()
+    assert service.counts()['leased'] == 3
+    key, (tec_map, labels) = prefetcher.pop()
+    assert tec_map.shape == labels.shape == (20, 36)
+    current_map = {'year': key[0], 'month': key[1], 'index': key[2], 'unsure': False}
+    remote.save(current_map, np.ones((20, 36), dtype=bool)).result()
+    assert remote.sampler.get_status(*key[:3]) == sampling.DONE
+    assert service.counts()['done'] == 1
+    prefetcher.shutdown()
+    assert service.counts()['leased'] == 0
+    remote.close()
+
+
+def test_save_skips_batch_delay(service):
+    service, address = service
+    service.config.label_writer.batch_delay = 60
+    client = server.LabelClient(address, AUTHKEY, annotator='a')
+    key = client.lease()
+    current_map = {'year': key[0], 'month': key[1], 'index': key[2], 'unsure': False}
+    saving = threading.Thread(target=client.save, args=(current_map, np.ones((20, 36), dtype=bool)))
+    saving.start()
+    saving.join(timeout=10)
+    assert not saving.is_alive()
+    assert service.counts()['done'] == 1
+    client.close()
+
+
+def test_authkey(tmp_path, monkeypatch, service):
+    service, address = service
+    monkeypatch.delenv(server.AUTHKEY_ENV, raising=False)
+    key_file = str(tmp_path / 'server.key')
+    with pytest.raises(FileNotFoundError):
+        server.load_authkey(key_file)
+    key = server.load_authkey(key_file, create=True)
+    assert len(key) == 64 and oct(os.stat(key_file).st_mode & 0o777) == oct(0o600)
+    assert server.load_authkey(key_file) == server.load_authkey(key_file, create=True) == key
+    monkeypatch.setenv(server.AUTHKEY_ENV, 'from-env')
+    assert server.load_authkey(key_file) == b'from-env'
+
+    with pytest.raises(multiprocessing.AuthenticationError):
+        server.LabelClient(address, b'wrong')
+    with pytest.raises(ValueError):
+        server.LabelServer(service, ('0.0.0.0', 0), authkey=b'short')
@@ -0,0 +1,79 @@
+import os
+import numpy as np
+import h5py
+
+from teclab import sampling, stats, utils
+from teclab.dataset_index import build_map_tree
+from teclab.synthetic import generate_dataset, month_range
+
+
+def test_map_stats():
+    mlat_vals = np.array([35., 45., 55., 65.])
+    tec = np.full((4, 10, 3), np.nan)
+    tec[:, :, 0] = np.arange(40).reshape(4, 10)
+    tec[:2, :, 1] = 5
+    result = stats.map_stats(tec, mlat_vals)
+    assert result['percentiles'].shape == (3, len(stats.PERCENTILES))
+    np.testing.assert_allclose(result['percentiles'][0, stats.PERCENTILES.index(50)], 19.5)
+    np.testing.assert_allclose(result['nan_fraction'], [0, .5, 1])
+    np.testing.assert_allclose(result['band_median'][0, :3], [4.5, 14.5, 24.5])
+    assert np.isnan(result['band_median'][1, 2]) and np.isnan(result['percentiles'][2]).all()
+
+
+def test_compute_stats(tmp_path):
+    data_dir = str(tmp_path)
+    info = generate_dataset(data_dir, month_range(2012, 6, 3), shape=(20, 36), n_maps=10)
+    with h5py.File(info['files'][1], 'r+') as f:
+        tec = f['tec'][()]
+        tec[:, :, 4] = np.nan
+        tec[:15, :, 5] = np.nan
+        f['tec'][()] = tec
+    mlat_vals = np.linspace(30, 89, 20)
+    stats_file = os.path.join(data_dir, stats.STATS_FILE_NAME)
+    assert len(stats.compute_stats(data_dir, mlat_vals, stats_file, max_workers=2)) == 3
+    # only files whose TEC changed are computed again, saving labels doesn't count
+    assert stats.compute_stats(data_dir, mlat_vals, stats_file) == []
+    utils.write_labels(info['files'][2], {0: np.ones((20, 36), dtype=bool)})
+    assert stats.compute_stats(data_dir, mlat_vals, stats_file) == []
+    with h5py.File(stats_file, 'r') as f:
+        assert f[os.path.basename(info['files'][2])].attrs['mtime'] == os.stat(info['files'][2]).st_mtime_ns
+    with h5py.File(info['files'][2], 'r+') as f:
+        f['tec'][:, :, 0] = 1
+    assert stats.compute_stats(data_dir, mlat_vals, stats_file) == [os.path.basename(info['files'][2])]
+
+    map_stats = stats.load_stats(stats_file)
+    vmin, vmax = map_stats.color_range(2012, 6, 3)
+    tec = utils.open_map({'h5_file': info['files'][0], 'index': 3})[0]
+    np.testing.assert_allclose([vmin, vmax], np.nanpercentile(tec, [2, 98]))
+    assert map_stats.color_range(2012, 7, 4) is None
+    assert map_stats.color_range(2013, 1, 0) is None
+
+    sampler = sampling.MapSampler(utils.get_map_tree(data_dir), seed=0)
+    nan_fraction = map_stats.nan_fraction(sampler)
+    assert nan_fraction.shape == (30, )
+    assert nan_fraction[sampler.flat_index(2012, 7, 4)] == 1
+    assert nan_fraction[sampler.flat_index(2012, 7, 5)] >= .75
+    assert stats.load_stats(str(tmp_path / 'missing.h5')) is None
+
+
+def test_sampler_excluded():
+    # 48 maps in January, 24 in February
+    times = np.arange(np.datetime64('2013-01-30T00'), np.datetime64('2013-02-02T00'), np.timedelta64(1, 'h'))
+    sampler = sampling.MapSampler(build_map_tree(times.astype('datetime64[s]').astype(float)), done_list=[(2013, 1, 0)],
+                                  seed=0)
+    excluded = np.zeros(len(sampler), dtype=bool)
+    excluded[:60] = True
+    sampler.set_excluded(excluded)
+    assert len(sampler.unlabeled) == 12
+    keys = {tuple(int(k) for k in sampler.sample()[:3]) for _ in range(50)}
+    assert keys <= {(2013, 2, i) for i in range(12, 24)}
+    strategy = sampling.DateRange('2013-01-30T00', '2013-02-02T00')
+    keys = {tuple(int(k) for k in sampler.sample(strategy)[:3]) for _ in range(20)}
+    assert keys <= {(2013, 2, i) for i in range(12, 24)}
+    # excluded maps keep their status and come back once the filter is relaxed
+    sampler.set_status(2013, 1, 3, sampling.UNSURE)
+    sampler.set_status(2013, 1, 3, sampling.UNLABELED)
+    assert len(sampler.unlabeled) == 12
+    sampler.set_excluded(np.zeros(len(sampler), dtype=bool))
+    assert len(sampler.unlabeled) == 71
+    assert sampler.get_status(2013, 1, 0) == sampling.DONE
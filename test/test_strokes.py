@@ -0,0 +1,117 @@
+import os
+import numpy as np
+
+from teclab import strokes
+
+
+def test_disk_matches_brush_kernel():
+    size = 15
+    c = int((size - 1) / 2)
+    y, x = np.mgrid[-c:size - c, -c:size - c]
+    kernel = x * x + y * y <= (size - 1) / 2 * (size - 1) / 2
+    image = np.zeros((100, 100))
+    region = strokes.draw_segment(image, (40, 60), (40, 60), (size - 1) / 2, 1)
+    assert region == (slice(33, 48), slice(53, 68))
+    np.testing.assert_array_equal(image[33:48, 53:68], kernel.T)
+    assert image.sum() == kernel.sum()
+
+
+def test_segment_has_no_gaps():
+    for p1 in [(90, 10), (10, 90), (90, 90), (73, 18)]:
+        image = np.zeros((100, 100, 3))
+        strokes.draw_segment(image, (10, 10), p1, 2, [255, 0, 0])
+        assert (image[..., 1:] == 0).all()
+        t = np.linspace(0, 1, 500)
+        xs = np.round(10 + t * (p1[0] - 10)).astype(int)
+        ys = np.round(10 + t * (p1[1] - 10)).astype(int)
+        assert (image[xs, ys, 0] == 255).all()
+
+
+def test_clipping_and_polyline():
+    image = np.ones((50, 50))
+    assert strokes.draw_segment(image, (-20, -20), (-10, -10), 3, 0) is None
+    strokes.draw_segment(image, (-5, 25), (5, 25), 2, 0)
+    assert image[:8, 23:28].min() == 0 and image[10:].min() == 1
+    image = np.zeros((50, 50))
+    strokes.draw_polyline(image, [(10, 10)], 1, 1)
+    assert image.sum() == 5
+    strokes.draw_polyline(image, [(10, 10), (10, 40), (40, 40)], 0, 1)
+    assert image[10, 10:41].all() and image[10:41, 40].all()
+
+
+def test_journal_undo_redo_clear():
+    rng = np.random.default_rng(0)
+    base = rng.random((60, 60)) > .9
+    journal = strokes.StrokeJournal(base)
+    live = base.copy()
+    states = [live.copy()]
+    for mode in [strokes.PAINT, strokes.ERASE, strokes.PAINT]:
+        points = [tuple(p) for p in rng.integers(0, 60, (4, 2))]
+        strokes.draw_polyline(live, points, 3, mode == strokes.PAINT)
+        journal.record(mode, 3, points)
+        states.append(live.copy())
+    np.testing.assert_array_equal(journal.render(), states[3])
+    np.testing.assert_array_equal(journal.undo(), states[2])
+    np.testing.assert_array_equal(journal.undo(), states[1])
+    np.testing.assert_array_equal(journal.redo(), states[2])
+    journal.record(strokes.CLEAR, 0, [])
+    assert not journal.render().any() and journal.redo() is None
+    np.testing.assert_array_equal(journal.undo(), states[2])
+    assert journal.undo() is not None and journal.undo() is not None and journal.undo() is None
+
+    # the oldest strokes are folded into the base
+    journal = strokes.StrokeJournal(np.zeros((60, 60), dtype=bool), max_strokes=2)
+    for x in [10, 20, 30]:
+        journal.record(strokes.PAINT, 2, [(x, 10)])
+    assert len(journal) == 2 and journal.base[10, 10] and not journal.base[20, 10]
+    journal.undo()
+    journal.undo()
+    assert journal.undo() is None
+    np.testing.assert_array_equal(journal.render(), journal.base)
+
+
+def test_journal_recovery(tmp_path):
+    path = str(tmp_path / 'map.jsonl')
+    base = np.zeros((40, 50), dtype=bool)
+    base[5:10, 5:10] = True
+    journal = strokes.StrokeJournal(base, path=path)
+    journal.record(strokes.PAINT, 2, [(20, 20), (30, 25)])
+    journal.record(strokes.ERASE, 3, [(7, 7)])
+    journal.record(strokes.PAINT, 1, [(35, 40)])
+    journal.undo()
+    expected = journal.render()
+    # crash: the file is left behind with a partly written last line
+    journal._file.close()
+    with open(path, 'a') as f:
+        f.write('{"op":"stro')
+    recovered = strokes.StrokeJournal.recover(path)
+    np.testing.assert_array_equal(recovered.render(), expected)
+    np.testing.assert_array_equal(recovered.redo(), expected | _disk(35, 40))
+    recovered.close()
+    recovered = strokes.StrokeJournal.recover(path)
+    np.testing.assert_array_equal(recovered.render(), expected | _disk(35, 40))
+    recovered.close()
+
+    journal = strokes.StrokeJournal(base, path=path)
+    journal.record(strokes.PAINT, 2, [(20, 20)])
+    journal.mark_saved()
+    journal.close()
+    assert not os.path.exists(path)
+
+    # journals with nothing to replay, or which started from another drawing, aren't recovered
+    journal = strokes.StrokeJournal(base, path=path)
+    journal._file.close()
+    assert strokes.StrokeJournal.recover(path) is None
+    journal = strokes.StrokeJournal(base, path=path)
+    journal.record(strokes.PAINT, 2, [(20, 20)])
+    journal._file.close()
+    assert strokes.StrokeJournal.recover(path, base=~base) is None
+    recovered = strokes.StrokeJournal.recover(path, base=base)
+    assert len(recovered) == 1
+    recovered.close()
+
+
+def _disk(x, y, shape=(40, 50), radius=1):
+    mask = np.zeros(shape, dtype=bool)
+    strokes.draw_polyline(mask, [(x, y)], radius, True)
+    return mask
@@ -1,7 +1,47 @@
-from teclab import config
+import os
+import datetime
+import numpy as np
+import h5py
 
+from teclab import utils, check
 
-def test_map_tree():
+
+def test_map_tree(synthetic_config):
     """Verify that the map tree matches the preprocessed dataset and the downloaded dataset perfectly
     """
-    config.map_tree
+    from teclab import config
+    _, info = synthetic_config
+    map_tree = config.map_tree
+    assert sorted((int(y), m) for y in map_tree for m in map_tree[y]) == [(2012, 11), (2012, 12), (2013, 1)]
+    for fn in info['files']:
+        year, month = (int(s) for s in os.path.basename(fn).split('_')[:2])
+        with h5py.File(fn, 'r') as f:
+            start_time = f['start_time'][()]
+        entry = map_tree[year][month]
+        np.testing.assert_array_equal(entry['index'], np.arange(start_time.shape[0]))
+        expected = start_time.astype('datetime64[s]').astype(datetime.datetime)
+        assert list(entry['datetime']) == list(expected)
+    assert config.theta_grid.shape == config.radius_grid.shape == (30, 45)
+    assert sorted(config.done_list) == sorted(tuple(k) for k in info['done_list'])
+    report = check.run(config.get_config())
+    assert report['errors'] == [] and report['warnings'] == []
+
+
+def test_cross_section_profiles():
+    rng = np.random.default_rng(0)
+    tec = rng.random((30, 40)) * 20
+    tec[rng.random(tec.shape) < .3] = np.nan
+    tec[:, 10:20] = np.nan
+    profiles = utils.cross_section_profiles(tec, avg_width=7, median_width=3)
+    assert profiles.shape == tec.shape
+
+    padded = np.pad(tec, ((0, 0), (3, 3)), mode='edge')
+    for t_ind in [0, 5, 15, 39]:
+        with np.errstate(invalid='ignore'):
+            vals = np.array([np.nan if np.isnan(row).all() else np.nanmean(row) for row in padded[:, t_ind:t_ind + 7]])
+        vals = np.pad(vals, (1, 1), mode='edge')
+        windows = np.column_stack([vals[i:vals.shape[0] - 2 + i] for i in range(3)])
+        expected = np.array([np.nan if np.isnan(w).all() else np.nanmedian(w) for w in windows])
+        np.testing.assert_allclose(profiles[:, t_ind], expected)
+
+    np.testing.assert_allclose(utils.cross_section_profiles(tec, avg_width=1, median_width=1), tec)
@@ -0,0 +1,112 @@
+import threading
+import numpy as np
+import h5py
+
+from teclab import utils
+from teclab.writer import LabelWriter
+
+
+def test_update_h5_writes_slice(month_file):
+    labels = np.zeros((20, 36), dtype=bool)
+    labels[5:8, 10:20] = True
+    utils.update_h5({'h5_file': month_file, 'index': 3}, labels)
+    with h5py.File(month_file, 'r') as f:
+        saved = f['labels'][()]
+    np.testing.assert_array_equal(saved[:, :, 3], labels)
+    assert saved.sum() == labels.sum()
+
+
+def test_writer_merges_and_flushes(month_file):
+    writer = LabelWriter(batch_delay=60)
+    first = np.zeros((20, 36), dtype=bool)
+    first[0] = True
+    second = np.zeros((20, 36), dtype=bool)
+    second[1] = True
+    f1 = writer.submit({'h5_file': month_file, 'index': 2}, first)
+    f2 = writer.submit({'h5_file': month_file, 'index': 2}, second)
+    f3 = writer.submit({'h5_file': month_file, 'index': 7}, first)
+    assert writer.n_pending == 2
+    np.testing.assert_array_equal(writer.pending_labels(month_file, 2), second)
+    assert writer.flush(timeout=10)
+    assert all(f.done() and f.exception() is None for f in (f1, f2, f3))
+    writer.close()
+
+    with h5py.File(month_file, 'r') as f:
+        saved = f['labels'][()]
+    np.testing.assert_array_equal(saved[:, :, 2], second)
+    np.testing.assert_array_equal(saved[:, :, 7], first)
+    assert writer.pending_labels(month_file, 2) is None
+
+
+def test_writer_close_flushes(month_file):
+    writer = LabelWriter(batch_delay=60)
+    writer.submit({'h5_file': month_file, 'index': 0}, np.ones((20, 36), dtype=bool))
+    writer.close()
+    with h5py.File(month_file, 'r') as f:
+        assert f['labels'][:, :, 0].all()
+
+
+def test_writer_alongside_readers(month_file):
+    stop = threading.Event()
+    errors = []
+
+    def read():
+        try:
+            while not stop.is_set():
+                utils.open_map({'h5_file': month_file, 'index': 5})
+        except Exception as e:
+            errors.append(e)
+
+    readers = [threading.Thread(target=read) for _ in range(2)]
+    for reader in readers:
+        reader.start()
+    writer = LabelWriter(batch_delay=0)
+    try:
+        futures = [writer.submit({'h5_file': month_file, 'index': i}, np.ones((20, 36), dtype=bool))
+                   for i in range(20)]
+        assert all(f.exception(timeout=10) is None for f in futures)
+    finally:
+        writer.close()
+        stop.set()
+        for reader in readers:
+            reader.join()
+    assert errors == []
+
+
+def test_writer_keeps_failed_saves(month_file, monkeypatch):
+    write_labels = utils.write_labels
+    calls = []
+
+    def failing_write(fn, labels_by_index, **kwargs):
+        calls.append(sorted(labels_by_index))
+        if len(calls) == 1:
+            raise OSError("unable to lock file")
+        return write_labels(fn, labels_by_index, **kwargs)
+
+    monkeypatch.setattr(utils, 'write_labels', failing_write)
+    writer = LabelWriter(batch_delay=0, retry_delay=60)
+    labels = np.ones((20, 36), dtype=bool)
+    future = writer.submit({'h5_file': month_file, 'index': 4}, labels)
+    assert isinstance(future.exception(timeout=10), OSError)
+    # the labels stay visible to readers until they are written
+    assert writer.n_failed == 1
+    np.testing.assert_array_equal(writer.pending_labels(month_file, 4), labels)
+    assert writer.generation(month_file) == 0
+    assert writer.flush(timeout=10)
+    assert calls == [[4], [4]] and writer.n_failed == 0 and writer.pending_labels(month_file, 4) is None
+    assert writer.generation(month_file) == 1
+    writer.close()
+    with h5py.File(month_file, 'r') as f:
+        assert f['labels'][:, :, 4].all()
+
+
+def test_writer_skips_slices_equal_to_the_file(month_file):
+    writer = LabelWriter(batch_delay=0)
+    labels = np.zeros((20, 36), dtype=bool)
+    labels[2:5] = True
+    writer.submit({'h5_file': month_file, 'index': 3}, labels).result(timeout=10)
+    assert writer.generation(month_file) == 1
+    writer.submit({'h5_file': month_file, 'index': 3}, labels).result(timeout=10)
+    assert writer.generation(month_file) == 1
+    assert utils.write_labels(month_file, {3: labels, 4: labels}, skip_unchanged=True) == 1
+    writer.close()